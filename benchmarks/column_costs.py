@@ -0,0 +1,120 @@
+"""
+Calculation cost of every TAXSIM output column, as a regression benchmark.
+
+Profiles a run on synthetic inputs and attributes the calculate time to the
+output columns, per state. Save the result as a baseline, then rerun against
+it after upgrading policyengine-us to flag the columns that got slower.
+
+    python benchmarks/column_costs.py --rows 200 --output column_costs.json
+    python benchmarks/column_costs.py --rows 200 --baseline column_costs.json
+
+By default the records are simulated once before the measured run, so the
+one-off parameter loading of every (year, state) is not charged to whichever
+column happens to be calculated first.
+"""
+
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+import click
+
+from policyengine_taxsim.core.cost_report import (
+    DEFAULT_REGRESSION_THRESHOLD,
+    MIN_COMPARED_SECONDS,
+    column_costs,
+    find_regressions,
+    format_column_costs,
+    total_column_costs,
+)
+
+
+def measure_column_costs(rows, seed, batch_size, warm_up):
+    """Profile rows synthetic records and return their column costs."""
+    from policyengine_taxsim import export_households, generate_household
+    from policyengine_taxsim.core.profiling import profiler
+    from policyengine_taxsim.core.run_config import RunConfig
+    from synthetic import generate_synthetic_inputs
+
+    df = generate_synthetic_inputs(rows, seed=seed)
+    taxsim_inputs = [row.to_dict() for _, row in df.iterrows()]
+    situations = [generate_household(each) for each in taxsim_inputs]
+    config = RunConfig(batch_size=batch_size)
+
+    if warm_up:
+        export_households(taxsim_inputs, situations, config)
+
+    profiler.start()
+    export_households(taxsim_inputs, situations, config)
+    profiler.stop()
+    return column_costs(profiler.report())
+
+
+@click.command()
+@click.option("--rows", type=click.IntRange(min=1), default=200, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option(
+    "--warm-up/--no-warm-up",
+    default=True,
+    show_default=True,
+    help="Simulate the records once before the measured run",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the column costs to this JSON file, e.g. as a new baseline",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Column costs JSON of an earlier run to compare against",
+)
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=1.0),
+    default=DEFAULT_REGRESSION_THRESHOLD,
+    show_default=True,
+    help="Flag columns slower than this multiple of the baseline",
+)
+def main(rows, seed, batch_size, warm_up, output, baseline, threshold):
+    costs = measure_column_costs(rows, seed, batch_size, warm_up)
+    click.echo(format_column_costs(costs))
+
+    if output:
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rows": rows,
+            "seed": seed,
+            "warm_up": warm_up,
+            "columns": total_column_costs(costs),
+            "states": costs,
+        }
+        with open(output, "w") as f:
+            json.dump(record, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            baseline_columns = json.load(f)["columns"]
+        regressions = find_regressions(
+            baseline_columns, total_column_costs(costs), threshold, MIN_COMPARED_SECONDS
+        )
+        click.echo("")
+        if not regressions:
+            click.echo(f"No column is more than {threshold}x slower than the baseline")
+            return
+        for column, before, after in regressions:
+            ratio = after / max(before, 1e-9)
+            click.echo(
+                f"REGRESSION {column}: {before:.3f}s -> {after:.3f}s ({ratio:.1f}x)"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
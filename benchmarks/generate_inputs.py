@@ -0,0 +1,32 @@
+"""
+Write synthetic TAXSIM-35 input records to a CSV file.
+
+    python benchmarks/generate_inputs.py --rows 10000 --seed 0 -o synthetic_10k.csv
+"""
+
+import click
+
+from synthetic import (
+    generate_synthetic_inputs,
+    DEFAULT_MAX_DEPENDENTS,
+)
+
+
+@click.command()
+@click.option("--rows", type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--max-dependents",
+    type=click.IntRange(min=0),
+    default=DEFAULT_MAX_DEPENDENTS,
+    show_default=True,
+)
+@click.option("--output", "-o", type=click.Path(dir_okay=False), required=True)
+def main(rows, seed, max_dependents, output):
+    df = generate_synthetic_inputs(rows, seed=seed, max_dependents=max_dependents)
+    df.to_csv(output, index=False)
+    click.echo(f"Wrote {rows} records to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Speedup of reusing simulations over building one per record.
+
+Simulates synthetic records one per simulation (batch size 1), once building
+a fresh simulation for every record and once taking the simulations from a
+SimulationPool, which resets the inputs of a kept simulation of the same
+household shape, year and state. Both runs must give the same outputs.
+
+    python benchmarks/simulation_reuse.py --rows 200
+    python benchmarks/simulation_reuse.py --rows 500 --state 5 --state 33 --state 44
+
+The records are spread over the given states, so the pool hits more often
+with fewer states. Every (year, state) is simulated once before the measured
+runs, so neither run is charged for loading the parameters.
+"""
+
+import time
+
+import click
+
+
+def run_export(taxsim_inputs, households, pool):
+    """Simulate every record with a batch size of 1 and time it."""
+    from policyengine_taxsim.core.batch import export_household_arrays
+    from policyengine_taxsim.core.run_config import RunConfig
+
+    start = time.perf_counter()
+    taxsim_outputs = export_household_arrays(
+        taxsim_inputs, households, RunConfig(batch_size=1), pool=pool
+    )
+    return taxsim_outputs, time.perf_counter() - start
+
+
+def run_benchmark(rows, seed, year, states):
+    from policyengine_taxsim.core.batch import export_household_arrays
+    from policyengine_taxsim.core.household_arrays import (
+        map_households,
+        records_to_columns,
+    )
+    from policyengine_taxsim.core.input_mapper import set_taxsim_defaults
+    from policyengine_taxsim.core.run_config import RunConfig
+    from policyengine_taxsim.core.simulation import SimulationPool
+    from synthetic import generate_synthetic_inputs
+
+    df = generate_synthetic_inputs(rows, seed=seed, years=(year,))
+    df["state"] = [states[position % len(states)] for position in range(rows)]
+    taxsim_inputs = [set_taxsim_defaults(row.to_dict()) for _, row in df.iterrows()]
+    households = map_households(records_to_columns(taxsim_inputs))
+
+    # Load the parameters of every (year, state) outside the measured runs
+    warm_up = [positions[0] for positions in households.buckets().values()]
+    export_household_arrays(
+        [taxsim_inputs[position] for position in warm_up],
+        households.select(warm_up),
+        RunConfig(),
+    )
+
+    fresh_outputs, fresh_seconds = run_export(
+        taxsim_inputs, households, SimulationPool(max_simulations=0)
+    )
+    pool = SimulationPool()
+    reused_outputs, reused_seconds = run_export(taxsim_inputs, households, pool)
+    if reused_outputs != fresh_outputs:
+        raise click.ClickException("Reused simulations gave different outputs")
+
+    return {
+        "rows": rows,
+        "fresh_seconds_per_record": fresh_seconds / rows,
+        "reused_seconds_per_record": reused_seconds / rows,
+        "speedup": fresh_seconds / reused_seconds,
+        "built": pool.built,
+        "reused": pool.reused,
+    }
+
+
+@click.command()
+@click.option("--rows", type=click.IntRange(min=1), default=200, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--year", type=int, default=2023, show_default=True)
+@click.option(
+    "--state",
+    "states",
+    type=int,
+    multiple=True,
+    default=(5, 33),
+    show_default=True,
+    help="TAXSIM state codes to spread the records over, repeatable",
+)
+def main(rows, seed, year, states):
+    result = run_benchmark(rows, seed, year, list(states))
+    click.echo(
+        f"fresh:  {result['fresh_seconds_per_record']:.3f}s per record\n"
+        f"reused: {result['reused_seconds_per_record']:.3f}s per record "
+        f"({result['built']} simulations built, {result['reused']} reused)\n"
+        f"speedup: {result['speedup']:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure the cold start of the policyengine-taxsim CLI.
+
+Runs the CLI's --help and a bare package import in fresh interpreters and
+prints the median wall time of each. With --history, the measurement is
+appended as one JSON line, so cold start can be tracked over time.
+
+    python benchmarks/startup.py --runs 5 --history benchmarks/startup_history.jsonl
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import click
+
+# Cold start budget of `policyengine-taxsim --help`, in seconds
+STARTUP_BUDGET_SECONDS = 2.0
+
+COMMANDS = {
+    "cli_help": [sys.executable, "-m", "policyengine_taxsim.cli", "--help"],
+    "package_import": [sys.executable, "-c", "import policyengine_taxsim"],
+}
+
+
+def time_command(command, runs):
+    """Median wall time of a command over several runs, in seconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure_startup(runs=3):
+    """Median cold start time of every measured command, in seconds."""
+    return {name: time_command(command, runs) for name, command in COMMANDS.items()}
+
+
+@click.command()
+@click.option("--runs", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option(
+    "--history",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Append the measurement to this JSON lines file",
+)
+def main(runs, history):
+    timings = measure_startup(runs)
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "budget_seconds": STARTUP_BUDGET_SECONDS,
+        **{name: round(seconds, 3) for name, seconds in timings.items()},
+    }
+    click.echo(json.dumps(record))
+
+    if history:
+        with open(history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    if timings["cli_help"] > STARTUP_BUDGET_SECONDS:
+        raise SystemExit(
+            f"--help took {timings['cli_help']:.2f}s, over the "
+            f"{STARTUP_BUDGET_SECONDS}s startup budget"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Synthetic TAXSIM-35 input records for the benchmarks and tests.
+
+Not part of the installed package; the benchmark scripts import it from this
+directory, and pytest puts the directory on the path for the tests.
+"""
+
+import numpy as np
+
+from policyengine_taxsim.core.mapping_plan import (
+    get_mapping_plan,
+    FULL_TEXT_OUTPUT_TYPE,
+)
+from policyengine_taxsim.core.utils import STATE_MAPPING
+
+SYNTHETIC_YEARS = (2021, 2022, 2023, 2024)
+
+# TAXSIM-35 marital status: single, joint, married separate, dependent taxpayer
+MSTAT_VALUES = (1, 2, 6, 8)
+
+DEFAULT_MAX_DEPENDENTS = 4
+
+# Share of records of each idtl
+DEFAULT_IDTL_WEIGHTS = {0: 0.45, 2: 0.45, FULL_TEXT_OUTPUT_TYPE: 0.1}
+
+# Share of records with a non-zero value of each additional income field
+INCOME_FIELD_PROBABILITY = 0.3
+
+
+def get_income_fields():
+    """TAXSIM input fields routed by the additional tax and income units."""
+    plan = get_mapping_plan()
+    fields = [
+        field for _, _, taxsim_fields in plan.person_routes for field in taxsim_fields
+    ]
+    fields += [field for _, taxsim_fields in plan.tax_unit_routes for field in taxsim_fields]
+    return list(dict.fromkeys(fields))
+
+
+def spread(rng, values, rows):
+    """Every value at least once when rows allow it, in random order."""
+    return rng.permutation(np.resize(np.array(values), rows))
+
+
+def generate_synthetic_inputs(
+    rows,
+    seed=0,
+    years=SYNTHETIC_YEARS,
+    max_dependents=DEFAULT_MAX_DEPENDENTS,
+    idtl_weights=None,
+):
+    """
+    Generate realistic TAXSIM-35 input records.
+
+    States, years and marital statuses are spread evenly, so every state
+    appears once rows reach the number of states. Dependents range from 0 to
+    max_dependents, wages are log-normal, and each additional income field
+    mapped by variable_mappings.yaml is set for a share of the records.
+
+    Args:
+        rows (int): Number of records
+        seed (int): Random seed, the same seed gives the same records
+        years (tuple): Tax years to draw from
+        max_dependents (int): Highest depx
+        idtl_weights (dict): Share of records per idtl, defaults to
+            DEFAULT_IDTL_WEIGHTS
+
+    Returns:
+        pandas.DataFrame: TAXSIM input records
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    idtl_weights = idtl_weights or DEFAULT_IDTL_WEIGHTS
+
+    mstat = spread(rng, MSTAT_VALUES, rows)
+    joint = mstat == 2
+    depx = rng.integers(0, max_dependents + 1, rows)
+
+    columns = {
+        "taxsimid": np.arange(1, rows + 1),
+        "year": spread(rng, years, rows),
+        "state": spread(rng, sorted(STATE_MAPPING), rows),
+        "mstat": mstat,
+        "page": rng.integers(18, 86, rows),
+        "sage": np.where(joint, rng.integers(18, 86, rows), 0),
+        "depx": depx,
+    }
+    for dependent in range(1, max_dependents + 1):
+        columns[f"age{dependent}"] = np.where(
+            depx >= dependent, rng.integers(0, 18, rows), 0
+        )
+
+    columns["pwages"] = np.round(rng.lognormal(10.6, 1.0, rows), 2)
+    columns["swages"] = np.where(
+        joint, np.round(rng.lognormal(10.2, 1.2, rows), 2), 0.0
+    )
+    for field in get_income_fields():
+        present = rng.random(rows) < INCOME_FIELD_PROBABILITY
+        if field == "ssemp":
+            present &= joint
+        elif field == "childcare":
+            present &= depx > 0
+        columns[field] = np.where(
+            present, np.round(rng.lognormal(8.5, 1.3, rows), 2), 0.0
+        )
+
+    output_types = list(idtl_weights)
+    weights = np.array([idtl_weights[idtl] for idtl in output_types], dtype=float)
+    columns["idtl"] = rng.choice(output_types, rows, p=weights / weights.sum())
+
+    return pd.DataFrame(columns)
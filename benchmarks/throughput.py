@@ -0,0 +1,183 @@
+"""
+Throughput benchmark of the TAXSIM emulator on synthetic inputs.
+
+Every input size runs in a fresh Python process, so the import stage and the
+peak resident set size are measured per size. The records are simulated
+through run_records and run_records_parallel, the entry points of the command
+line. Reports records/sec, the latency of every stage and the peak RSS.
+
+    python benchmarks/throughput.py --rows 1000 --rows 10000 --rows 100000
+    python benchmarks/throughput.py --rows 1000 --history benchmarks/throughput_history.jsonl
+"""
+
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import click
+
+DEFAULT_ROWS = (1000, 10000, 100000)
+
+STAGES = ("import", "generate_input", "read_input", "simulate", "format_output")
+
+# Stages that make up the records/sec figure
+PROCESSING_STAGES = ("read_input", "simulate", "format_output")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its children, in MB."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(rows, seed, batch_size, jobs):
+    """Run every stage on rows synthetic records in this process."""
+    timings = {}
+
+    @contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        yield
+        timings[name] = time.perf_counter() - start
+
+    with stage("import"):
+        import pandas as pd
+
+        # The package imports PolicyEngine US lazily, so load it here to keep
+        # its import time out of the processing stages
+        importlib.import_module("policyengine_us")
+        from policyengine_taxsim.cli import format_output
+        from policyengine_taxsim.core.batch import run_records
+        from policyengine_taxsim.core.parallel import run_records_parallel
+        from policyengine_taxsim.core.run_config import RunConfig
+        from synthetic import generate_synthetic_inputs
+
+    with stage("generate_input"):
+        df = generate_synthetic_inputs(rows, seed=seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = Path(directory) / "input.csv"
+        df.to_csv(input_file, index=False)
+        with stage("read_input"):
+            taxsim_inputs = [
+                row.to_dict() for _, row in pd.read_csv(input_file).iterrows()
+            ]
+
+    # Records are mapped to entity arrays inside the runs, so mapping is part
+    # of the simulate stage, as in a command line run
+    config = RunConfig(batch_size=batch_size, jobs=jobs)
+    with stage("simulate"):
+        if jobs == 1:
+            taxsim_outputs = run_records(taxsim_inputs, config)
+        else:
+            taxsim_inputs, taxsim_outputs = run_records_parallel(
+                taxsim_inputs, config
+            )
+
+    with stage("format_output"):
+        format_output(taxsim_inputs, taxsim_outputs)
+
+    processing = sum(timings[name] for name in PROCESSING_STAGES)
+    return {
+        "rows": rows,
+        "records_per_second": rows / processing,
+        "stages": timings,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def format_table(results):
+    header = ["rows", "records/s", *STAGES, "peak RSS MB"]
+    lines = [" ".join(f"{column:>14}" for column in header)]
+    for result in results:
+        peak = result["peak_rss_mb"]
+        values = [
+            f"{result['rows']}",
+            f"{result['records_per_second']:.1f}",
+            *(f"{result['stages'][name]:.2f}s" for name in STAGES),
+            f"{peak:.0f}" if peak is not None else "n/a",
+        ]
+        lines.append(" ".join(f"{value:>14}" for value in values))
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option(
+    "--rows",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=DEFAULT_ROWS,
+    show_default=True,
+    help="Input sizes, one fresh process each",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option(
+    "--history",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Append the results to this JSON lines file",
+)
+@click.option("--single", is_flag=True, hidden=True)
+def main(rows, seed, batch_size, jobs, history, single):
+    if single:
+        click.echo(json.dumps(run_benchmark(rows[0], seed, batch_size, jobs)))
+        return
+
+    results = []
+    for size in rows:
+        process = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--single",
+                "--rows",
+                str(size),
+                "--seed",
+                str(seed),
+                "--batch-size",
+                str(batch_size),
+                "--jobs",
+                str(jobs),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        click.echo(f"{size} rows: {results[-1]['records_per_second']:.1f} records/s", err=True)
+
+    click.echo(format_table(results))
+
+    if history:
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "batch_size": batch_size,
+            "jobs": jobs,
+            "results": results,
+        }
+        with open(history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 from .core.input_mapper import generate_household
 from .core.output_mapper import export_household
+from .core.batch import export_households
+from .core.api import run_taxsim
 from .cli import main as cli
 
-__all__ = ["generate_household", "export_household", "cli"]
+__all__ = [
+    "generate_household",
+    "export_household",
+    "export_households",
+    "run_taxsim",
+    "cli",
+]
 
 __version__ = "0.1.0"  # Make sure this matches the version in pyproject.toml
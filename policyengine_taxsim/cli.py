@@ -1,83 +1,512 @@
+import functools
+import sys
+
 import click
-import pandas as pd
 from pathlib import Path
 from io import StringIO
 
 try:
-    from .core.input_mapper import generate_household
-    from .core.output_mapper import export_household
+    from .core.run_config import RunConfig, DEFAULT_BATCH_SIZE
+    from .core.parallel import run_records_parallel, EXECUTORS
+    from .core.cache import ResultCache, DEFAULT_MAX_ENTRIES
+    from .core.dedupe import RecordDeduplicator
+    from .core.simulation import DEFAULT_MARGINAL_RATE_DELTA
+    from .core.server import serve_stream, DEFAULT_END_MARKER
+    from .core.profiling import profiler
+    from .core.cost_report import column_costs, format_column_costs
+    from .core.mapping_plan import parse_columns
+    from .core.streaming import (
+        read_input_chunks,
+        open_output_writer,
+        exit_on_sigterm,
+        TaxsimOutputWriter,
+        DEFAULT_CHUNK_SIZE,
+    )
+    from .core.columnar import FORMATS, import_pyarrow
+    from .core.yaml_logs import LogSettings, LOG_FORMATS
+    from .core.service import (
+        RequestCoalescer,
+        check_records,
+        create_server,
+        DEFAULT_HOST,
+        DEFAULT_PORT,
+        DEFAULT_WINDOW_MS,
+    )
 except ImportError:
-    from policyengine_taxsim.core.input_mapper import generate_household
-    from policyengine_taxsim.core.output_mapper import export_household
+    from policyengine_taxsim.core.run_config import RunConfig, DEFAULT_BATCH_SIZE
+    from policyengine_taxsim.core.parallel import run_records_parallel, EXECUTORS
+    from policyengine_taxsim.core.cache import ResultCache, DEFAULT_MAX_ENTRIES
+    from policyengine_taxsim.core.dedupe import RecordDeduplicator
+    from policyengine_taxsim.core.simulation import DEFAULT_MARGINAL_RATE_DELTA
+    from policyengine_taxsim.core.server import serve_stream, DEFAULT_END_MARKER
+    from policyengine_taxsim.core.profiling import profiler
+    from policyengine_taxsim.core.cost_report import column_costs, format_column_costs
+    from policyengine_taxsim.core.mapping_plan import parse_columns
+    from policyengine_taxsim.core.streaming import (
+        read_input_chunks,
+        open_output_writer,
+        exit_on_sigterm,
+        TaxsimOutputWriter,
+        DEFAULT_CHUNK_SIZE,
+    )
+    from policyengine_taxsim.core.columnar import FORMATS, import_pyarrow
+    from policyengine_taxsim.core.yaml_logs import LogSettings, LOG_FORMATS
+    from policyengine_taxsim.core.service import (
+        RequestCoalescer,
+        check_records,
+        create_server,
+        DEFAULT_HOST,
+        DEFAULT_PORT,
+        DEFAULT_WINDOW_MS,
+    )
+
+
+class DefaultCommandGroup(click.Group):
+    """Command group that runs its default command when no subcommand is named."""
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (
+            args[0] not in self.commands
+            and args[0] not in self.get_help_option_names(ctx)
+        ):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+def parse_columns_option(ctx, param, value):
+    """Validate the --columns option into a tuple of column names."""
+    if value is None:
+        return None
+    try:
+        return parse_columns(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
 
+def simulation_options(function):
+    """
+    Options shared by the run, serve and service commands.
+
+    The options that make up the RunConfig of a run are built into one, which
+    the command gets as its config argument. The result cache options and
+    --dedupe, which set up objects of the command itself, are passed as they
+    are.
+    """
+
+    @functools.wraps(function)
+    def with_run_config(
+        logs,
+        logs_sample,
+        logs_dir,
+        logs_format,
+        disable_salt,
+        batch_size,
+        jobs,
+        marginal_rate_delta,
+        warm_start,
+        columns,
+        executor,
+        **kwargs,
+    ):
+        config = RunConfig(
+            logs=logs,
+            disable_salt=disable_salt,
+            marginal_rate_delta=marginal_rate_delta,
+            columns=columns,
+            log_settings=LogSettings(logs_sample, logs_dir, logs_format),
+            batch_size=batch_size,
+            jobs=jobs,
+            warm_start=warm_start,
+            executor=executor,
+        )
+        return function(config=config, **kwargs)
+
+    options = [
+        click.option("--logs", is_flag=True, help="Generate PE YAML Tests Logs"),
+        click.option(
+            "--logs-sample",
+            type=click.FloatRange(min=0, max=1),
+            default=1.0,
+            show_default=True,
+            help="Fraction of records logged with --logs, sampled by taxsimid",
+        ),
+        click.option(
+            "--logs-dir",
+            type=click.Path(file_okay=False),
+            default=".",
+            show_default=True,
+            help="Directory the --logs are written into",
+        ),
+        click.option(
+            "--logs-format",
+            type=click.Choice(LOG_FORMATS),
+            default="yaml",
+            show_default=True,
+            help="yaml writes a file per record. jsonl and zip bundle the logs of "
+            "every process into one JSON-lines file or zip archive.",
+        ),
+        click.option(
+            "--disable-salt",
+            is_flag=True,
+            default=False,
+            help="Set SALT Deduction to 0",
+        ),
+        click.option(
+            "--batch-size",
+            type=click.IntRange(min=1),
+            default=DEFAULT_BATCH_SIZE,
+            show_default=True,
+            help="Number of records simulated together in one PolicyEngine simulation",
+        ),
+        click.option(
+            "--jobs",
+            "-j",
+            type=click.IntRange(min=1),
+            default=1,
+            show_default=True,
+            help="Number of workers used to simulate batches in parallel",
+        ),
+        click.option(
+            "--cache-dir",
+            type=click.Path(file_okay=False),
+            default=None,
+            help="Directory of a persistent result cache reused across runs",
+        ),
+        click.option(
+            "--cache-size",
+            type=click.IntRange(min=1),
+            default=DEFAULT_MAX_ENTRIES,
+            show_default=True,
+            help="Maximum number of records kept in the result cache",
+        ),
+        click.option(
+            "--dedupe/--no-dedupe",
+            default=True,
+            show_default=True,
+            help="Simulate records that only differ in taxsimid once",
+        ),
+        click.option(
+            "--marginal-rate-delta",
+            type=click.FloatRange(min=0, min_open=True),
+            default=DEFAULT_MARGINAL_RATE_DELTA,
+            show_default=True,
+            help="Extra earnings used to compute the frate, srate and ficar marginal rates",
+        ),
+        click.option(
+            "--warm-start",
+            is_flag=True,
+            default=False,
+            help="Warm up PolicyEngine US once for the input years and states before "
+            "forking the --jobs workers, so they do not each start cold",
+        ),
+        click.option(
+            "--columns",
+            default=None,
+            callback=parse_columns_option,
+            help="Comma separated idtl 0/2 output columns to calculate, e.g. "
+            "fiitax,siitax,v10. taxsimid, year and state are always included.",
+        ),
+        click.option(
+            "--executor",
+            type=click.Choice(EXECUTORS),
+            default="process",
+            show_default=True,
+            help="Run the --jobs workers as processes, or as threads sharing one "
+            "PolicyEngine US system in this process",
+        ),
+    ]
+    for option in reversed(options):
+        with_run_config = option(with_run_config)
+    return with_run_config
+
+
+@click.group(cls=DefaultCommandGroup, default_command="run")
+def main():
+    """
+    PolicyEngine TAXSIM emulator. Runs an input file unless a command is given.
+    """
 
-@click.command()
+
+@main.command()
 @click.argument("input_file", type=click.Path(exists=True))
 @click.option(
     "--output",
     "-o",
-    type=click.Path(),
-    default="output.txt",
-    help="Output file path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Output file path. Output is written to stdout when not given.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CHUNK_SIZE,
+    show_default=True,
+    help="Number of input records read, simulated and written at a time",
+)
+@click.option(
+    "--input-format",
+    type=click.Choice(FORMATS),
+    default="csv",
+    show_default=True,
+    help="Format of the input file. Parquet and Arrow need pyarrow.",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(FORMATS),
+    default="csv",
+    show_default=True,
+    help="csv writes the TAXSIM text output. parquet and arrow write one typed "
+    "row per record to the --output file, rounded to two decimals rather than one.",
+)
+@simulation_options
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Time every processing stage and print a summary table on stderr",
 )
-@click.option("--logs", is_flag=True, help="Generate PE YAML Tests Logs")
 @click.option(
-    "--disable-salt", is_flag=True, default=False, help="Set SALT Deduction to 0"
+    "--profile-json",
+    type=click.Path(dir_okay=False),
+    default="taxsim_profile.json",
+    show_default=True,
+    help="Where --profile writes its JSON report",
 )
-def main(input_file, output, logs, disable_salt):
+@click.option(
+    "--cprofile",
+    "cprofile_output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Dump cProfile stats of the run to this file, e.g. for flame graphs",
+)
+def run(
+    input_file,
+    output,
+    chunk_size,
+    input_format,
+    output_format,
+    config,
+    cache_dir,
+    cache_size,
+    dedupe,
+    profile,
+    profile_json,
+    cprofile_output,
+):
     """
     Process TAXSIM input file and generate PolicyEngine-compatible output.
     """
+    if output_format != "csv" and not output:
+        raise click.UsageError(f"--output-format {output_format} needs --output")
+    if {input_format, output_format} != {"csv"}:
+        try:
+            import_pyarrow()
+        except ImportError as e:
+            raise click.UsageError(str(e))
+
     try:
-        # Read input file
-        df = pd.read_csv(input_file)
-
-        # Process each row
-        idtl_0_results = []
-        idtl_2_results = []
-        idtl_5_results = ""
-
-        for _, row in df.iterrows():
-            taxsim_input = row.to_dict()
-            pe_situation = generate_household(taxsim_input)
-
-            taxsim_output = export_household(
-                taxsim_input, pe_situation, logs, disable_salt
-            )
-
-            idtl = taxsim_input["idtl"]
-            if idtl == 0:
-                idtl_0_results.append(taxsim_output)
-            elif idtl == 2:
-                idtl_2_results.append(taxsim_output)
-            else:
-                idtl_5_results += taxsim_output
-
-        idtl_0_output = to_csv_str(idtl_0_results)
-        idtl_2_output = to_csv_str(idtl_2_results)
-
-        output_str = ""
-        if idtl_0_output:
-            output_str += idtl_0_output
-        if idtl_2_output:
-            output_str += f"\n{idtl_2_output}"
-        if idtl_5_results:
-            output_str += f"\n{idtl_5_results}"
-
-        print(output_str)
+        if profile:
+            profiler.start()
+        if cprofile_output:
+            import cProfile
+
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+
+        cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+        deduplicator = RecordDeduplicator() if dedupe and not config.logs else None
+
+        writer = open_output_writer(output, output_format, config.columns)
+        # A terminated run unwinds through the finally block, which writes the
+        # sections of the chunks completed so far
+        with exit_on_sigterm():
+            try:
+                # Read, simulate and write the input chunk by chunk
+                chunks = read_input_chunks(input_file, chunk_size, input_format)
+                while True:
+                    with profiler.stage("read_csv"):
+                        df = next(chunks, None)
+                    if df is None:
+                        break
+
+                    taxsim_inputs, taxsim_outputs = simulate_dataframe(
+                        df, config, cache, deduplicator
+                    )
+                    writer.write(taxsim_inputs, taxsim_outputs)
+            finally:
+                writer.close()
+
+        report_reuse(cache, deduplicator)
+        if cache is not None:
+            cache.close()
+
+        if cprofile_output:
+            cprofiler.disable()
+            cprofiler.dump_stats(cprofile_output)
+        if profile:
+            profiler.stop()
+            costs = column_costs(profiler.report())
+            click.echo(profiler.summary_table(), err=True)
+            click.echo("", err=True)
+            click.echo(format_column_costs(costs), err=True)
+            profiler.write_report(profile_json, column_costs=costs)
     except Exception as e:
         click.echo(f"Error processing input: {str(e)}", err=True)
         raise
 
 
-def to_csv_str(results):
-    if len(results) == 0 or results is None:
-        return ""
+@main.command()
+@simulation_options
+@click.option(
+    "--end-marker",
+    default=DEFAULT_END_MARKER,
+    show_default=True,
+    help="Line written after the output of every micro-batch (empty to disable)",
+)
+def serve(
+    config,
+    cache_dir,
+    cache_size,
+    dedupe,
+    end_marker,
+):
+    """
+    Stay resident and answer TAXSIM records read from stdin.
+
+    Input is TAXSIM CSV with a header line. A blank line, a new header line or
+    --batch-size records end a micro-batch. The output of every micro-batch is
+    written to stdout as soon as it is ready, in the same format as a file
+    run, followed by the end marker line. The server stops when stdin closes.
+    """
+    cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+    deduplicator = RecordDeduplicator() if dedupe and not config.logs else None
+
+    def process_batch(csv_text):
+        import pandas as pd
+
+        output_str = process_dataframe(
+            pd.read_csv(StringIO(csv_text)), config, cache, deduplicator
+        )
+        return f"{output_str}\n"
+
+    try:
+        serve_stream(
+            sys.stdin, sys.stdout, process_batch, config.batch_size, end_marker
+        )
+    finally:
+        report_reuse(cache, deduplicator)
+        if cache is not None:
+            cache.close()
+
+
+@main.command()
+@simulation_options
+@click.option(
+    "--host",
+    default=DEFAULT_HOST,
+    show_default=True,
+    help="Host the HTTP service listens on",
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    default=DEFAULT_PORT,
+    show_default=True,
+    help="Port the HTTP service listens on",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Listen on this Unix socket instead of host and port",
+)
+@click.option(
+    "--window-ms",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_WINDOW_MS,
+    show_default=True,
+    help="Latency window in which concurrent requests are evaluated together",
+)
+def service(
+    config,
+    cache_dir,
+    cache_size,
+    dedupe,
+    host,
+    port,
+    socket_path,
+    window_ms,
+):
+    """
+    Serve TAXSIM records over localhost HTTP or a Unix socket.
+
+    POST a JSON record or list of records to get a JSON list of outputs, or
+    TAXSIM CSV (Content-Type: text/csv) to get the output text of a file run.
+    Requests arriving within --window-ms of each other, up to --batch-size
+    records, are evaluated in one batched PolicyEngine simulation.
+    """
+    cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+    deduplicator = RecordDeduplicator() if dedupe and not config.logs else None
+
+    def process_records(taxsim_inputs):
+        return run_records_parallel(taxsim_inputs, config, cache, deduplicator)
+
+    coalescer = RequestCoalescer(
+        process_records, window_ms / 1000, config.batch_size, check_records
+    )
+    server = create_server(coalescer, format_output, host, port, socket_path)
+    address = socket_path or f"http://{host}:{server.server_address[1]}"
+    click.echo(f"Serving TAXSIM on {address}", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        coalescer.close()
+        click.echo(coalescer.summary(), err=True)
+        report_reuse(cache, deduplicator)
+        if cache is not None:
+            cache.close()
+
+
+def simulate_dataframe(df, config, cache=None, deduplicator=None):
+    """Simulate the TAXSIM records of a DataFrame, returning inputs and outputs."""
+    # Process records in batched simulations
+    with profiler.stage("dataframe_to_records"):
+        taxsim_inputs = [row.to_dict() for _, row in df.iterrows()]
+
+    return run_records_parallel(taxsim_inputs, config, cache, deduplicator)
+
+
+def process_dataframe(df, config, cache=None, deduplicator=None):
+    """Simulate the TAXSIM records of a DataFrame and format the output text."""
+    taxsim_inputs, taxsim_outputs = simulate_dataframe(
+        df, config, cache, deduplicator
+    )
+    return format_output(taxsim_inputs, taxsim_outputs)
+
+
+def format_output(taxsim_inputs, taxsim_outputs):
+    """Collate outputs by idtl into the TAXSIM output text."""
+    output = StringIO()
+    writer = TaxsimOutputWriter(output)
+    writer.write(taxsim_inputs, taxsim_outputs)
+    writer.close()
+    return output.getvalue()
+
 
-    df = pd.DataFrame(results)
-    content = df.to_csv(index=False, float_format="%.1f", lineterminator="\n")
-    cleaned_df = pd.read_csv(StringIO(content))
-    return cleaned_df.to_csv(index=False, lineterminator="\n")
+def report_reuse(cache, deduplicator):
+    """Report deduplication and cache counts on stderr."""
+    if deduplicator is not None:
+        click.echo(deduplicator.summary(), err=True)
+    if cache is not None:
+        click.echo(cache.summary(), err=True)
 
 
 if __name__ == "__main__":
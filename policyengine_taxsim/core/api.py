@@ -0,0 +1,132 @@
+from .cache import ResultCache, DEFAULT_MAX_ENTRIES
+from .columnar import collect_output_columns, get_output_columns, FULL_TEXT_COLUMN
+from .dedupe import RecordDeduplicator
+from .mapping_plan import parse_columns, IDENTIFIER_COLUMNS
+from .parallel import run_records_parallel
+from .run_config import RunConfig, DEFAULT_BATCH_SIZE
+from .simulation import DEFAULT_MARGINAL_RATE_DELTA
+
+
+def to_records(inputs):
+    """
+    TAXSIM input dicts of a DataFrame or a mapping of column arrays.
+
+    Args:
+        inputs: pandas DataFrame, or mapping of TAXSIM input names to arrays
+            of equal length
+
+    Returns:
+        list: One TAXSIM input dict per record
+    """
+    import pandas as pd
+
+    df = inputs if isinstance(inputs, pd.DataFrame) else pd.DataFrame(inputs)
+    return [row.to_dict() for _, row in df.iterrows()]
+
+
+def to_results_frame(taxsim_inputs, taxsim_outputs, columns=None):
+    """
+    Typed DataFrame of TAXSIM results, one row per record in input order.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, with defaults already set
+        taxsim_outputs (list): Matching outputs
+        columns (tuple): Requested idtl 0/2 output columns, or None for all
+
+    Returns:
+        pandas.DataFrame: taxsimid, year, state and idtl as int64, the output
+            columns of the idtls present as float64 and the idtl 5 text in
+            full_text
+    """
+    import pandas as pd
+
+    output_types = sorted({int(taxsim_input["idtl"]) for taxsim_input in taxsim_inputs})
+    value_columns = [
+        name
+        for name in get_output_columns(columns, output_types)
+        if name not in IDENTIFIER_COLUMNS
+    ]
+    data = collect_output_columns(taxsim_inputs, taxsim_outputs, value_columns)
+
+    df = pd.DataFrame(data)
+    dtypes = {name: "int64" for name in (*IDENTIFIER_COLUMNS, "idtl")}
+    dtypes.update({name: "float64" for name in value_columns})
+    dtypes[FULL_TEXT_COLUMN] = "object"
+    return df.astype(dtypes)
+
+
+def run_taxsim(
+    inputs,
+    disable_salt=False,
+    columns=None,
+    jobs=1,
+    batch_size=DEFAULT_BATCH_SIZE,
+    marginal_rate_delta=DEFAULT_MARGINAL_RATE_DELTA,
+    cache_dir=None,
+    cache_size=DEFAULT_MAX_ENTRIES,
+    dedupe=True,
+    warm_start=False,
+    executor="process",
+):
+    """
+    Run TAXSIM records in-process and return the results as a DataFrame.
+
+    This is the batch API behind the command line: the records are simulated
+    exactly like a file run, without the process startup and CSV round trip.
+    Repeated calls in the same process reuse the loaded PolicyEngine US
+    system.
+
+    The result has one row per record, in input order. idtl 0/2 values keep
+    the two decimals of the output mapper rather than being rounded to one
+    decimal like the CSV output, and a column is NaN for records whose idtl
+    does not have it. idtl 5 records get their
+    text output in the full_text column, which is None for other records.
+
+    Args:
+        inputs: pandas DataFrame or mapping of column arrays of TAXSIM inputs
+        disable_salt (bool): Set SALT deduction to 0
+        columns: idtl 0/2 output columns to calculate, as a list or a comma
+            separated string, or None for all
+        jobs (int): Number of worker processes
+        batch_size (int): Number of records per simulation
+        marginal_rate_delta (float): Extra earnings used for the marginal rates
+        cache_dir (str): Directory of an on-disk result cache, or None
+        cache_size (int): Maximum number of records kept in the cache
+        dedupe (bool): Simulate records identical apart from taxsimid once
+        warm_start (bool): Warm the PolicyEngine US caches before forking
+            the worker processes
+        executor (str): Run the jobs workers as "process"es or as "thread"s
+            of this process, which share its PolicyEngine US system
+
+    Returns:
+        pandas.DataFrame: Results, see to_results_frame
+
+    Raises:
+        ValueError: If columns names an unknown output column, or executor is
+            unknown
+    """
+    if columns is not None:
+        if not isinstance(columns, str):
+            columns = ",".join(columns)
+        columns = parse_columns(columns)
+
+    config = RunConfig(
+        disable_salt=disable_salt,
+        marginal_rate_delta=marginal_rate_delta,
+        columns=columns,
+        batch_size=batch_size,
+        jobs=jobs,
+        warm_start=warm_start,
+        executor=executor,
+    )
+    taxsim_inputs = to_records(inputs)
+    cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+    deduplicator = RecordDeduplicator() if dedupe else None
+    try:
+        taxsim_inputs, taxsim_outputs = run_records_parallel(
+            taxsim_inputs, config, cache, deduplicator
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+    return to_results_frame(taxsim_inputs, taxsim_outputs, columns)
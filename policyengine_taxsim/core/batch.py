@@ -0,0 +1,288 @@
+from contextlib import nullcontext
+from dataclasses import replace
+
+from .input_mapper import generate_household, set_taxsim_defaults
+from .output_mapper import generate_household_output
+from .household_arrays import map_households, records_to_columns
+from .simulation import (
+    BatchSimulation,
+    HouseholdArraysBatchSimulation,
+    SimulationPool,
+)
+from .run_config import RunConfig
+from .profiling import profiler
+from .yaml_logs import open_yaml_logs
+
+
+def get_record_year_and_state(taxsim_input):
+    """(year, state number) scheduling key of a TAXSIM input record."""
+    taxsim_input = set_taxsim_defaults(taxsim_input)
+    return int(taxsim_input["year"]), taxsim_input["state"]
+
+
+def schedule_records(taxsim_inputs):
+    """
+    Order record positions into (year, state) buckets.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, updated in place with defaults
+
+    Returns:
+        list: Record positions, sorted by (year, state) and then by input order
+    """
+    return sorted(
+        range(len(taxsim_inputs)),
+        key=lambda position: get_record_year_and_state(taxsim_inputs[position]),
+    )
+
+
+def get_situation_year_and_state(situation):
+    """Extract the year and state code from a generated situation."""
+    state_name = situation["households"]["your household"]["state_name"]
+    year = list(state_name.keys())[0]
+    return year, state_name[year]
+
+
+def export_batches(taxsim_inputs, buckets, make_batch, config):
+    """
+    Simulate the records of (year, state) buckets in batches.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, with defaults already set
+        buckets (dict): Record positions by (year, state code)
+        make_batch (callable): Takes record positions, the year and the
+            marginal rate delta (None without marginal rates) and returns
+            their BatchSimulation
+        config (RunConfig): Options of the run, with config.batch_size records
+            per simulation at most
+
+    Returns:
+        list: TAXSIM outputs in input order
+    """
+    results = [None] * len(taxsim_inputs)
+
+    for year, state_name in sorted(buckets):
+        positions = buckets[(year, state_name)]
+        for start in range(0, len(positions), config.batch_size):
+            batch_positions = positions[start : start + config.batch_size]
+            needs_marginal_rates = any(
+                config.needs_marginal_rates(taxsim_inputs[position]["idtl"])
+                for position in batch_positions
+            )
+            batch = make_batch(
+                batch_positions,
+                year,
+                config.marginal_rate_delta if needs_marginal_rates else None,
+            )
+            for batch_position, position in enumerate(batch_positions):
+                results[position] = generate_household_output(
+                    taxsim_inputs[position],
+                    year,
+                    state_name,
+                    batch.record(batch_position),
+                    batch.perturbed_record(batch_position),
+                    config,
+                )
+
+    return results
+
+
+def export_households(taxsim_inputs, situations, config=None):
+    """
+    Convert many PolicyEngine situations to TAXSIM outputs with batched simulations.
+
+    Records are worked through in (year, state) buckets, and the records of a
+    bucket are packed into one BatchSimulation per batch, together with their
+    perturbed copies for the marginal rates. The perturbed copies are left out
+    of batches whose output columns have no marginal rate. Only the variables
+    of the output columns of each record's idtl are calculated, each once per
+    batch. Results are returned in the original input order.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, with defaults already set
+        situations (list): Matching situations from generate_household
+        config (RunConfig): Options of the run, or None for the defaults
+
+    Returns:
+        list: TAXSIM outputs in input order (dicts for idtl 0/2, text for idtl 5)
+    """
+    if config is None:
+        config = RunConfig()
+    return export_situations(taxsim_inputs, situations, config)
+
+
+def export_situations(taxsim_inputs, situations, config):
+    """
+    Convert situations to TAXSIM outputs with the options of a run.
+
+    See export_households.
+
+    Returns:
+        list: TAXSIM outputs in input order
+    """
+    # Bucket records by (year, state) so every simulation sees one parameter
+    # tree and one set of state variables
+    buckets = {}
+    for position, situation in enumerate(situations):
+        buckets.setdefault(get_situation_year_and_state(situation), []).append(
+            position
+        )
+
+    def make_batch(positions, year, batch_marginal_rate_delta):
+        return BatchSimulation(
+            [situations[position] for position in positions],
+            year,
+            config.disable_salt,
+            batch_marginal_rate_delta,
+        )
+
+    return export_batches(taxsim_inputs, buckets, make_batch, config)
+
+
+def export_household_arrays(taxsim_inputs, households, config, pool=None):
+    """
+    Convert HouseholdArrays to TAXSIM outputs with batched simulations.
+
+    Works like export_households, but the simulations are built from the
+    entity arrays of map_households instead of situation dicts. With a batch
+    size of 1, where every record gets its own simulation, simulations are
+    taken from a SimulationPool, so records of the same household shape,
+    year and state reuse one simulation.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, with defaults already set
+        households (HouseholdArrays): Matching households from map_households
+        config (RunConfig): Options of the run. PE YAML test logs need
+            situations, so config.logs is ignored.
+        pool (SimulationPool): Pool to take the simulations from, or None for
+            a new pool with a batch size of 1 and fresh simulations otherwise
+
+    Returns:
+        list: TAXSIM outputs in input order (dicts for idtl 0/2, text for idtl 5)
+    """
+    if pool is None and config.batch_size == 1:
+        pool = SimulationPool()
+
+    def make_batch(positions, year, batch_marginal_rate_delta):
+        if pool is not None:
+            return pool.get(
+                households.select(positions),
+                year,
+                config.disable_salt,
+                batch_marginal_rate_delta,
+            )
+        return HouseholdArraysBatchSimulation(
+            households.select(positions),
+            year,
+            config.disable_salt,
+            batch_marginal_rate_delta,
+        )
+
+    return export_batches(
+        taxsim_inputs,
+        households.buckets(),
+        make_batch,
+        replace(config, logs=False),
+    )
+
+
+def simulate_records(taxsim_inputs, config):
+    """
+    Simulate TAXSIM input records, updating them in place with the defaults.
+
+    The records are mapped to entity arrays column by column. With logs, the
+    records in the log sample are mapped to situations one by one instead,
+    since the PE YAML test logs are written from the situations. Their logs
+    are written by a background writer, which is closed before returning.
+
+    Returns:
+        list: TAXSIM outputs in input order
+    """
+    if not taxsim_inputs:
+        return []
+    for taxsim_input in taxsim_inputs:
+        set_taxsim_defaults(taxsim_input)
+    if not config.logs:
+        return simulate_arrays(taxsim_inputs, config)
+
+    logged = [
+        position
+        for position, taxsim_input in enumerate(taxsim_inputs)
+        if config.logs_record(taxsim_input["taxsimid"])
+    ]
+    logged_set = set(logged)
+    unlogged = [
+        position for position in range(len(taxsim_inputs)) if position not in logged_set
+    ]
+    logged_inputs = [taxsim_inputs[position] for position in logged]
+    unlogged_inputs = [taxsim_inputs[position] for position in unlogged]
+
+    results = [None] * len(taxsim_inputs)
+    # The writer is only opened for a sample that logs anything
+    with open_yaml_logs(config.log_settings) if logged else nullcontext():
+        situations = [
+            generate_household(taxsim_input) for taxsim_input in logged_inputs
+        ]
+        logged_outputs = export_situations(logged_inputs, situations, config)
+        unlogged_outputs = simulate_arrays(unlogged_inputs, replace(config, logs=False))
+    for position, taxsim_output in zip(logged, logged_outputs):
+        results[position] = taxsim_output
+    for position, taxsim_output in zip(unlogged, unlogged_outputs):
+        results[position] = taxsim_output
+    return results
+
+
+def simulate_arrays(taxsim_inputs, config):
+    """Simulate records with defaults set from their entity arrays."""
+    if not taxsim_inputs:
+        return []
+    households = map_households(records_to_columns(taxsim_inputs))
+    return export_household_arrays(taxsim_inputs, households, config)
+
+
+def run_records(taxsim_inputs, config, cache=None):
+    """
+    Simulate TAXSIM input records with the options of a run.
+
+    The input dicts are updated in place with the TAXSIM defaults. With a
+    result cache, only records missing from the cache are simulated. The cache
+    is not used when logs are requested, since logs need the simulation.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts
+        config (RunConfig): Options of the run
+        cache (ResultCache): Optional on-disk result cache
+
+    Returns:
+        list: TAXSIM outputs in input order
+    """
+    if cache is None or config.logs:
+        return simulate_records(taxsim_inputs, config)
+
+    keys = [
+        cache.key(
+            set_taxsim_defaults(taxsim_input),
+            config.disable_salt,
+            config.marginal_rate_delta,
+            config.columns,
+        )
+        for taxsim_input in taxsim_inputs
+    ]
+    with profiler.stage("cache_lookup"):
+        cached = cache.get_many(keys)
+
+    missing = [position for position, key in enumerate(keys) if key not in cached]
+    missing_inputs = [taxsim_inputs[position] for position in missing]
+    missing_outputs = simulate_records(missing_inputs, config)
+    with profiler.stage("cache_store"):
+        cache.put_many(
+            {
+                keys[position]: taxsim_output
+                for position, taxsim_output in zip(missing, missing_outputs)
+            }
+        )
+
+    results = [cached.get(key) for key in keys]
+    for position, taxsim_output in zip(missing, missing_outputs):
+        results[position] = taxsim_output
+    return results
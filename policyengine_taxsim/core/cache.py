@@ -0,0 +1,196 @@
+import hashlib
+import json
+import math
+import pickle
+import sqlite3
+import time
+from functools import lru_cache
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+
+from .utils import load_variable_mappings
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+CACHE_FILE_NAME = "taxsim_results.sqlite"
+
+# SQLite limits the number of bound parameters per statement
+QUERY_CHUNK_SIZE = 500
+
+
+def get_policyengine_us_version():
+    """Installed policyengine-us version, part of every cache key."""
+    try:
+        return version("policyengine-us")
+    except PackageNotFoundError:
+        import policyengine_us
+
+        return getattr(policyengine_us, "__version__", "unknown")
+
+
+def get_policyengine_taxsim_version():
+    """Installed policyengine-taxsim version, part of every cache key."""
+    try:
+        return version("policyengine-taxsim")
+    except PackageNotFoundError:
+        from policyengine_taxsim import __version__
+
+        return __version__
+
+
+def mapping_digest(mappings):
+    """Hex digest of parsed variable mappings."""
+    text = json.dumps(mappings, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_mapping_digest():
+    """Digest of variable_mappings.yaml, part of every cache key."""
+    return mapping_digest(load_variable_mappings())
+
+
+def normalise_value(value):
+    """Normalise an input value so equal numbers hash the same way."""
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if math.isnan(number):
+        return None
+    return number
+
+
+class ResultCache:
+    """
+    Size-bounded on-disk cache of TAXSIM outputs.
+
+    Entries are keyed on the normalised input record (with TAXSIM defaults
+    applied), the idtl, the disable_salt flag, the marginal rate delta, the
+    installed policyengine-us and policyengine-taxsim versions and a digest of
+    the variable mappings, so an upgrade of the model or of the mapping never
+    serves stale outputs. The cache is a SQLite database in WAL mode, so
+    several worker processes can read and write it at the same time. When it
+    grows beyond max_entries, the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.model_version = get_policyengine_us_version()
+        self.taxsim_version = get_policyengine_taxsim_version()
+        self.mapping_digest = get_mapping_digest()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # The connection may be used by another thread than the one that
+        # opened it, one thread at a time (e.g. the service's coalescer)
+        self.connection = sqlite3.connect(
+            self.cache_dir / CACHE_FILE_NAME,
+            timeout=60,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+
+    def key(self, taxsim_input, disable_salt, marginal_rate_delta=None, columns=None):
+        """
+        Cache key of a TAXSIM input record.
+
+        Args:
+            taxsim_input (dict): TAXSIM input dict, with defaults already set
+            disable_salt (bool): Set SALT deduction to 0
+            marginal_rate_delta (float): Extra earnings used for the marginal rates
+            columns (tuple): Requested output columns, or None for all
+
+        Returns:
+            str: Hex digest identifying the record, model and mapping versions
+        """
+        record = {
+            field: normalise_value(value) for field, value in taxsim_input.items()
+        }
+        key_material = json.dumps(
+            {
+                "input": record,
+                "idtl": int(taxsim_input["idtl"]),
+                "disable_salt": bool(disable_salt),
+                "marginal_rate_delta": normalise_value(marginal_rate_delta),
+                "columns": list(columns) if columns else None,
+                "policyengine_us": self.model_version,
+                "policyengine_taxsim": self.taxsim_version,
+                "mappings": self.mapping_digest,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(key_material.encode()).hexdigest()
+
+    def get_many(self, keys):
+        """Look up several keys, returning a dict of the ones found."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            chunk = unique_keys[start : start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, value FROM results WHERE key IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+
+            if rows:
+                self.connection.execute(
+                    f"UPDATE results SET accessed = ? WHERE key IN ({placeholders})",
+                    [time.time(), *chunk],
+                )
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Store several (key, output) pairs and evict the oldest entries."""
+        if not items:
+            return
+
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (key, value, accessed) VALUES (?, ?, ?)",
+                [
+                    (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now)
+                    for key, value in items.items()
+                ],
+            )
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM results"
+            ).fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY accessed, rowid LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def summary(self):
+        """Human readable hit and miss counts."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate)"
+
+    def close(self):
+        self.connection.close()
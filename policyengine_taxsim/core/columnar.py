@@ -0,0 +1,216 @@
+import re
+
+import numpy as np
+
+from .mapping_plan import get_mapping_plan, IDENTIFIER_COLUMNS, OUTPUT_TYPES
+
+FORMATS = ("csv", "parquet", "arrow")
+
+# TAXSIM inputs read by generate_household besides the mapped income fields
+HOUSEHOLD_INPUT_FIELDS = ("idtl", "mstat", "depx", "page", "sage", "pwages", "swages")
+
+DEPENDENT_AGE_FIELD = re.compile(r"age\d+")
+
+FULL_TEXT_COLUMN = "full_text"
+
+
+def import_pyarrow():
+    """Import pyarrow, which only the Parquet and Arrow formats need."""
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError(
+            "The parquet and arrow formats need pyarrow: "
+            "pip install 'policyengine-taxsim[arrow]'"
+        ) from error
+    return pyarrow
+
+
+def get_input_columns(available):
+    """
+    TAXSIM input columns of a file that the emulator uses.
+
+    Args:
+        available (list): Column names of the input file
+
+    Returns:
+        list: The used column names, in file order
+    """
+    plan = get_mapping_plan()
+    used = {field for field, _ in plan.input_definitions}
+    used.update(field for _, fields in plan.tax_unit_routes for field in fields)
+    used.update(field for _, _, fields in plan.person_routes for field in fields)
+    used.update(HOUSEHOLD_INPUT_FIELDS)
+    return [
+        name
+        for name in available
+        if name in used or DEPENDENT_AGE_FIELD.fullmatch(name)
+    ]
+
+
+def read_parquet_chunks(input_file, chunk_size):
+    """Read the used TAXSIM columns of a Parquet file in chunks of records."""
+    import_pyarrow()
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(input_file)
+    columns = get_input_columns(parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def read_arrow_chunks(input_file, chunk_size):
+    """
+    Read the used TAXSIM columns of an Arrow IPC file or stream in chunks.
+
+    Record batches larger than chunk_size are split, smaller ones are read
+    as they are.
+    """
+    pa = import_pyarrow()
+    import pyarrow.ipc as ipc
+
+    with pa.memory_map(str(input_file)) as source:
+        try:
+            reader = ipc.open_file(source)
+            batches = (
+                reader.get_batch(index) for index in range(reader.num_record_batches)
+            )
+        except pa.ArrowInvalid:
+            source.seek(0)
+            reader = ipc.open_stream(source)
+            batches = iter(reader)
+
+        columns = get_input_columns(reader.schema.names)
+        for batch in batches:
+            batch = batch.select(columns)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(start, chunk_size).to_pandas()
+
+
+def get_output_columns(columns=None, output_types=OUTPUT_TYPES):
+    """
+    Output columns of a columnar file, in mapping order.
+
+    Args:
+        columns (tuple): Requested idtl 0/2 output columns, or None for all
+        output_types (tuple): idtls whose output columns are included
+
+    Returns:
+        list: Names of the output columns of the output types
+    """
+    plan = get_mapping_plan()
+    names = [
+        column.name
+        for output_type in output_types
+        if output_type in OUTPUT_TYPES
+        for column in plan.select_columns(output_type, columns)
+    ]
+    order = {column.name: position for position, column in enumerate(plan.columns)}
+    return sorted(dict.fromkeys(names), key=order.get)
+
+
+def to_float64(value):
+    """
+    Output value as a float64.
+
+    PolicyEngine calculates in float32. A float32 value is converted through
+    its shortest decimal form, so 2486.7 is kept as 2486.7 rather than the
+    2486.699951171875 of its binary value.
+    """
+    if isinstance(value, np.float32):
+        return float(str(value))
+    return float(value)
+
+
+def collect_output_columns(taxsim_inputs, taxsim_outputs, value_columns):
+    """
+    Outputs of records as columns, one row per record.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, with defaults already set
+        taxsim_outputs (list): Matching outputs, dicts for idtl 0/2 and text
+            for idtl 5
+        value_columns (list): Output columns besides the identifiers
+
+    Returns:
+        dict: Values of the identifier columns, idtl, value columns and
+            full_text column. Missing values are None.
+    """
+    data = {
+        name: []
+        for name in (*IDENTIFIER_COLUMNS, "idtl", *value_columns, FULL_TEXT_COLUMN)
+    }
+    for taxsim_input, taxsim_output in zip(taxsim_inputs, taxsim_outputs):
+        data["idtl"].append(int(taxsim_input["idtl"]))
+        if isinstance(taxsim_output, str):
+            # idtl 5 text output
+            for name in IDENTIFIER_COLUMNS:
+                data[name].append(int(taxsim_input[name]))
+            for name in value_columns:
+                data[name].append(None)
+            data[FULL_TEXT_COLUMN].append(taxsim_output)
+            continue
+
+        for name in IDENTIFIER_COLUMNS:
+            data[name].append(int(taxsim_output[name]))
+        for name in value_columns:
+            value = taxsim_output.get(name)
+            data[name].append(None if value is None else to_float64(value))
+        data[FULL_TEXT_COLUMN].append(None)
+    return data
+
+
+class ColumnarOutputWriter:
+    """
+    Write TAXSIM output as a typed Parquet or Arrow IPC file, chunk by chunk.
+
+    Every record is one row, in input order, with its idtl. The values of
+    idtl 0 and 2 records are kept in float64 columns with the two decimals of
+    the output mapper, without the one decimal rounding of the CSV output. A
+    column an idtl does not have is null for its records. The text of idtl 5
+    records is kept in the full_text column.
+    """
+
+    def __init__(self, path, output_format, columns=None):
+        """
+        Args:
+            path (str): Output file path
+            output_format (str): "parquet" or "arrow"
+            columns (tuple): Requested idtl 0/2 output columns, or None for all
+        """
+        pa = import_pyarrow()
+        self.pa = pa
+        self.records = 0
+        self.value_columns = [
+            name
+            for name in get_output_columns(columns)
+            if name not in IDENTIFIER_COLUMNS
+        ]
+        self.schema = pa.schema(
+            [(name, pa.int64()) for name in (*IDENTIFIER_COLUMNS, "idtl")]
+            + [(name, pa.float64()) for name in self.value_columns]
+            + [(FULL_TEXT_COLUMN, pa.string())]
+        )
+
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc as ipc
+
+            self._writer = ipc.new_file(path, self.schema)
+        self._closed = False
+
+    def write(self, taxsim_inputs, taxsim_outputs):
+        """Write the outputs of one chunk of records."""
+        data = collect_output_columns(taxsim_inputs, taxsim_outputs, self.value_columns)
+        self._writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+        self.records += len(taxsim_inputs)
+
+    def close(self):
+        """Finish the file. The chunks written so far are kept."""
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
@@ -0,0 +1,137 @@
+from .mapping_plan import get_mapping_plan, IDENTIFIER_COLUMNS
+
+# A column is flagged when it gets this much slower than in the baseline
+DEFAULT_REGRESSION_THRESHOLD = 1.5
+
+# Columns cheaper than this in both runs are too noisy to compare
+MIN_COMPARED_SECONDS = 0.05
+
+
+def variable_costs(profile_report):
+    """
+    Calculation cost of every PolicyEngine variable, per state.
+
+    Args:
+        profile_report (dict): StageProfiler report of a run
+
+    Returns:
+        dict: {state code: {variable: {"calls", "seconds"}}}
+    """
+    costs = {}
+    for detail, entry in profile_report["details"].get("calculate", {}).items():
+        state_name, _, variable = detail.rpartition(":")
+        costs.setdefault(state_name, {})[variable] = dict(entry)
+    return costs
+
+
+def column_costs(profile_report, plan=None):
+    """
+    Calculation cost of every TAXSIM output column, per state.
+
+    A column costs the time of calculating its PolicyEngine variables in the
+    state, including the state's special case variable. PolicyEngine computes
+    the dependencies of a variable the first time they are needed, so a
+    variable shared by several columns is counted for each of them, and the
+    first column to need a shared dependency carries its cost.
+
+    Args:
+        profile_report (dict): StageProfiler report of a run
+        plan (MappingPlan): Mapping plan, defaults to the compiled plan
+
+    Returns:
+        dict: {state code: {column: {"calls", "seconds", "variables",
+            "special_case"}}}, columns sorted by cost
+    """
+    plan = plan or get_mapping_plan()
+    costs = {}
+
+    for state_name, variables in variable_costs(profile_report).items():
+        state_costs = {}
+        for column in plan.columns:
+            if column.name in IDENTIFIER_COLUMNS:
+                continue
+            if column.is_multiple:
+                column_variables = list(column.variables)
+            else:
+                column_variables = [plan.state_variable(column, state_name)]
+
+            calculated = [variable for variable in column_variables if variable in variables]
+            if not calculated:
+                continue
+            state_costs[column.name] = {
+                "calls": sum(variables[variable]["calls"] for variable in calculated),
+                "seconds": sum(variables[variable]["seconds"] for variable in calculated),
+                "variables": column_variables,
+                "special_case": state_name.lower() in column.special_cases,
+            }
+
+        costs[state_name] = dict(
+            sorted(state_costs.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        )
+    return costs
+
+
+def total_column_costs(costs):
+    """Column costs summed over all states, sorted by cost."""
+    totals = {}
+    for state_costs in costs.values():
+        for column, entry in state_costs.items():
+            total = totals.setdefault(column, {"calls": 0, "seconds": 0.0})
+            total["calls"] += entry["calls"]
+            total["seconds"] += entry["seconds"]
+    return dict(sorted(totals.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+
+def format_column_costs(costs, top=10):
+    """Human readable table of the costliest columns, overall and per state."""
+    lines = [f"{'costliest columns':<30}{'calls':>10}{'total s':>12}"]
+    for column, entry in list(total_column_costs(costs).items())[:top]:
+        lines.append(f"{column:<30}{entry['calls']:>10}{entry['seconds']:>12.3f}")
+
+    state_totals = sorted(
+        (
+            (sum(entry["seconds"] for entry in state_costs.values()), state_name)
+            for state_name, state_costs in costs.items()
+        ),
+        reverse=True,
+    )
+    lines.append("")
+    lines.append(f"{'costliest states':<30}{'top column':>18}{'total s':>12}")
+    for seconds, state_name in state_totals[:top]:
+        top_column = next(iter(costs[state_name]), "")
+        if costs[state_name].get(top_column, {}).get("special_case"):
+            top_column += "*"
+        lines.append(f"{state_name:<30}{top_column:>18}{seconds:>12.3f}")
+    return "\n".join(lines)
+
+
+def find_regressions(
+    baseline,
+    current,
+    threshold=DEFAULT_REGRESSION_THRESHOLD,
+    min_seconds=MIN_COMPARED_SECONDS,
+):
+    """
+    Columns whose cost grew by more than threshold times the baseline.
+
+    Args:
+        baseline (dict): total_column_costs of the baseline run
+        current (dict): total_column_costs of the run to check
+        threshold (float): Allowed ratio of current to baseline cost
+        min_seconds (float): Columns cheaper than this in both runs are skipped
+
+    Returns:
+        list: (column, baseline seconds, current seconds) of every regression,
+            slowest first. Columns missing from the baseline are not flagged.
+    """
+    regressions = []
+    for column, entry in current.items():
+        if column not in baseline:
+            continue
+        before = baseline[column]["seconds"]
+        after = entry["seconds"]
+        if max(before, after) < min_seconds:
+            continue
+        if after > before * threshold:
+            regressions.append((column, before, after))
+    return sorted(regressions, key=lambda item: item[2] / max(item[1], 1e-9), reverse=True)
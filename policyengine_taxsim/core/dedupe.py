@@ -0,0 +1,95 @@
+import json
+
+from .cache import normalise_value
+from .input_mapper import set_taxsim_defaults
+
+
+def record_fingerprint(taxsim_input):
+    """
+    Fingerprint of a TAXSIM input record, ignoring its taxsimid.
+
+    Args:
+        taxsim_input (dict): TAXSIM input dict, with defaults already set
+
+    Returns:
+        str: Canonical JSON of the normalised record
+    """
+    return json.dumps(
+        {
+            field: normalise_value(value)
+            for field, value in taxsim_input.items()
+            if field != "taxsimid"
+        },
+        sort_keys=True,
+    )
+
+
+class RecordDeduplicator:
+    """
+    Simulate each distinct household of a run once.
+
+    Records that are identical apart from their taxsimid, after the TAXSIM
+    defaults are applied, share one simulation. Only idtl 0/2 records are
+    deduplicated; full text records (idtl 5) print their taxsimid inside the
+    text, so each is simulated on its own.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.unique_records = 0
+
+    def deduplicate(self, taxsim_inputs):
+        """
+        Find the representative record of every input record.
+
+        Args:
+            taxsim_inputs (list): TAXSIM input dicts, updated in place with defaults
+
+        Returns:
+            list: Position of the representative record for each position
+        """
+        first_positions = {}
+        representatives = []
+        for position, taxsim_input in enumerate(taxsim_inputs):
+            taxsim_input = set_taxsim_defaults(taxsim_input)
+            if int(taxsim_input["idtl"]) in [0, 2]:
+                fingerprint = record_fingerprint(taxsim_input)
+                representatives.append(first_positions.setdefault(fingerprint, position))
+            else:
+                representatives.append(position)
+
+        self.records += len(taxsim_inputs)
+        self.unique_records += len(set(representatives))
+        return representatives
+
+    def fan_out(self, taxsim_inputs, representatives, representative_outputs):
+        """
+        Copy the outputs of representative records to their duplicates.
+
+        Args:
+            taxsim_inputs (list): TAXSIM input dicts
+            representatives (list): Result of deduplicate
+            representative_outputs (dict): Output of each representative position
+
+        Returns:
+            list: TAXSIM outputs in input order
+        """
+        taxsim_outputs = []
+        for position, representative in enumerate(representatives):
+            taxsim_output = representative_outputs[representative]
+            if representative != position:
+                taxsim_output = dict(taxsim_output)
+                taxsim_output["taxsimid"] = taxsim_inputs[position]["taxsimid"]
+            taxsim_outputs.append(taxsim_output)
+        return taxsim_outputs
+
+    @property
+    def dedupe_ratio(self):
+        return self.records / self.unique_records if self.unique_records else 1.0
+
+    def summary(self):
+        """Human readable deduplication counts."""
+        return (
+            f"Deduplication: {self.records} records, {self.unique_records} "
+            f"distinct households ({self.dedupe_ratio:.2f}x)"
+        )
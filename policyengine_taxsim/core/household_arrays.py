@@ -0,0 +1,692 @@
+import functools
+
+import numpy as np
+
+from .input_mapper import TAXSIM_DEFAULTS
+from .mapping_plan import get_mapping_plan
+from .profiling import profiler
+from .utils import STATE_MAPPING
+
+# Kinds of household members, in their order within a household
+HEAD, SPOUSE, DEPENDENT = 0, 1, 2
+
+# Members of the person routes of the mapping plan
+ROUTE_MEMBERS = {"you": HEAD, "your partner": SPOUSE}
+
+# Group entities with one instance per household
+HOUSEHOLD_ENTITIES = ("household", "family", "spm_unit", "tax_unit")
+
+# Inputs that policyengine_us moves to another variable when it builds a
+# simulation, to apply labor supply and capital gains responses
+MOVED_INPUTS = {
+    "employment_income": "employment_income_before_lsr",
+    "self_employment_income": "self_employment_income_before_lsr",
+    "sstb_self_employment_income": "sstb_self_employment_income_before_lsr",
+    "weekly_hours_worked": "weekly_hours_worked_before_lsr",
+    "long_term_capital_gains": "long_term_capital_gains_before_response",
+}
+
+DEFAULT_ADULT_AGE = 40
+DEFAULT_DEPENDENT_AGE = 10
+
+
+def records_to_columns(taxsim_inputs):
+    """
+    Columns of TAXSIM input dicts, for map_households.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts
+
+    Returns:
+        dict: Object array of every field, with None for records without it
+    """
+    names = dict.fromkeys(
+        name for taxsim_input in taxsim_inputs for name in taxsim_input
+    )
+    columns = {}
+    for name in names:
+        column = np.empty(len(taxsim_inputs), dtype=object)
+        column[:] = [taxsim_input.get(name) for taxsim_input in taxsim_inputs]
+        columns[name] = column
+    return columns
+
+
+def get_column(inputs, name):
+    """
+    Values of a TAXSIM input column and where they are given.
+
+    None values of an object column, e.g. from records_to_columns, are
+    missing. NaN is a value, as it is for a record dict.
+
+    Returns:
+        tuple: Values and boolean mask, or None if there is no such column
+    """
+    if name not in inputs:
+        return None
+    values = np.asarray(inputs[name])
+    if values.dtype == object:
+        present = np.array([value is not None for value in values], dtype=bool)
+    else:
+        present = np.ones(len(values), dtype=bool)
+    return values, present
+
+
+def to_float(values, present):
+    return np.where(present, values, 0).astype(np.float64)
+
+
+def to_int(values, present, name):
+    """Values as integers, truncated like int(value)."""
+    values = to_float(values, present)
+    if np.isnan(values[present]).any():
+        raise ValueError(f"cannot convert float NaN to integer in {name}")
+    return values.astype(np.int64)
+
+
+def get_with_default(inputs, name, count, default):
+    """
+    Integer column that falls back to default where missing, like
+    taxsim_vars.get(name, default).
+    """
+    column = get_column(inputs, name)
+    if column is None:
+        return np.full(count, default, dtype=np.int64)
+    values, present = column
+    return np.where(present, to_int(values, present, name), default)
+
+
+def get_taxsim_default(inputs, name, count):
+    """
+    Integer column with its TAXSIM default where missing or zero, like
+    set_taxsim_defaults.
+    """
+    default = TAXSIM_DEFAULTS[name]
+    column = get_column(inputs, name)
+    if column is None:
+        return np.full(count, default, dtype=np.int64)
+    values, present = column
+    values = to_float(values, present)
+    if np.isnan(values).any():
+        raise ValueError(f"cannot convert float NaN to integer in {name}")
+    return np.where(values == 0, default, values).astype(np.int64)
+
+
+def route_values(inputs, fields):
+    """
+    Value of an input route, per record.
+
+    A route with one field takes its value. A route with several fields
+    takes the sum of the fields a record has.
+
+    Returns:
+        tuple: Values and mask of the records that have any of the fields, or
+            None if no record has one
+    """
+    columns = [get_column(inputs, field) for field in fields]
+    columns = [column for column in columns if column is not None]
+    if not columns:
+        return None
+    if len(fields) == 1:
+        values, present = columns[0]
+        return to_float(values, present), present
+
+    total = 0
+    any_present = np.zeros(len(columns[0][0]), dtype=bool)
+    for values, present in columns:
+        total = total + to_float(values, present)
+        any_present |= present
+    return total, any_present
+
+
+def select_members(owner, owner_count, positions):
+    """
+    Members of selected owners, e.g. the people of some households.
+
+    Args:
+        owner (numpy.ndarray): Owner index of every member, in owner order
+        owner_count (int): Number of owners
+        positions (numpy.ndarray): Selected owners, in the new order
+
+    Returns:
+        tuple: Indices of the selected members and their new owner index
+    """
+    counts = np.bincount(owner, minlength=owner_count)
+    starts = np.cumsum(counts) - counts
+    selected_counts = counts[positions]
+    new_owner = np.repeat(np.arange(len(positions)), selected_counts)
+    new_starts = np.cumsum(selected_counts) - selected_counts
+    index = np.repeat(starts[positions] - new_starts, selected_counts) + np.arange(
+        len(new_owner)
+    )
+    return index, new_owner
+
+
+class HouseholdArrays:
+    """
+    PolicyEngine entity arrays of many TAXSIM households.
+
+    Every household has its people (taxpayer, spouse, then dependents), one
+    marital unit for the taxpayer and spouse and one per dependent, and one
+    family, SPM unit and tax unit. Entities are stored in household order.
+
+    Inputs are kept per entity key as {variable: (values, mask)}. Entities
+    outside the mask get the variable's default, as they do when
+    PolicyEngine builds a simulation from a situation that leaves them out.
+
+    Attributes:
+        years (numpy.ndarray): Tax year of every household
+        state_names (numpy.ndarray): Two letter state code of every household
+        person_household (numpy.ndarray): Household index of every person
+        person_kind (numpy.ndarray): HEAD, SPOUSE or DEPENDENT
+        person_marital_unit (numpy.ndarray): Marital unit index of every person
+        marital_unit_household (numpy.ndarray): Household of every marital unit
+        inputs (dict): Input values per entity key
+    """
+
+    def __init__(
+        self,
+        years,
+        state_names,
+        person_household,
+        person_kind,
+        person_marital_unit,
+        marital_unit_household,
+        inputs,
+    ):
+        self.years = years
+        self.state_names = state_names
+        self.person_household = person_household
+        self.person_kind = person_kind
+        self.person_marital_unit = person_marital_unit
+        self.marital_unit_household = marital_unit_household
+        self.inputs = inputs
+
+    @property
+    def count(self):
+        return len(self.years)
+
+    def entity_count(self, entity_key):
+        if entity_key == "person":
+            return len(self.person_household)
+        if entity_key == "marital_unit":
+            return len(self.marital_unit_household)
+        return self.count
+
+    def memberships(self, entity_key):
+        """Index of the entity of every person."""
+        if entity_key == "marital_unit":
+            return self.person_marital_unit
+        return self.person_household
+
+    def offsets(self):
+        """For every household, the index of its first entity per entity key."""
+        person_counts = np.bincount(self.person_household, minlength=self.count)
+        unit_counts = np.bincount(self.marital_unit_household, minlength=self.count)
+        person_starts = (np.cumsum(person_counts) - person_counts).tolist()
+        unit_starts = (np.cumsum(unit_counts) - unit_counts).tolist()
+        return [
+            {
+                "person": person_start,
+                "marital_unit": unit_start,
+                **dict.fromkeys(HOUSEHOLD_ENTITIES, position),
+            }
+            for position, (person_start, unit_start) in enumerate(
+                zip(person_starts, unit_starts)
+            )
+        ]
+
+    def shape_key(self):
+        """
+        Key of the entity structure and input variables of the households.
+
+        Households with the same key give simulations with the same entities
+        and the same input holders, differing only in the input values.
+        """
+        return (
+            tuple(self.person_kind.tolist()),
+            tuple(self.marital_unit_household.tolist()),
+            tuple(
+                (entity_key, tuple(variables))
+                for entity_key, variables in self.inputs.items()
+            ),
+        )
+
+    def buckets(self):
+        """Household positions by (year, state code), in input order."""
+        buckets = {}
+        keys = zip(self.years.tolist(), self.state_names.tolist())
+        for position, (year, state_name) in enumerate(keys):
+            buckets.setdefault((str(year), state_name), []).append(position)
+        return buckets
+
+    def select(self, positions):
+        """
+        Arrays of some of the households.
+
+        Args:
+            positions (list): Household positions, in the new order
+
+        Returns:
+            HouseholdArrays: The selected households
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        people, person_household = select_members(
+            self.person_household, self.count, positions
+        )
+        units, unit_household = select_members(
+            self.marital_unit_household, self.count, positions
+        )
+
+        # Position of every person's marital unit within its household
+        unit_counts = np.bincount(self.marital_unit_household, minlength=self.count)
+        unit_starts = np.cumsum(unit_counts) - unit_counts
+        unit_in_household = (
+            self.person_marital_unit[people]
+            - unit_starts[self.person_household[people]]
+        )
+        selected_counts = unit_counts[positions]
+        new_unit_starts = np.cumsum(selected_counts) - selected_counts
+
+        index = {"person": people, "marital_unit": units}
+        inputs = {}
+        for entity_key, variables in self.inputs.items():
+            entities = index.get(entity_key, positions)
+            inputs[entity_key] = {
+                name: (values[entities], mask[entities])
+                for name, (values, mask) in variables.items()
+            }
+        return HouseholdArrays(
+            self.years[positions],
+            self.state_names[positions],
+            person_household,
+            self.person_kind[people],
+            new_unit_starts[person_household] + unit_in_household,
+            unit_household,
+            inputs,
+        )
+
+    def with_raised_earnings(self, delta):
+        """
+        Copy of the households with delta more earnings per tax unit.
+
+        The extra earnings are split between the taxpayer and spouse like
+        perturb_earnings does.
+        """
+        earnings, mask = self.inputs["person"]["employment_income"]
+        earner = self.person_kind != DEPENDENT
+        total = np.bincount(
+            self.person_household[earner],
+            weights=earnings[earner],
+            minlength=self.count,
+        )[self.person_household]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = np.where(
+                total > 0, earnings / total, (self.person_kind == HEAD).astype(float)
+            )
+        raised = np.where(earner & (share != 0), earnings + delta * share, earnings)
+
+        person_inputs = dict(self.inputs["person"])
+        person_inputs["employment_income"] = (raised, mask)
+        return HouseholdArrays(
+            self.years,
+            self.state_names,
+            self.person_household,
+            self.person_kind,
+            self.person_marital_unit,
+            self.marital_unit_household,
+            {**self.inputs, "person": person_inputs},
+        )
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Arrays of the households of several HouseholdArrays, in order."""
+        household_offsets = np.cumsum([0] + [part.count for part in parts])
+        unit_offsets = np.cumsum(
+            [0] + [len(part.marital_unit_household) for part in parts]
+        )
+
+        inputs = {}
+        for entity_key in dict.fromkeys(
+            key for part in parts for key in part.inputs
+        ):
+            names = dict.fromkeys(
+                name for part in parts for name in part.inputs.get(entity_key, {})
+            )
+            inputs[entity_key] = {}
+            for name in names:
+                reference = next(
+                    part.inputs[entity_key][name][0]
+                    for part in parts
+                    if name in part.inputs.get(entity_key, {})
+                )
+                values, masks = [], []
+                for part in parts:
+                    count = part.entity_count(entity_key)
+                    part_values, part_mask = part.inputs.get(entity_key, {}).get(
+                        name,
+                        (
+                            np.zeros(count, dtype=reference.dtype),
+                            np.zeros(count, dtype=bool),
+                        ),
+                    )
+                    values.append(part_values)
+                    masks.append(part_mask)
+                inputs[entity_key][name] = (
+                    np.concatenate(values),
+                    np.concatenate(masks),
+                )
+
+        return cls(
+            np.concatenate([part.years for part in parts]),
+            np.concatenate([part.state_names for part in parts]),
+            np.concatenate(
+                [
+                    part.person_household + offset
+                    for part, offset in zip(parts, household_offsets)
+                ]
+            ),
+            np.concatenate([part.person_kind for part in parts]),
+            np.concatenate(
+                [
+                    part.person_marital_unit + offset
+                    for part, offset in zip(parts, unit_offsets)
+                ]
+            ),
+            np.concatenate(
+                [
+                    part.marital_unit_household + offset
+                    for part, offset in zip(parts, household_offsets)
+                ]
+            ),
+            inputs,
+        )
+
+
+def map_households(inputs):
+    """
+    Convert TAXSIM input columns to PolicyEngine entity arrays.
+
+    The columnar counterpart of generate_household: the TAXSIM defaults,
+    state codes, household structure of mstat and depx and the input routes
+    of the mapping plan are applied to whole columns at once, and a
+    simulation of the households gives the same results as one built from
+    their situations.
+
+    Args:
+        inputs: pandas DataFrame or mapping of TAXSIM input names to arrays,
+            e.g. from records_to_columns
+
+    Returns:
+        HouseholdArrays: Entity arrays of the households, in input order
+
+    Raises:
+        KeyError: If there is no year column
+    """
+    with profiler.stage("map_households"):
+        plan = get_mapping_plan()
+        if "year" not in inputs:
+            raise KeyError("year")
+        values, present = get_column(inputs, "year")
+        years = to_int(values, present, "year")
+        count = len(years)
+
+        state_numbers = get_taxsim_default(inputs, "state", count)
+        numbers, inverse = np.unique(state_numbers, return_inverse=True)
+        state_codes = [
+            STATE_MAPPING.get(number, "Invalid state number")
+            for number in numbers.tolist()
+        ]
+        state_names = np.array(state_codes, dtype=object)[inverse.reshape(-1)]
+        married = get_taxsim_default(inputs, "mstat", count) == 2
+        dependents = np.maximum(get_taxsim_default(inputs, "depx", count), 0)
+
+        # People: taxpayer, spouse of joint filers, then dependents
+        person_counts = 1 + married + dependents
+        person_household = np.repeat(np.arange(count), person_counts)
+        person_starts = np.cumsum(person_counts) - person_counts
+        rank = np.arange(len(person_household)) - person_starts[person_household]
+        person_married = married[person_household]
+        person_kind = np.where(
+            rank == 0,
+            HEAD,
+            np.where(person_married & (rank == 1), SPOUSE, DEPENDENT),
+        )
+        dependent_number = np.where(
+            person_kind == DEPENDENT, rank - person_married, 0
+        )
+
+        # Marital units: taxpayer and spouse, then one per dependent
+        unit_counts = 1 + dependents
+        marital_unit_household = np.repeat(np.arange(count), unit_counts)
+        unit_starts = np.cumsum(unit_counts) - unit_counts
+        person_marital_unit = unit_starts[person_household] + dependent_number
+        unit_rank = (
+            np.arange(len(marital_unit_household))
+            - unit_starts[marital_unit_household]
+        )
+
+        is_head = person_kind == HEAD
+        is_spouse = person_kind == SPOUSE
+        everyone = np.ones(len(person_household), dtype=bool)
+
+        age = np.zeros(len(person_household), dtype=np.int64)
+        age[is_head] = get_with_default(inputs, "page", count, DEFAULT_ADULT_AGE)[
+            person_household[is_head]
+        ]
+        age[is_spouse] = get_with_default(inputs, "sage", count, DEFAULT_ADULT_AGE)[
+            person_household[is_spouse]
+        ]
+        for number in range(1, int(dependents.max(initial=0)) + 1):
+            people = np.flatnonzero(dependent_number == number)
+            age[people] = get_with_default(
+                inputs, f"age{number}", count, DEFAULT_DEPENDENT_AGE
+            )[person_household[people]]
+
+        earnings = np.zeros(len(person_household), dtype=np.float64)
+        for kind, field in ((HEAD, "pwages"), (SPOUSE, "swages")):
+            people = np.flatnonzero(person_kind == kind)
+            column = get_column(inputs, field)
+            if column is not None:
+                earnings[people] = to_float(*column)[person_household[people]]
+
+        person_inputs = {
+            "age": (age, everyone),
+            "employment_income": (earnings, everyone),
+            "is_tax_unit_head": (is_head, is_head),
+            "is_tax_unit_spouse": (is_spouse, is_spouse),
+        }
+        for member, field, fields in plan.person_routes:
+            route = route_values(inputs, fields)
+            if route is None:
+                continue
+            route_total, route_present = route
+            member_mask = (person_kind == ROUTE_MEMBERS[member]) & route_present[
+                person_household
+            ]
+            values, mask = person_inputs.get(
+                field, (np.zeros(len(person_household)), np.zeros_like(everyone))
+            )
+            values = np.where(member_mask, route_total[person_household], values)
+            person_inputs[field] = (values, mask | member_mask)
+
+        tax_unit_inputs = {}
+        for code in np.unique(state_names).tolist():
+            if code.lower() in plan.use_tax_states:
+                tax_unit_inputs[f"{code.lower()}_use_tax"] = (
+                    np.zeros(count),
+                    state_names == code,
+                )
+        all_households = np.ones(count, dtype=bool)
+        for field, fields in plan.tax_unit_routes:
+            if not fields:
+                tax_unit_inputs[field] = (np.zeros(count), all_households)
+                continue
+            route = route_values(inputs, fields)
+            if route is not None:
+                tax_unit_inputs[field] = route
+
+        inputs = {
+            "person": {
+                name: value for name, value in person_inputs.items() if value[1].any()
+            },
+            "marital_unit": {
+                "marital_unit_id": (unit_rank, unit_rank > 0),
+            },
+            "household": {"state_name": (state_names, all_households)},
+            "tax_unit": {
+                name: value
+                for name, value in tax_unit_inputs.items()
+                if value[1].any()
+            },
+        }
+        if not (unit_rank > 0).any():
+            del inputs["marital_unit"]["marital_unit_id"]
+
+        return HouseholdArrays(
+            years,
+            state_names,
+            person_household,
+            person_kind,
+            person_marital_unit,
+            marital_unit_household,
+            inputs,
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_simulation_class():
+    """policyengine_us.Simulation subclass that is built from HouseholdArrays."""
+    from policyengine_us import Simulation
+    from policyengine_core.simulations.simulation_builder import SimulationBuilder
+
+    class HouseholdArraysSimulation(Simulation):
+        """
+        Simulation of HouseholdArrays.
+
+        Core builds a simulation given populations before policyengine_us
+        post-processes its inputs (e.g. moving employment_income before labor
+        supply responses), so the entities and inputs are set up in
+        build_from_populations, at the point a situation would be parsed.
+        """
+
+        def __init__(self, households, period):
+            self._households = households
+            self._period = period
+            super().__init__(populations={})
+
+        def build_from_populations(self, populations):
+            households = self.__dict__.pop("_households", None)
+            if households is None:
+                return super().build_from_populations(populations)
+
+            system = self.tax_benefit_system
+            person_count = households.entity_count("person")
+            builder = SimulationBuilder()
+            builder.create_entities(system)
+            builder.declare_person_entity(
+                system.person_entity.key, np.arange(person_count)
+            )
+            roles = np.zeros(person_count, dtype=np.int64)
+            for entity in system.group_entities:
+                population = builder.declare_entity(
+                    entity.key, np.arange(households.entity_count(entity.key))
+                )
+                builder.join_with_persons(
+                    population, households.memberships(entity.key), roles
+                )
+            super().build_from_populations(builder.populations)
+
+            for entity_key, variables in households.inputs.items():
+                population = self.populations[entity_key]
+                for name, (values, mask) in variables.items():
+                    variable = system.get_variable(name)
+                    population.get_holder(name).set_input(
+                        self._period, input_array(variable, values, mask)
+                    )
+
+    return HouseholdArraysSimulation
+
+
+def input_array(variable, values, mask):
+    """Input array of a variable, with its default outside mask."""
+    if mask.all():
+        return values
+    if variable.value_type.__name__ == "Enum":
+        return np.where(mask, values, variable.default_value.name)
+    array = variable.default_array(len(mask))
+    array[mask] = values[mask]
+    return array
+
+
+def build_simulation(households, period):
+    """
+    PolicyEngine US simulation of HouseholdArrays.
+
+    Args:
+        households (HouseholdArrays): Households of one tax year
+        period (str): Tax year of the inputs
+
+    Returns:
+        policyengine_us.Simulation: The simulation
+    """
+    return get_simulation_class()(households, str(period))
+
+
+def input_names(households):
+    """Names the inputs of households are stored under in their simulation."""
+    return [
+        MOVED_INPUTS.get(name, name)
+        for variables in households.inputs.values()
+        for name in variables
+    ]
+
+
+def can_reset(simulation, households, period):
+    """
+    Whether reset_simulation can give a simulation other households' inputs.
+
+    Every input of the households must be stored under a known name, so
+    that setting it replaces the value the simulation was built with.
+    """
+    period = str(period)
+    return all(
+        any(str(known) == period for known in simulation.get_known_periods(name))
+        for name in input_names(households)
+    )
+
+
+def drop_calculated(simulation):
+    """
+    Drop every calculated value of a simulation, keeping its inputs.
+
+    This includes the branches formulas created to compare alternatives (e.g.
+    itemizing), which hold values of the inputs they were created from.
+    """
+    simulation.drop_computed_arrays()
+    simulation.branches.clear()
+
+
+def reset_simulation(simulation, households, period):
+    """
+    Give a simulation the inputs of other households of the same shape.
+
+    Every input is replaced with set_input, under the variable policyengine_us
+    moved it to, and every calculated value is dropped. The entities and the
+    formula machinery of the simulation are kept.
+
+    Args:
+        simulation (policyengine_us.Simulation): Simulation of households
+            with the same shape_key, from build_simulation
+        households (HouseholdArrays): The new households
+        period (str): Tax year of the inputs
+    """
+    system = simulation.tax_benefit_system
+    for variables in households.inputs.values():
+        for name, (values, mask) in variables.items():
+            simulation.set_input(
+                MOVED_INPUTS.get(name, name),
+                str(period),
+                input_array(system.get_variable(name), values, mask),
+            )
+    drop_calculated(simulation)
@@ -1,117 +1,162 @@
 from .utils import (
-    load_variable_mappings,
     get_state_code,
     get_ordinal,
 )
-import copy
+from .mapping_plan import get_mapping_plan
+from .profiling import profiler
+from dataclasses import dataclass
+import functools
 
+# Values of TAXSIM inputs that are missing or zero
+TAXSIM_DEFAULTS = {
+    "state": 44,  # Texas
+    "depx": 0,  # Number of dependents
+    "mstat": 1,  # Marital status
+    "taxsimid": 0,  # TAXSIM ID
+    "idtl": 0,  # output flag
+}
 
-def add_additional_units(state, year, situation, taxsim_vars):
 
-    additional_tax_units_config = load_variable_mappings()["taxsim_to_policyengine"][
-        "household_situation"
-    ]["additional_tax_units"]
-    additional_income_units_config = load_variable_mappings()["taxsim_to_policyengine"][
-        "household_situation"
-    ]["additional_income_units"]
+def add_additional_units(state, year, situation, taxsim_vars):
+    plan = get_mapping_plan()
 
     tax_unit = situation["tax_units"]["your tax unit"]
     people_unit = situation["people"]
 
-    for item in additional_tax_units_config:
-        for field, values in item.items():
-            if not values:
-                continue
-
-            if field == "state_use_tax":
-                if state.lower() in values:
-                    tax_unit[f"{state}_use_tax"] = {str(year): 0}
-                continue
-
-            if field == "state_sales_tax":
-                tax_unit["state_sales_tax"] = {str(year): 0}
-                continue
-
-            if len(values) > 1:
-                matching_values = [
-                    taxsim_vars.get(value, 0)
-                    for value in values
-                    if value in taxsim_vars
-                ]
-                if matching_values:
-                    tax_unit[field] = {str(year): sum(matching_values)}
-
-            elif len(values) == 1 and values[0] in taxsim_vars:
-                tax_unit[field] = {str(year): taxsim_vars[values[0]]}
-
-    for item in additional_income_units_config:
-        for field, values in item.items():
-            if not values:
-                continue
-
-            if field == "self_employment_income":
-                if "psemp" in taxsim_vars:
-                    people_unit["you"][field] = {str(year): taxsim_vars.get("psemp", 0)}
-                if "your partner" in people_unit and "ssemp" in taxsim_vars:
-                    people_unit["your partner"][field] = {
-                        str(year): taxsim_vars.get("ssemp", 0)
-                    }
-
-            elif len(values) > 1:
-                matching_values = [
-                    taxsim_vars.get(value, 0)
-                    for value in values
-                    if value in taxsim_vars
-                ]
-                if matching_values:
-                    people_unit["you"][field] = {str(year): sum(matching_values)}
-
-            elif len(values) == 1 and values[0] in taxsim_vars:
-                people_unit["you"][field] = {str(year): taxsim_vars[values[0]]}
+    if state.lower() in plan.use_tax_states:
+        tax_unit[f"{state}_use_tax"] = {str(year): 0}
+
+    for field, values in plan.tax_unit_routes:
+        if not values:
+            tax_unit[field] = {str(year): 0}
+            continue
+
+        matching_values = [
+            taxsim_vars.get(value, 0) for value in values if value in taxsim_vars
+        ]
+        if len(values) > 1 and matching_values:
+            tax_unit[field] = {str(year): sum(matching_values)}
+        elif len(values) == 1 and matching_values:
+            tax_unit[field] = {str(year): taxsim_vars[values[0]]}
+
+    for member, field, values in plan.person_routes:
+        if member not in people_unit:
+            continue
+
+        matching_values = [
+            taxsim_vars.get(value, 0) for value in values if value in taxsim_vars
+        ]
+        if len(values) > 1 and matching_values:
+            people_unit[member][field] = {str(year): sum(matching_values)}
+        elif len(values) == 1 and matching_values:
+            people_unit[member][field] = {str(year): taxsim_vars[values[0]]}
 
     return situation
 
 
-def form_household_situation(year, state, taxsim_vars):
-    mappings = load_variable_mappings()["taxsim_to_policyengine"]
-
-    household_situation = copy.deepcopy(mappings["household_situation"])
-    household_situation.pop("additional_tax_units", None)
-    household_situation.pop("additional_income_units", None)
+@dataclass(frozen=True)
+class HouseholdShape:
+    """
+    Structure of the situations of one household shape.
+
+    Attributes:
+        plurals: Entity groups of the situation, in order
+        entities: (plural, entity name, members, period keys) of every entity
+            besides the people, in situation order. The period keys are
+            the entity's variables other than members, e.g. state_name.
+        spouse: Name of the spouse, or None
+        dependents: Names of the dependents, in order
+        dependent_units: (marital unit name, marital_unit_id) of every
+            dependent's marital unit
+    """
 
-    depx = taxsim_vars["depx"]
-    mstat = taxsim_vars["mstat"]
+    plurals: tuple
+    entities: tuple
+    spouse: str
+    dependents: tuple
+    dependent_units: tuple
 
-    if mstat == 2:  # Married filing jointly
-        members = ["you", "your partner"]
-    else:  # Single, separate, or dependent taxpayer
-        members = ["you"]
 
-    for i in range(1, depx + 1):
-        members.append(f"your {get_ordinal(i)} dependent")
+@functools.lru_cache(maxsize=None)
+def get_household_shape(joint, depx):
+    """
+    Structure of the situations of households filing jointly or not, with
+    depx dependents.
 
-    household_situation["families"]["your family"]["members"] = members
-    household_situation["households"]["your household"]["members"] = members
-    household_situation["tax_units"]["your tax unit"]["members"] = members
+    The entities and member lists of a situation only depend on its shape, so
+    they are worked out once per shape, and form_household_situation only
+    fills in the values of a record.
 
-    household_situation["spm_units"]["your household"]["members"] = members
+    Args:
+        joint (bool): Married filing jointly (mstat 2)
+        depx (int): Number of dependents
 
+    Returns:
+        HouseholdShape: The cached structure
+    """
+    template = get_mapping_plan().household_template
+    adults = ("you", "your partner") if joint else ("you",)
+    dependents = tuple(f"your {get_ordinal(i)} dependent" for i in range(1, depx + 1))
+    members = adults + dependents
+
+    dependent_units = tuple(
+        (f"{dep_name}'s marital unit", i)
+        for i, dep_name in enumerate(dependents, start=1)
+    )
     if depx > 0:
-        household_situation["marital_units"] = {
+        marital_units = {"your marital unit": {"members": adults}}
+        for (unit_name, _), dep_name in zip(dependent_units, dependents):
+            marital_units[unit_name] = {
+                "members": (dep_name,),
+                "marital_unit_id": {},
+            }
+    else:
+        marital_units = {
             "your marital unit": {
-                "members": ["you", "your partner"] if mstat == 2 else ["you"]
+                **template["marital_units"]["your marital unit"],
+                "members": adults,
             }
         }
-        for i in range(1, depx + 1):
-            dep_name = f"your {get_ordinal(i)} dependent"
-            household_situation["marital_units"][f"{dep_name}'s marital unit"] = {
-                "members": [dep_name],
-                "marital_unit_id": {str(year): i},
-            }
-    else:
-        household_situation["marital_units"]["your marital unit"]["members"] = (
-            ["you", "your partner"] if mstat == 2 else ["you"]
-        )
+
+    entities = []
+    for plural, template_entities in template.items():
+        if plural == "people":
+            continue
+        if plural == "marital_units":
+            template_entities = marital_units
+        for name, entity in template_entities.items():
+            if plural != "marital_units":
+                entity_members = members
+            else:
+                entity_members = entity["members"]
+            period_keys = tuple(key for key in entity if key != "members")
+            entities.append((plural, name, tuple(entity_members), period_keys))
+
+    return HouseholdShape(
+        plurals=tuple(template),
+        entities=tuple(entities),
+        spouse="your partner" if joint else None,
+        dependents=dependents,
+        dependent_units=dependent_units,
+    )
+
+
+def form_household_situation(year, state, taxsim_vars):
+    depx = taxsim_vars["depx"]
+    mstat = taxsim_vars["mstat"]
+
+    shape = get_household_shape(mstat == 2, max(depx, 0))
+    household_situation = {plural: {} for plural in shape.plurals}
+    for plural, name, members, period_keys in shape.entities:
+        entity = {"members": list(members)}
+        for key in period_keys:
+            entity[key] = {}
+        household_situation[plural][name] = entity
+
+    for unit_name, marital_unit_id in shape.dependent_units:
+        household_situation["marital_units"][unit_name]["marital_unit_id"][
+            str(year)
+        ] = marital_unit_id
 
     household_situation["households"]["your household"]["state_name"][str(year)] = state
 
@@ -123,15 +168,14 @@ def form_household_situation(year, state, taxsim_vars):
         "is_tax_unit_head": {str(year): True},
     }
 
-    if mstat == 2:
-        people["your partner"] = {
+    if shape.spouse:
+        people[shape.spouse] = {
             "age": {str(year): int(taxsim_vars.get("sage", 40))},
             "employment_income": {str(year): float(taxsim_vars.get("swages", 0))},
             "is_tax_unit_spouse": {str(year): True},
         }
 
-    for i in range(1, depx + 1):
-        dep_name = f"your {get_ordinal(i)} dependent"
+    for i, dep_name in enumerate(shape.dependents, start=1):
         people[dep_name] = {
             "age": {str(year): int(taxsim_vars.get(f"age{i}", 10))},
             "employment_income": {str(year): 0},
@@ -161,15 +205,7 @@ def set_taxsim_defaults(taxsim_vars: dict) -> dict:
         - taxsimid: 0 (TAXSIM ID)
         - idtl: 0 (output flag)
     """
-    DEFAULTS = {
-        "state": 44,  # Texas
-        "depx": 0,  # Number of dependents
-        "mstat": 1,  # Marital status
-        "taxsimid": 0,  # TAXSIM ID
-        "idtl": 0,  # output flag
-    }
-
-    for key, default_value in DEFAULTS.items():
+    for key, default_value in TAXSIM_DEFAULTS.items():
         taxsim_vars[key] = int(taxsim_vars.get(key, default_value) or default_value)
 
     return taxsim_vars
@@ -185,13 +221,13 @@ def generate_household(taxsim_vars):
     Returns:
         dict: PolicyEngine situation dictionary
     """
+    with profiler.stage("generate_household"):
+        year = str(int(taxsim_vars["year"]))  # Ensure year is an integer string
 
-    year = str(int(taxsim_vars["year"]))  # Ensure year is an integer string
-
-    taxsim_vars = set_taxsim_defaults(taxsim_vars)
+        taxsim_vars = set_taxsim_defaults(taxsim_vars)
 
-    state = get_state_code(taxsim_vars["state"])
+        state = get_state_code(taxsim_vars["state"])
 
-    situation = form_household_situation(year, state, taxsim_vars)
+        situation = form_household_situation(year, state, taxsim_vars)
 
     return situation
@@ -0,0 +1,339 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+
+from .utils import load_variable_mappings, STATE_MAPPING
+
+OUTPUT_TYPES = (0, 2)
+FULL_TEXT_OUTPUT_TYPE = 5
+
+# Columns filled from the input record rather than from a PolicyEngine variable
+IDENTIFIER_COLUMNS = ("taxsimid", "year", "state")
+
+
+@dataclass(frozen=True)
+class OutputColumn:
+    """
+    A TAXSIM output column and the PolicyEngine variables behind it.
+
+    A marginal rate column reports the change of its variable, in percent,
+    when the household earns a little more.
+    """
+
+    name: str
+    variable: str
+    variables: tuple = ()
+    idtl: frozenset = frozenset()
+    special_cases: MappingProxyType = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    text_description: str = ""
+    full_text_group: str = ""
+    group_order: int = 0
+    group_column: int = 1
+    marginal_rate: bool = False
+
+    @property
+    def is_multiple(self):
+        return len(self.variables) > 0
+
+
+@dataclass(frozen=True)
+class TextGroup:
+    """A group of columns in the idtl 5 full text output."""
+
+    name: str
+    has_second_column: bool
+    columns: tuple
+
+
+@dataclass(frozen=True)
+class MappingPlan:
+    """
+    Immutable, pre-resolved form of variable_mappings.yaml.
+
+    Attributes:
+        columns: Implemented output columns, in mapping order
+        columns_by_idtl: Output columns emitted for idtl 0 and 2
+        text_groups: Groups of the idtl 5 text output, in print order
+        household_template: Base household situation, without the routing
+            sections. Must be copied before it is modified.
+        tax_unit_routes: (PolicyEngine field, TAXSIM inputs) for the tax unit.
+            A route without inputs sets the field to zero.
+        use_tax_states: Lowercase states that get a zero <state>_use_tax input
+        person_routes: (member, PolicyEngine field, TAXSIM inputs) for people
+        input_definitions: (TAXSIM field, config) pairs for the idtl 5 header
+        state_variables: Concrete PolicyEngine variable of every single-variable
+            column, per state code
+        output_variables: Distinct PolicyEngine variables calculated for a
+            (state code, idtl) pair
+    """
+
+    columns: tuple
+    columns_by_idtl: MappingProxyType
+    text_groups: tuple
+    household_template: dict
+    tax_unit_routes: tuple
+    use_tax_states: frozenset
+    person_routes: tuple
+    input_definitions: tuple
+    state_variables: MappingProxyType
+    output_variables: MappingProxyType
+
+    def select_columns(self, output_type, columns=None):
+        """
+        Output columns of an idtl 0 or 2 record.
+
+        Args:
+            output_type (int): idtl of the record
+            columns (tuple): Names of the requested columns, or None for all.
+                The identifier columns are always included.
+
+        Returns:
+            tuple: OutputColumns to calculate, in mapping order
+        """
+        output_columns = self.columns_by_idtl[output_type]
+        if columns is None:
+            return output_columns
+        return tuple(
+            column
+            for column in output_columns
+            if column.name in IDENTIFIER_COLUMNS or column.name in columns
+        )
+
+    def needs_marginal_rates(self, output_type, columns=None):
+        """Whether the output of an idtl needs the perturbed household."""
+        if output_type == FULL_TEXT_OUTPUT_TYPE:
+            return any(
+                column.marginal_rate or column.group_column == 2
+                for group in self.text_groups
+                for column in group.columns
+            )
+        return any(
+            column.marginal_rate
+            for column in self.select_columns(output_type, columns)
+        )
+
+    def state_variable(self, column, state_name):
+        """Concrete PolicyEngine variable of a single-variable column in a state."""
+        state_variables = self.state_variables.get(state_name)
+        if state_variables is None:
+            return resolve_variable(column, state_name)
+        return state_variables[column.name]
+
+
+def compile_output_column(name, each_item):
+    """Build an OutputColumn from one policyengine_to_taxsim mapping entry."""
+    first_special_cases = {}
+    for special_case in each_item.get("special_cases", []):
+        for state_initial, config in special_case.items():
+            first_special_cases.setdefault(state_initial, config)
+
+    # Special cases that are not implemented fall back to the default variable
+    special_cases = {
+        state_initial: config["variable"]
+        for state_initial, config in first_special_cases.items()
+        if config["implemented"]
+    }
+
+    return OutputColumn(
+        name=name,
+        variable=each_item["variable"],
+        variables=tuple(each_item.get("variables") or ()),
+        idtl=frozenset(value for entry in each_item["idtl"] for value in entry.values()),
+        special_cases=MappingProxyType(special_cases),
+        text_description=each_item.get("text_description", ""),
+        full_text_group=each_item.get("full_text_group", ""),
+        group_order=each_item.get("group_order", 0),
+        group_column=each_item.get("group_column", 1),
+        marginal_rate=each_item.get("marginal_rate", False),
+    )
+
+
+def compile_text_groups(columns):
+    """Group the full text columns the way the idtl 5 output prints them."""
+    groups = {}
+    group_orders = {}
+
+    for column in columns:
+        if (
+            column.full_text_group
+            and column.text_description
+            and FULL_TEXT_OUTPUT_TYPE in column.idtl
+        ):
+            if column.full_text_group not in groups:
+                groups[column.full_text_group] = []
+                group_orders[column.full_text_group] = column.group_order
+            groups[column.full_text_group].append(column)
+
+    sorted_groups = sorted(groups.keys(), key=lambda x: group_orders[x])
+    return tuple(
+        TextGroup(
+            name=group_name,
+            has_second_column=any(
+                column.group_column == 2 for column in groups[group_name]
+            ),
+            columns=tuple(
+                sorted(groups[group_name], key=lambda column: column.text_description)
+            ),
+        )
+        for group_name in sorted_groups
+    )
+
+
+def compile_input_routes(household_situation):
+    """Resolve the additional tax unit and income unit input routing."""
+    tax_unit_routes = []
+    use_tax_states = frozenset()
+    person_routes = []
+
+    for item in household_situation.get("additional_tax_units", []):
+        for pe_field, values in item.items():
+            if not values:
+                continue
+            if pe_field == "state_use_tax":
+                use_tax_states = frozenset(value.lower() for value in values)
+            elif pe_field == "state_sales_tax":
+                tax_unit_routes.append((pe_field, ()))
+            else:
+                tax_unit_routes.append((pe_field, tuple(values)))
+
+    for item in household_situation.get("additional_income_units", []):
+        for pe_field, values in item.items():
+            if not values:
+                continue
+            if pe_field == "self_employment_income":
+                person_routes.append(("you", pe_field, ("psemp",)))
+                person_routes.append(("your partner", pe_field, ("ssemp",)))
+            else:
+                person_routes.append(("you", pe_field, tuple(values)))
+
+    return tuple(tax_unit_routes), use_tax_states, tuple(person_routes)
+
+
+def compile_state_tables(columns, columns_by_idtl):
+    """Resolve the "state" substitution and special cases for every state."""
+    state_variables = {}
+    output_variables = {}
+
+    for state_name in STATE_MAPPING.values():
+        state_variables[state_name] = MappingProxyType(
+            {
+                column.name: resolve_variable(column, state_name)
+                for column in columns
+                if column.name not in IDENTIFIER_COLUMNS and not column.is_multiple
+            }
+        )
+
+        for output_type, output_columns in columns_by_idtl.items():
+            variables = []
+            for column in output_columns:
+                if column.name in IDENTIFIER_COLUMNS:
+                    continue
+                if column.is_multiple:
+                    variables.extend(column.variables)
+                else:
+                    variables.append(state_variables[state_name][column.name])
+            output_variables[(state_name, output_type)] = tuple(
+                dict.fromkeys(variables)
+            )
+
+    return MappingProxyType(state_variables), MappingProxyType(output_variables)
+
+
+def compile_mapping_plan(mappings):
+    """
+    Compile the raw variable mappings into a MappingPlan.
+
+    Args:
+        mappings (dict): Parsed variable_mappings.yaml
+
+    Returns:
+        MappingPlan: The compiled plan
+    """
+    columns = tuple(
+        compile_output_column(name, each_item)
+        for name, each_item in mappings["policyengine_to_taxsim"].items()
+        if each_item["implemented"]
+    )
+
+    columns_by_idtl = MappingProxyType(
+        {
+            output_type: tuple(
+                column for column in columns if output_type in column.idtl
+            )
+            for output_type in OUTPUT_TYPES
+        }
+    )
+
+    household_situation = mappings["taxsim_to_policyengine"]["household_situation"]
+    household_template = {
+        key: value
+        for key, value in household_situation.items()
+        if key not in ("additional_tax_units", "additional_income_units")
+    }
+    tax_unit_routes, use_tax_states, person_routes = compile_input_routes(
+        household_situation
+    )
+
+    input_definitions = tuple(
+        next(iter(mapping.items())) for mapping in mappings["taxsim_input_definition"]
+    )
+
+    state_variables, output_variables = compile_state_tables(columns, columns_by_idtl)
+
+    return MappingPlan(
+        columns=columns,
+        columns_by_idtl=columns_by_idtl,
+        text_groups=compile_text_groups(columns),
+        household_template=household_template,
+        tax_unit_routes=tax_unit_routes,
+        use_tax_states=use_tax_states,
+        person_routes=person_routes,
+        input_definitions=input_definitions,
+        state_variables=state_variables,
+        output_variables=output_variables,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_mapping_plan():
+    """Return the mapping plan, compiled once per process."""
+    return compile_mapping_plan(load_variable_mappings())
+
+
+def resolve_variable(column, state_name):
+    """Return the concrete PolicyEngine variable of a single-variable column."""
+    state_initial = state_name.lower()
+    pe_variable = column.special_cases.get(state_initial, column.variable)
+    return pe_variable.replace("state", state_initial)
+
+
+def parse_columns(text):
+    """
+    Parse a comma separated list of TAXSIM output columns.
+
+    Args:
+        text (str): Column names, e.g. "fiitax,siitax,v10"
+
+    Returns:
+        tuple: Column names, in the given order
+
+    Raises:
+        ValueError: If a name is not an implemented idtl 0 or 2 column
+    """
+    plan = get_mapping_plan()
+    known = {
+        column.name
+        for output_type in OUTPUT_TYPES
+        for column in plan.columns_by_idtl[output_type]
+    }
+    columns = tuple(
+        dict.fromkeys(name.strip() for name in text.split(",") if name.strip())
+    )
+    unknown = [name for name in columns if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown output columns: {', '.join(unknown)}")
+    if not columns:
+        raise ValueError("No output columns given")
+    return columns
@@ -1,104 +1,81 @@
 from .utils import (
-    load_variable_mappings,
     get_state_number,
     to_roundedup_number,
 )
-from policyengine_us import Simulation
-from policyengine_tests_generator.core.generator import PETestsYAMLGenerator
-
-disable_salt_variable = False
+from .mapping_plan import get_mapping_plan
+from .simulation import BatchSimulation
+from .run_config import RunConfig
+from .profiling import profiler
+from .yaml_logs import open_yaml_logs
 
 
 def generate_non_description_output(
-    taxsim_output, mappings, year, state_name, simulation, output_type, logs
+    taxsim_output,
+    columns,
+    year,
+    state_name,
+    simulation,
+    simulation_perturbed,
+    config,
 ):
+    plan = get_mapping_plan()
     outputs = []
-    for key, each_item in mappings.items():
-        if each_item["implemented"]:
-            if key == "taxsimid":
-                taxsim_output[key] = taxsim_output["taxsimid"]
-            elif key == "year":
-                taxsim_output[key] = int(year)
-            elif key == "state":
-                taxsim_output[key] = get_state_number(state_name)
-            elif "variables" in each_item and len(each_item["variables"]) > 0:
-                pe_variables = each_item["variables"]
-                taxsim_output[key] = simulate_multiple(simulation, pe_variables, year)
-            else:
-                pe_variable = each_item["variable"]
-                state_initial = state_name.lower()
-
-                if "state" in pe_variable:
-                    pe_variable = pe_variable.replace("state", state_initial)
-
-                for entry in each_item["idtl"]:
-                    if output_type in entry.values():
-
-                        if "special_cases" in each_item:
-                            found_state = next(
-                                (
-                                    each
-                                    for each in each_item["special_cases"]
-                                    if state_initial in each
-                                ),
-                                None,
-                            )
-                            if (
-                                found_state
-                                and found_state[state_initial]["implemented"]
-                            ):
-                                pe_variable = (
-                                    found_state[state_initial]["variable"].replace(
-                                        "state", state_initial
-                                    )
-                                    if "state" in found_state[state_initial]["variable"]
-                                    else found_state[state_initial]["variable"]
-                                )
-                        taxsim_output[key] = simulate(simulation, pe_variable, year)
-                        outputs.append(
-                            {"variable": pe_variable, "value": taxsim_output[key]}
-                        )
-
-    file_name = f"{taxsim_output['taxsimid']}-{state_name}.yaml"
-    generate_pe_tests_yaml(simulation.situation_input, outputs, file_name, logs)
+    for column in columns:
+        key = column.name
+        if key == "taxsimid":
+            taxsim_output[key] = taxsim_output["taxsimid"]
+        elif key == "year":
+            taxsim_output[key] = int(year)
+        elif key == "state":
+            taxsim_output[key] = get_state_number(state_name)
+        elif column.marginal_rate:
+            taxsim_output[key] = simulate_marginal_rate(
+                simulation,
+                simulation_perturbed,
+                plan.state_variable(column, state_name),
+                year,
+                config.marginal_rate_delta,
+            )
+        elif column.is_multiple:
+            taxsim_output[key] = simulate_multiple(simulation, column.variables, year)
+        else:
+            pe_variable = plan.state_variable(column, state_name)
+            taxsim_output[key] = simulate(simulation, pe_variable, year)
+            outputs.append({"variable": pe_variable, "value": taxsim_output[key]})
+
+    generate_pe_tests_yaml(
+        simulation.situation_input,
+        outputs,
+        taxsim_output["taxsimid"],
+        state_name,
+        config,
+    )
 
     return taxsim_output
 
 
-def generate_pe_tests_yaml(household, outputs, file_name, logs):
-    if logs:
-        generator = PETestsYAMLGenerator()
-        yaml_data = generator.generate_yaml(
-            household_data=household, name=file_name, pe_outputs=outputs
-        )
-        output = generator._get_yaml(yaml_data)
-        with open(file_name, "w") as f:
-            f.write(output)
+def generate_pe_tests_yaml(household, outputs, taxsimid, state_name, config):
+    """
+    Queue the PE YAML test log of a record if it is in the log sample.
+
+    The log is written by the background writer of the run's log directory
+    and format; outside a run, the writer is opened for this record alone.
+    """
+    if not config.logs_record(taxsimid):
+        return
+    with open_yaml_logs(config.log_settings) as writer:
+        writer.submit(household, outputs, f"{taxsimid}-{state_name}.yaml")
 
 
 def generate_text_description_output(
-    taxsim_input, mappings, year, state_name, simulation, simulation_1dollar_more, logs
+    taxsim_input,
+    text_groups,
+    year,
+    state_name,
+    simulation,
+    simulation_1dollar_more,
+    config,
 ):
-    groups = {}
-    group_orders = {}
-
-    for var_name, var_info in mappings.items():
-        if (
-            "full_text_group" in var_info
-            and "text_description" in var_info
-            and "implemented" in var_info
-            and var_info["implemented"] is True
-            and any(item.get("full_text", 0) == 5 for item in var_info["idtl"])
-        ):
-            group = var_info["full_text_group"]
-            group_order = var_info["group_order"]
-
-            if group not in groups:
-                groups[group] = []
-                group_orders[group] = group_order
-
-            groups[group].append((var_info["text_description"], var_name, var_info))
-
     # Configuration for formatting
     LEFT_MARGIN = 4
     LABEL_INDENT = 4
@@ -107,18 +84,13 @@ def generate_text_description_output(
     SECOND_VALUE_WIDTH = 12
     GROUP_MARGIN = LEFT_MARGIN  # Groups are 2 tabs left of text_description
 
+    plan = get_mapping_plan()
     lines = [""]
-    sorted_groups = sorted(groups.keys(), key=lambda x: group_orders[x])
     outputs = []
-    for group_name in sorted_groups:
-        variables = groups[group_name]
-        if variables:
-            # Check if this group has any variables with group_column = 2
-            has_second_column = any(
-                var_info.get("group_column", 1) == 2 for _, _, var_info in variables
-            )
-
-            if has_second_column:
+    for group in text_groups:
+        group_name = group.name
+        if group.columns:
+            if group.has_second_column:
                 # Group headers are 2 tabs left of text_description
                 line = f"{' ' * GROUP_MARGIN}{group_name}:"
                 padding = " " * (
@@ -133,14 +105,11 @@ def generate_text_description_output(
                 # Group headers are 2 tabs left of text_description
                 lines.append(f"{' ' * GROUP_MARGIN}{group_name}:")
 
-            state_initial = state_name.lower()
+            for column in group.columns:
+                desc = column.text_description
+                var_name = column.name
+                has_second_column = column.group_column == 2
 
-            for desc, var_name, each_item in sorted(variables, key=lambda x: x[0]):
-                variable = each_item["variable"]
-                has_second_column = each_item.get("group_column", 1) == 2
-
-                if "state" in variable:
-                    variable = variable.replace("state", state_name).lower()
                 if var_name == "taxsimid":
                     value = taxsim_input["taxsimid"]
                 elif var_name == "year":
@@ -149,26 +118,18 @@ def generate_text_description_output(
                     value = (
                         f"{get_state_number(state_name)}{' ' * LEFT_MARGIN}{state_name}"
                     )
-                elif "variables" in each_item and len(each_item["variables"]) > 0:
-                    value = simulate_multiple(simulation, each_item["variables"], year)
+                elif column.marginal_rate:
+                    value = simulate_marginal_rate(
+                        simulation,
+                        simulation_1dollar_more,
+                        plan.state_variable(column, state_name),
+                        year,
+                        config.marginal_rate_delta,
+                    )
+                elif column.is_multiple:
+                    value = simulate_multiple(simulation, column.variables, year)
                 else:
-                    if "special_cases" in each_item:
-                        found_state = next(
-                            (
-                                each
-                                for each in each_item["special_cases"]
-                                if state_initial in each
-                            ),
-                            None,
-                        )
-                        if found_state and found_state[state_initial]["implemented"]:
-                            variable = (
-                                found_state[state_initial]["variable"].replace(
-                                    "state", state_initial
-                                )
-                                if "state" in found_state[state_initial]["variable"]
-                                else found_state[state_initial]["variable"]
-                            )
+                    variable = plan.state_variable(column, state_name)
                     value = simulate(simulation, variable, year)
                     outputs.append({"variable": variable, "value": value})
 
@@ -180,31 +141,12 @@ def generate_text_description_output(
 
                 # Format second column value if needed
                 if has_second_column:
-                    if "variables" in each_item and len(each_item["variables"]) > 0:
+                    if column.is_multiple:
                         second_value = simulate_multiple(
-                            simulation_1dollar_more, each_item["variables"], year
+                            simulation_1dollar_more, column.variables, year
                         )
                     else:
-                        if "special_cases" in each_item:
-                            found_state = next(
-                                (
-                                    each
-                                    for each in each_item["special_cases"]
-                                    if state_initial in each
-                                ),
-                                None,
-                            )
-                            if (
-                                found_state
-                                and found_state[state_initial]["implemented"]
-                            ):
-                                variable = (
-                                    found_state[state_initial]["variable"].replace(
-                                        "state", state_initial
-                                    )
-                                    if "state" in found_state[state_initial]["variable"]
-                                    else found_state[state_initial]["variable"]
-                                )
+                        variable = plan.state_variable(column, state_name)
                         second_value = simulate(simulation_1dollar_more, variable, year)
 
                     if isinstance(second_value, (int, float)):
@@ -226,8 +168,13 @@ def generate_text_description_output(
 
             lines.append("")
 
-    file_name = f"{taxsim_input['taxsimid']}-{state_name}.yaml"
-    generate_pe_tests_yaml(simulation.situation_input, outputs, file_name, logs)
+    generate_pe_tests_yaml(
+        simulation.situation_input,
+        outputs,
+        taxsim_input["taxsimid"],
+        state_name,
+        config,
+    )
 
     return "\n".join(lines)
 
@@ -235,7 +182,7 @@ def generate_text_description_output(
 def taxsim_input_definition(data_dict, year, state_name):
     """Process a dictionary of data according to the configuration."""
     output_lines = []
-    mappings = load_variable_mappings()["taxsim_input_definition"]
+    input_definitions = get_mapping_plan().input_definitions
 
     # Header lines using year from input data
     current_year = data_dict.get("year", year)
@@ -250,8 +197,7 @@ def taxsim_input_definition(data_dict, year, state_name):
     SECOND_VALUE_WIDTH = 12
 
     # Process each field from mappings in order
-    for mapping in mappings:
-        field, config = next(iter(mapping.items()))
+    for field, config in input_definitions:
 
         # Check if field exists in data_dict
         if field in data_dict:
@@ -317,84 +263,120 @@ def taxsim_input_definition(data_dict, year, state_name):
     return "\n".join(output_lines)
 
 
-def add_a_dollar(data):
+def generate_household_output(
+    taxsim_input,
+    year,
+    state_name,
+    simulation,
+    simulation_perturbed,
+    config,
+):
     """
-    Recursively traverse through JSON data and add $1 to all employment_income values.
+    Build the TAXSIM output of one record from its simulation.
 
     Args:
-        data: Dict or list containing the JSON data
+        taxsim_input (dict): TAXSIM input dict, with defaults already set
+        year (str): Tax year
+        state_name (str): Two letter state code
+        simulation: Simulation of the record's household
+        simulation_perturbed: Simulation of the household with
+            config.marginal_rate_delta more earnings, or None
+        config (RunConfig): Options of the run
 
     Returns:
-        Updated data structure with modified employment_income values
+        dict or str: Output dict for idtl 0/2, full text for idtl 5
     """
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key == "employment_income" and isinstance(value, dict):
-                for year in value:
-                    value[year] += 1
-            elif isinstance(value, (dict, list)):
-                add_a_dollar(value)
-    elif isinstance(data, list):
-        for item in data:
-            if isinstance(item, (dict, list)):
-                add_a_dollar(item)
-
-    return data
-
-
-def export_household(taxsim_input, policyengine_situation, logs, disable_salt):
+    plan = get_mapping_plan()
+
+    taxsim_output = {}
+    taxsim_output["taxsimid"] = simulation.situation_input.get(
+        "taxsimid", taxsim_input["taxsimid"]
+    )
+    output_type = taxsim_input["idtl"]
+
+    if int(output_type) in [0, 2]:
+        with profiler.stage("output_mapping"):
+            return generate_non_description_output(
+                taxsim_output,
+                config.output_columns(output_type),
+                year,
+                state_name,
+                simulation,
+                simulation_perturbed,
+                config,
+            )
+    else:
+        with profiler.stage("text_rendering"):
+            input_definitions_lines = taxsim_input_definition(
+                taxsim_input, year, state_name
+            )
+            output = generate_text_description_output(
+                taxsim_input,
+                plan.text_groups,
+                year,
+                state_name,
+                simulation,
+                simulation_perturbed,
+                config,
+            )
+        return f"{input_definitions_lines}\n{output}\n"
+
+
+def export_household(
+    taxsim_input, policyengine_situation, logs=None, disable_salt=None, config=None
+):
     """
     Convert a PolicyEngine situation to TAXSIM output variables.
 
+    The household and its copy with config.marginal_rate_delta more earnings
+    are simulated together, so the marginal rates need no second simulation.
+    The copy is left out when the requested output has no marginal rate.
+
     Args:
+        taxsim_input (dict): TAXSIM input dict, with defaults already set
         policyengine_situation (dict): PolicyEngine situation dictionary
+        logs (bool): Generate PE YAML test logs, for a run without config
+        disable_salt (bool): Set SALT deduction to 0, for a run without config
+        config (RunConfig): Options of the run, or None for the defaults with
+            logs and disable_salt
 
     Returns:
         dict: Dictionary of TAXSIM output variables
+
+    Raises:
+        ValueError: If logs or disable_salt is passed together with config
     """
-    global disable_salt_variable
-    disable_salt_variable = disable_salt
+    if config is None:
+        config = RunConfig(bool(logs), bool(disable_salt))
+    elif logs is not None or disable_salt is not None:
+        raise ValueError(
+            "Pass logs and disable_salt in the RunConfig when a config is given"
+        )
 
-    mappings = load_variable_mappings()["policyengine_to_taxsim"]
-    
     # Extract the year and state name from the situation
     year = list(
         policyengine_situation["households"]["your household"]["state_name"].keys()
     )[0]
     state_name = policyengine_situation["households"]["your household"]["state_name"][year]
 
-    simulation = Simulation(situation=policyengine_situation)
-
-    # If state and local taxes should be set to zero, set it once on the simulation instance with the required period
-    if disable_salt:
-        simulation.set_input(variable_name="state_and_local_sales_or_income_tax", value=0.0, period=year)
-
-    taxsim_output = {}
-    taxsim_output["taxsimid"] = policyengine_situation.get(
-        "taxsimid", taxsim_input["taxsimid"]
+    batch = BatchSimulation(
+        [policyengine_situation],
+        year,
+        config.disable_salt,
+        (
+            config.marginal_rate_delta
+            if config.needs_marginal_rates(taxsim_input["idtl"])
+            else None
+        ),
+    )
+    return generate_household_output(
+        taxsim_input,
+        year,
+        state_name,
+        batch.record(0),
+        batch.perturbed_record(0),
+        config,
     )
-    output_type = taxsim_input["idtl"]
-
-    if int(output_type) in [0, 2]:
-        return generate_non_description_output(
-            taxsim_output, mappings, year, state_name, simulation, output_type, logs
-        )
-    else:
-        input_definitions_lines = taxsim_input_definition(taxsim_input, year, state_name)
-        a_dollar_more_situation = add_a_dollar(policyengine_situation)
-        simulation_a_dollar_more = Simulation(situation=a_dollar_more_situation)
-        if disable_salt:
-            simulation_a_dollar_more.set_input(variable_name="state_and_local_sales_or_income_tax", value=0.0, period=year)
-        output = generate_text_description_output(
-            taxsim_input,
-            mappings,
-            year,
-            state_name,
-            simulation,
-            simulation_a_dollar_more,
-            logs,
-        )
-        return f"{input_definitions_lines}\n{output}\n"
 
 
 def simulate(simulation, variable, year):
@@ -413,3 +395,21 @@ def simulate_multiple(simulation, variables, year):
     except Exception as error:
         total = 0.00
     return to_roundedup_number(total)
+
+
+def simulate_marginal_rate(simulation, simulation_perturbed, variable, year, delta):
+    """
+    Marginal rate of a variable, in percent, from a base and perturbed simulation.
+
+    The rate is taken from the unrounded values, since rounding both values to
+    cents first would swamp the change caused by a small delta.
+    """
+    if simulation_perturbed is None or not delta:
+        return 0.00
+    try:
+        base = simulation.calculate(variable, period=year)
+        perturbed = simulation_perturbed.calculate(variable, period=year)
+        rate = (float(perturbed[0]) - float(base[0])) / delta * 100
+    except Exception:
+        return 0.00
+    return to_roundedup_number(rate)
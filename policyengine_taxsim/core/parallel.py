@@ -0,0 +1,187 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .mapping_plan import get_mapping_plan
+from .cache import ResultCache
+from .batch import run_records, schedule_records, get_record_year_and_state
+from .run_config import RunConfig
+from .profiling import profiler
+
+# How the --jobs workers run: worker processes, or threads of this process
+EXECUTORS = ("process", "thread")
+
+# (year, state) buckets whose PolicyEngine US caches are warm in this process
+warm_buckets = set()
+
+
+def init_worker():
+    """Load PolicyEngine US and the mapping plan once per worker process."""
+    # Pre-import the tax-benefit system in the worker, before its first chunk
+    import policyengine_us  # noqa: F401
+
+    get_mapping_plan()
+
+
+def warm_up(taxsim_inputs, disable_salt=False):
+    """
+    Warm the PolicyEngine US caches of this process for a set of records.
+
+    Building the tax-benefit system and the first calculation of every
+    (year, state) bucket dominate the cost of a fresh process. One record per
+    bucket not yet warm is simulated and its result dropped, so that worker
+    processes forked afterwards start with the system built and the
+    parameters of those years loaded.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts, updated in place with defaults
+        disable_salt (bool): Set SALT deduction to 0
+
+    Returns:
+        int: Number of buckets warmed
+    """
+    representatives = {}
+    for position in schedule_records(taxsim_inputs):
+        bucket = get_record_year_and_state(taxsim_inputs[position])
+        if bucket not in warm_buckets and bucket not in representatives:
+            # idtl 2 calculates every output column
+            representatives[bucket] = dict(taxsim_inputs[position], idtl=2)
+
+    if representatives:
+        run_records(
+            list(representatives.values()),
+            RunConfig(disable_salt=disable_salt, batch_size=len(representatives)),
+        )
+        warm_buckets.update(representatives)
+    return len(representatives)
+
+
+def process_chunk(chunk):
+    """
+    Process one chunk of records in a worker.
+
+    A worker opens its own connection to the result cache, since a
+    connection cannot be shared between processes or threads. Worker
+    processes profile into their own profiler, whose records are returned;
+    worker threads record into the profiler of the process directly.
+
+    Returns the inputs with defaults set, the outputs, the cache hit and
+    miss counts of the chunk, and the stage profile when profiling.
+    """
+    taxsim_inputs, config, cache_settings, profile = chunk
+
+    if profile:
+        profiler.start()
+
+    cache = ResultCache(*cache_settings) if cache_settings else None
+    try:
+        taxsim_outputs = run_records(taxsim_inputs, config, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    profile_snapshot = profiler.snapshot() if profile else None
+    return taxsim_inputs, taxsim_outputs, hits, misses, profile_snapshot
+
+
+def run_records_parallel(taxsim_inputs, config, cache=None, deduplicator=None):
+    """
+    Run TAXSIM input records with the options of a run on a pool of workers.
+
+    The records are ordered into (year, state) buckets and split into chunks
+    of config.batch_size records, run on config.jobs workers. Results are put
+    back in input order, so the output matches a serial run exactly.
+
+    Worker threads share the PolicyEngine US system of this process instead
+    of loading their own copy, at the cost of sharing the GIL. The run
+    options are passed to every chunk in the RunConfig, and nothing is kept
+    in module state, so threads running chunks with different options, or
+    several runs of one process, do not interfere. config.warm_start is only
+    used with worker processes, where processes can be forked, and worker
+    processes write log bundles of their own.
+
+    Args:
+        taxsim_inputs (list): TAXSIM input dicts
+        config (RunConfig): Options of the run
+        cache (ResultCache): Optional on-disk result cache. Workers open their
+            own connection, and their hit and miss counts are added to it.
+        deduplicator (RecordDeduplicator): Optional deduplicator, so that
+            records identical apart from taxsimid are simulated once. Not used
+            when logs are requested.
+
+    Returns:
+        tuple: TAXSIM input dicts with defaults set, and outputs in input order
+
+    Raises:
+        ValueError: If config.executor is not one of EXECUTORS
+    """
+    if config.executor not in EXECUTORS:
+        raise ValueError(
+            f"Unknown executor {config.executor!r}, "
+            f"expected one of {', '.join(EXECUTORS)}"
+        )
+
+    if deduplicator is not None and not config.logs:
+        representatives = deduplicator.deduplicate(taxsim_inputs)
+        unique_positions = sorted(set(representatives))
+        _, unique_outputs = run_records_parallel(
+            [taxsim_inputs[position] for position in unique_positions], config, cache
+        )
+        taxsim_outputs = deduplicator.fan_out(
+            taxsim_inputs, representatives, dict(zip(unique_positions, unique_outputs))
+        )
+        return taxsim_inputs, taxsim_outputs
+
+    batch_size = config.batch_size
+    if config.jobs <= 1 or len(taxsim_inputs) <= batch_size:
+        taxsim_outputs = run_records(taxsim_inputs, config, cache)
+        return taxsim_inputs, taxsim_outputs
+
+    # Chunk records in (year, state) order so each worker simulates few buckets
+    order = schedule_records(taxsim_inputs)
+    cache_settings = (
+        (str(cache.cache_dir), cache.max_entries) if cache is not None else None
+    )
+    chunks = [
+        (
+            [taxsim_inputs[position] for position in order[start : start + batch_size]],
+            config,
+            cache_settings,
+            profiler.enabled and config.executor == "process",
+        )
+        for start in range(0, len(order), batch_size)
+    ]
+
+    workers = min(config.jobs, len(chunks))
+    if config.executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        context = None
+        if config.warm_start and "fork" in multiprocessing.get_all_start_methods():
+            warm_up(taxsim_inputs, config.disable_salt)
+            context = multiprocessing.get_context("fork")
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            mp_context=context,
+        )
+
+    processed_inputs = [None] * len(taxsim_inputs)
+    taxsim_outputs = [None] * len(taxsim_inputs)
+    with pool:
+        results = pool.map(process_chunk, chunks)
+        for start, (chunk_inputs, chunk_outputs, hits, misses, profile) in zip(
+            range(0, len(order), batch_size), results
+        ):
+            if cache is not None:
+                cache.hits += hits
+                cache.misses += misses
+            if profile is not None:
+                profiler.merge(profile)
+            for position, taxsim_input, taxsim_output in zip(
+                order[start : start + batch_size], chunk_inputs, chunk_outputs
+            ):
+                processed_inputs[position] = taxsim_input
+                taxsim_outputs[position] = taxsim_output
+
+    return processed_inputs, taxsim_outputs
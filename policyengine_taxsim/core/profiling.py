@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageProfiler:
+    """
+    Wall time of the processing stages of a run.
+
+    Stages may be nested: the self time of a stage excludes the time spent in
+    stages opened inside it, so self times add up to the profiled time. A
+    stage may carry a detail (e.g. the variable of a calculate call), which
+    is recorded separately as well. A disabled profiler records nothing.
+
+    Threads may record stages at the same time. Every thread nests its own
+    stages, so the self times of concurrent threads add up to more than the
+    wall time, as those of worker processes do.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.stages = {}
+        self.details = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        """Open stages of the current thread."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start(self):
+        """Enable the profiler and reset its records."""
+        self.enabled = True
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.details = {}
+        self._local = threading.local()
+
+    def stop(self):
+        self.enabled = False
+
+    @contextmanager
+    def stage(self, name, detail=None):
+        """Time the enclosed block as one call of a stage."""
+        if not self.enabled:
+            yield
+            return
+
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            seconds = time.perf_counter() - frame[0]
+            if self._stack:
+                self._stack[-1][1] += seconds
+            self.record(name, seconds, seconds - frame[1], detail)
+
+    def record(self, name, seconds, self_seconds=None, detail=None, calls=1):
+        """Add calls of a stage that were timed elsewhere."""
+        self_seconds = seconds if self_seconds is None else self_seconds
+        with self._lock:
+            entry = self.stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "self_seconds": 0.0}
+            )
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["self_seconds"] += self_seconds
+
+            if detail is not None:
+                detail_entry = self.details.setdefault(name, {}).setdefault(
+                    str(detail), {"calls": 0, "seconds": 0.0}
+                )
+                detail_entry["calls"] += calls
+                detail_entry["seconds"] += seconds
+
+    def snapshot(self):
+        """Stage and detail records, to be merged into another profiler."""
+        return {"stages": self.stages, "details": self.details}
+
+    def merge(self, snapshot):
+        """Add the records of another profiler, e.g. of a worker process."""
+        for name, entry in snapshot["stages"].items():
+            self.record(
+                name, entry["seconds"], entry["self_seconds"], calls=entry["calls"]
+            )
+        with self._lock:
+            for name, details in snapshot["details"].items():
+                for detail, entry in details.items():
+                    detail_entry = self.details.setdefault(name, {}).setdefault(
+                        detail, {"calls": 0, "seconds": 0.0}
+                    )
+                    detail_entry["calls"] += entry["calls"]
+                    detail_entry["seconds"] += entry["seconds"]
+
+    def report(self):
+        """
+        Machine readable profile of the run.
+
+        Returns:
+            dict: Wall time since start, stages sorted by self time, and the
+                details of every stage sorted by time
+        """
+        wall_seconds = time.perf_counter() - self.started if self.started else 0.0
+        return {
+            "wall_seconds": wall_seconds,
+            "stages": dict(
+                sorted(
+                    self.stages.items(),
+                    key=lambda item: item[1]["self_seconds"],
+                    reverse=True,
+                )
+            ),
+            "details": {
+                name: dict(
+                    sorted(
+                        details.items(),
+                        key=lambda item: item[1]["seconds"],
+                        reverse=True,
+                    )
+                )
+                for name, details in self.details.items()
+            },
+        }
+
+    def write_report(self, path, **sections):
+        """Write the report as JSON, with extra sections (e.g. column costs)."""
+        with open(path, "w") as f:
+            json.dump({**self.report(), **sections}, f, indent=2)
+
+    def summary_table(self, top_details=10):
+        """Human readable table of the stages and the slowest details."""
+        report = self.report()
+        wall_seconds = report["wall_seconds"] or 1.0
+
+        lines = [
+            f"{'stage':<28}{'calls':>10}{'self s':>12}{'total s':>12}{'share':>9}"
+        ]
+        for name, entry in report["stages"].items():
+            lines.append(
+                f"{name:<28}{entry['calls']:>10}{entry['self_seconds']:>12.3f}"
+                f"{entry['seconds']:>12.3f}{entry['self_seconds'] / wall_seconds:>9.1%}"
+            )
+        lines.append(f"{'wall time':<28}{'':>10}{report['wall_seconds']:>12.3f}")
+
+        for name, details in report["details"].items():
+            lines.append("")
+            lines.append(f"{'slowest ' + name:<50}{'calls':>10}{'total s':>12}")
+            for detail, entry in list(details.items())[:top_details]:
+                lines.append(f"{detail:<50}{entry['calls']:>10}{entry['seconds']:>12.3f}")
+
+        return "\n".join(lines)
+
+
+# Profiler of the current process
+profiler = StageProfiler()
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+
+from .mapping_plan import get_mapping_plan
+from .simulation import DEFAULT_MARGINAL_RATE_DELTA
+from .yaml_logs import LogSettings, is_sampled
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    Options of a run, shared by every record it simulates.
+
+    The command line builds the RunConfig of a run once from its options and
+    passes it down to the mapper functions, which read the options of their
+    run from it instead of from module state, so runs with different options
+    can share a process and its threads. The idtl is an input field of every record;
+    output_columns and needs_marginal_rates give what the options mean for a
+    record of a given idtl.
+
+    Attributes:
+        logs: Generate PE YAML test logs
+        disable_salt: Set SALT deduction to 0
+        marginal_rate_delta: Extra earnings used for the marginal rates
+        columns: Output columns of idtl 0/2 records, or None for all
+        log_settings: Where the logs are written, and for how many records
+        batch_size: Maximum number of records per simulation and per chunk
+        jobs: Number of worker processes or threads
+        warm_start: Warm this process up before forking worker processes
+        executor: Run the workers as "process"es or "thread"s
+    """
+
+    logs: bool = False
+    disable_salt: bool = False
+    marginal_rate_delta: float = DEFAULT_MARGINAL_RATE_DELTA
+    columns: tuple = None
+    log_settings: LogSettings = LogSettings()
+    batch_size: int = DEFAULT_BATCH_SIZE
+    jobs: int = 1
+    warm_start: bool = False
+    executor: str = "process"
+
+    def logs_record(self, taxsimid):
+        """Whether the record of a taxsimid gets a PE YAML test log."""
+        return self.logs and is_sampled(taxsimid, self.log_settings.sample)
+
+    def output_columns(self, output_type):
+        """Output columns of records of an idtl 0/2 output type."""
+        return get_mapping_plan().select_columns(int(output_type), self.columns)
+
+    def needs_marginal_rates(self, output_type):
+        """Whether records of an output type need the perturbed households."""
+        return get_mapping_plan().needs_marginal_rates(int(output_type), self.columns)
@@ -0,0 +1,132 @@
+import sys
+
+from .mapping_plan import IDENTIFIER_COLUMNS
+
+DEFAULT_END_MARKER = "%%END"
+
+
+def split_fields(line):
+    """Fields of a CSV line, without surrounding spaces and quotes."""
+    return [field.strip().strip('"') for field in line.split(",")]
+
+
+def is_number(field):
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def is_header_line(line):
+    """
+    Whether a CSV line is a TAXSIM header.
+
+    Every field of a header is a column name, and one of them is a TAXSIM
+    identifier column (taxsimid, year or state). A record whose taxsimid is
+    empty or malformed is not a header, however its other fields look.
+    """
+    fields = split_fields(line)
+    return all(field and not is_number(field) for field in fields) and any(
+        field in IDENTIFIER_COLUMNS for field in fields
+    )
+
+
+def read_micro_batches(input_stream, max_records):
+    """
+    Split a stream of TAXSIM CSV lines into micro-batches.
+
+    The stream starts with a TAXSIM header line. A blank line, a new header
+    line, the end of the stream or max_records records end a micro-batch.
+    Records after a new header line are read with that header. A line that
+    is neither a header nor a record with a numeric first field fails its
+    micro-batch, which is yielded as the ValueError describing the line.
+
+    Args:
+        input_stream: Text stream of TAXSIM CSV lines
+        max_records (int): Maximum number of records per micro-batch
+
+    Yields:
+        str: CSV text of one micro-batch, with its header line, or the
+            ValueError of a micro-batch with an invalid line
+
+    Raises:
+        ValueError: If the stream does not start with a header line
+    """
+    header = None
+    records = []
+    error = None
+
+    def flush():
+        nonlocal error
+        batch = "\n".join([header, *records]) + "\n" if error is None else error
+        records.clear()
+        error = None
+        return batch
+
+    for line in iter(input_stream.readline, ""):
+        line = line.strip()
+        if not line:
+            if records:
+                yield flush()
+        elif header is None:
+            if is_number(split_fields(line)[0]):
+                raise ValueError("TAXSIM input must start with a header line")
+            header = line
+        elif is_header_line(line):
+            if records:
+                yield flush()
+            header = line
+        else:
+            if error is None and not is_number(split_fields(line)[0]):
+                error = ValueError(
+                    f"Invalid TAXSIM record {line!r}: its first field is not a "
+                    "number, and the line is not a header"
+                )
+            records.append(line)
+            if len(records) >= max_records:
+                yield flush()
+
+    if records:
+        yield flush()
+
+
+def serve_stream(
+    input_stream,
+    output_stream,
+    process_batch,
+    max_records,
+    end_marker=DEFAULT_END_MARKER,
+):
+    """
+    Answer TAXSIM micro-batches read from a stream until it ends.
+
+    The output of every micro-batch is written and flushed as soon as it is
+    ready, followed by the end marker line, so a client can tell where the
+    answer to its batch ends. A micro-batch that fails, or that has an
+    invalid line, is reported on stderr and still answered with the end
+    marker.
+
+    Args:
+        input_stream: Text stream of TAXSIM CSV lines
+        output_stream: Text stream the outputs are written to
+        process_batch (callable): Returns the output text of a CSV micro-batch
+        max_records (int): Maximum number of records per micro-batch
+        end_marker (str): Line written after every answer. Empty to disable.
+
+    Returns:
+        int: Number of micro-batches answered
+    """
+    batches = 0
+    for csv_text in read_micro_batches(input_stream, max_records):
+        try:
+            if isinstance(csv_text, ValueError):
+                raise csv_text
+            output_stream.write(process_batch(csv_text))
+        except Exception as e:
+            print(f"Error processing input: {str(e)}", file=sys.stderr, flush=True)
+        if end_marker:
+            output_stream.write(f"{end_marker}\n")
+        output_stream.flush()
+        batches += 1
+    return batches
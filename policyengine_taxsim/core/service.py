@@ -0,0 +1,303 @@
+import json
+import os
+import queue
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import numpy as np
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WINDOW_MS = 10.0
+
+# Sentinel that stops the coalescer thread
+STOP = object()
+
+
+class RequestCoalescer:
+    """
+    Combine concurrent requests into one batched evaluation.
+
+    The first request of a batch opens a latency window. Requests arriving
+    within window seconds, up to max_records records in total, are evaluated
+    together with one call of process_records, and every request gets back
+    its own slice of the results. Evaluations run one at a time on a
+    background thread.
+
+    A request whose records fail validation gets its error before the batch
+    is merged. If the batched evaluation still fails, the requests are
+    evaluated one by one, so only the failing request gets the error.
+    """
+
+    def __init__(self, process_records, window, max_records, validate_records=None):
+        """
+        Args:
+            process_records (callable): Takes a list of TAXSIM input dicts and
+                returns the processed inputs and outputs, like
+                run_records_parallel with the RunConfig of the service
+            window (float): Latency window in seconds
+            max_records (int): Records that close a batch before the window ends
+            validate_records (callable): Optional check of the records of one
+                request, like check_records, raising on invalid records
+        """
+        self.process_records = process_records
+        self.window = window
+        self.max_records = max_records
+        self.validate_records = validate_records
+        self.requests = 0
+        self.batches = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, taxsim_inputs):
+        """Queue the records of one request, returning a Future of its results."""
+        future = Future()
+        self._queue.put((list(taxsim_inputs), future))
+        return future
+
+    def evaluate(self, taxsim_inputs):
+        """
+        Evaluate the records of one request together with concurrent requests.
+
+        Returns:
+            tuple: TAXSIM input dicts with defaults set, and outputs
+        """
+        return self.submit(taxsim_inputs).result()
+
+    def close(self):
+        """Evaluate the queued requests and stop the background thread."""
+        self._queue.put(STOP)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is STOP:
+            return None
+
+        pending = [first]
+        records = len(first[0])
+        deadline = time.monotonic() + self.window
+        while records < self.max_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is STOP:
+                self._queue.put(STOP)
+                break
+            pending.append(item)
+            records += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+            self._evaluate(pending)
+
+    def _evaluate(self, pending):
+        if self.validate_records is not None:
+            pending = [
+                (request_inputs, future)
+                for request_inputs, future in pending
+                if self._validate(request_inputs, future)
+            ]
+            if not pending:
+                return
+
+        taxsim_inputs = [
+            taxsim_input for request_inputs, _ in pending for taxsim_input in request_inputs
+        ]
+        try:
+            processed_inputs, taxsim_outputs = self.process_records(taxsim_inputs)
+        except Exception as error:
+            if len(pending) > 1:
+                # Find the failing request, so it does not fail the others
+                for item in pending:
+                    self._evaluate([item])
+            else:
+                pending[0][1].set_exception(error)
+            return
+
+        self.requests += len(pending)
+        self.batches += 1
+        start = 0
+        for request_inputs, future in pending:
+            end = start + len(request_inputs)
+            future.set_result((processed_inputs[start:end], taxsim_outputs[start:end]))
+            start = end
+
+    def _validate(self, request_inputs, future):
+        try:
+            self.validate_records(request_inputs)
+        except Exception as error:
+            future.set_exception(error)
+            return False
+        return True
+
+    def summary(self):
+        """Human readable coalescing counts."""
+        return f"Coalescing: {self.requests} requests in {self.batches} evaluations"
+
+
+def check_records(taxsim_inputs):
+    """
+    Check that TAXSIM records can be simulated.
+
+    Every record needs a year, and every value must be a number.
+
+    Raises:
+        ValueError: On the first invalid record
+    """
+    for taxsim_input in taxsim_inputs:
+        taxsimid = taxsim_input.get("taxsimid")
+        if "year" not in taxsim_input:
+            raise ValueError(f"Record {taxsimid} has no year")
+        for name, value in taxsim_input.items():
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    f"Record {taxsimid} has a non-numeric {name}: {value!r}"
+                ) from None
+            if name == "year" and np.isnan(number):
+                raise ValueError(f"Record {taxsimid} has no year")
+
+
+def json_default(value):
+    """Serialise the numpy numbers of TAXSIM outputs."""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return round(float(value), 2)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def parse_records(body, content_type):
+    """
+    Parse the TAXSIM records of a request body.
+
+    Args:
+        body (str): Request body
+        content_type (str): text/csv for TAXSIM CSV, JSON otherwise
+
+    Returns:
+        list: TAXSIM input dicts
+    """
+    if content_type == "text/csv":
+        import pandas as pd
+
+        df = pd.read_csv(StringIO(body))
+        return [row.to_dict() for _, row in df.iterrows()]
+
+    records = json.loads(body)
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list) or not all(
+        isinstance(record, dict) for record in records
+    ):
+        raise ValueError("JSON body must be a TAXSIM record or a list of records")
+    return records
+
+
+class TaxsimRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of the TAXSIM service.
+
+    POST records as JSON (a record object or a list of them) to get a JSON
+    list of outputs, or as TAXSIM CSV (Content-Type: text/csv) to get the
+    output text of a file run. GET /health answers "ok".
+    """
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self.send_body(200, "ok\n", "text/plain")
+        else:
+            self.send_body(404, "Not found\n", "text/plain")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        content_type = (
+            self.headers.get("Content-Type", "application/json").split(";")[0].strip()
+        )
+
+        try:
+            taxsim_inputs = parse_records(body, content_type)
+        except Exception as e:
+            self.send_body(400, f"Error parsing input: {str(e)}\n", "text/plain")
+            return
+
+        try:
+            taxsim_inputs, taxsim_outputs = self.server.coalescer.evaluate(taxsim_inputs)
+        except Exception as e:
+            self.send_body(500, f"Error processing input: {str(e)}\n", "text/plain")
+            return
+
+        if content_type == "text/csv":
+            output = self.server.format_output(taxsim_inputs, taxsim_outputs)
+            self.send_body(200, output, "text/csv")
+        else:
+            output = json.dumps(taxsim_outputs, default=json_default)
+            self.send_body(200, output, "application/json")
+
+    def send_body(self, status, text, content_type):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # One line per request is too noisy at high request rates
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(
+    coalescer, format_output, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None
+):
+    """
+    Create the HTTP server of the TAXSIM service.
+
+    Args:
+        coalescer (RequestCoalescer): Evaluates the records of the requests
+        format_output (callable): Formats inputs and outputs as TAXSIM text,
+            for CSV requests
+        host (str): Host to listen on over TCP
+        port (int): Port to listen on over TCP
+        socket_path (str): Listen on this Unix socket instead of TCP. A stale
+            socket file at the path is replaced.
+
+    Returns:
+        socketserver.BaseServer: Server ready for serve_forever
+    """
+    if socket_path:
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, TaxsimRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), TaxsimRequestHandler)
+
+    server.coalescer = coalescer
+    server.format_output = format_output
+    return server
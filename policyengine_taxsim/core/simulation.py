@@ -0,0 +1,366 @@
+from collections import OrderedDict
+
+from .household_arrays import (
+    HouseholdArrays,
+    build_simulation,
+    can_reset,
+    drop_calculated,
+    get_simulation_class,
+    reset_simulation,
+)
+from .profiling import profiler
+
+# PolicyEngine calculates in float32, whose rounding at high incomes outweighs
+# the tax on a $1 raise, so marginal rates use $100 like TAXSIM
+DEFAULT_MARGINAL_RATE_DELTA = 100.0
+
+# Simulations a SimulationPool keeps for reuse
+DEFAULT_POOL_SIZE = 32
+
+# Plural situation keys mapped to the PolicyEngine entity keys
+ENTITY_KEYS = {
+    "people": "person",
+    "families": "family",
+    "households": "household",
+    "marital_units": "marital_unit",
+    "spm_units": "spm_unit",
+    "tax_units": "tax_unit",
+}
+
+# Members whose earnings are raised to compute marginal rates
+EARNERS = ("you", "your partner")
+
+
+def combine_situations(situations):
+    """
+    Merge per-record PolicyEngine situations into one multi-household situation.
+
+    Every entity and member name is prefixed with the record position, so the
+    households stay independent inside the combined simulation.
+
+    Args:
+        situations (list): Per-record situations from generate_household
+
+    Returns:
+        tuple: The combined situation and, for each record, a dict of the index
+            of its first entity per PolicyEngine entity key
+    """
+    combined = {plural: {} for plural in ENTITY_KEYS}
+    counts = {entity_key: 0 for entity_key in ENTITY_KEYS.values()}
+    offsets = []
+
+    for position, situation in enumerate(situations):
+        prefix = f"{position}:"
+        offsets.append(dict(counts))
+
+        for plural, entity_key in ENTITY_KEYS.items():
+            for name, entity in situation.get(plural, {}).items():
+                entity = dict(entity)
+                if "members" in entity:
+                    entity["members"] = [
+                        f"{prefix}{member}" for member in entity["members"]
+                    ]
+                combined[plural][f"{prefix}{name}"] = entity
+                counts[entity_key] += 1
+
+    return combined, offsets
+
+
+def get_batch_state_name(situations):
+    """State code shared by the households of a batch, or "mixed"."""
+    state_names = {
+        state_name
+        for situation in situations
+        for state_name in situation["households"]["your household"][
+            "state_name"
+        ].values()
+    }
+    return state_names.pop() if len(state_names) == 1 else "mixed"
+
+
+def perturb_earnings(situation, delta):
+    """
+    Copy of a situation with delta more earnings for the tax unit.
+
+    The extra earnings are split between the taxpayer and spouse by their
+    share of employment income, so marginal rates are taken with respect to
+    weighted average earnings. Without earnings, all of delta goes to the
+    taxpayer. The input situation is not modified.
+
+    Args:
+        situation (dict): PolicyEngine situation from generate_household
+        delta (float): Extra earnings
+
+    Returns:
+        dict: Perturbed situation
+    """
+    people = situation["people"]
+    earners = [name for name in EARNERS if name in people]
+    earnings = {
+        name: sum(people[name].get("employment_income", {}).values())
+        for name in earners
+    }
+    total_earnings = sum(earnings.values())
+
+    perturbed_people = dict(people)
+    for name in earners:
+        if total_earnings > 0:
+            share = earnings[name] / total_earnings
+        else:
+            share = 1 if name == "you" else 0
+        if not share:
+            continue
+
+        person = dict(people[name])
+        person["employment_income"] = {
+            year: value + delta * share
+            for year, value in person.get("employment_income", {}).items()
+        }
+        perturbed_people[name] = person
+
+    return {**situation, "people": perturbed_people}
+
+
+def set_salt_to_zero(simulation, year, tax_unit_count):
+    """Set the SALT deduction of every tax unit of a simulation to zero."""
+    simulation.set_input(
+        variable_name="state_and_local_sales_or_income_tax",
+        value=[0.0] * tax_unit_count,
+        period=year,
+    )
+
+
+class BatchSimulation:
+    """
+    One PolicyEngine simulation of many households.
+
+    With a marginal rate delta, a copy of every household with delta more
+    earnings is added to the same simulation, so base and perturbed values
+    come from one set of calculate calls. Each variable is calculated once
+    per period, and RecordSimulation views hand out the value of one record.
+    """
+
+    def __init__(
+        self, situations, year, disable_salt=False, marginal_rate_delta=None
+    ):
+        # Loading PolicyEngine US builds the tax-benefit system, so it is
+        # imported when the first simulation runs rather than at startup
+        with profiler.stage("import_policyengine_us"):
+            from policyengine_us import Simulation
+
+        with profiler.stage("simulation_construction"):
+            self.situations = list(situations)
+            self.state_name = get_batch_state_name(self.situations)
+            self.perturbed_situations = (
+                [
+                    perturb_earnings(situation, marginal_rate_delta)
+                    for situation in self.situations
+                ]
+                if marginal_rate_delta
+                else []
+            )
+
+            combined, self.offsets = combine_situations(
+                self.situations + self.perturbed_situations
+            )
+            self.simulation = Simulation(situation=combined)
+
+            if disable_salt:
+                set_salt_to_zero(self.simulation, year, len(combined["tax_units"]))
+
+        self._results = {}
+
+    def calculate(self, variable, period):
+        """
+        Calculate a variable for all households of the batch.
+
+        Returns:
+            tuple: The variable's entity key and its values
+        """
+        key = (variable, str(period))
+        if key not in self._results:
+            try:
+                entity_key = self.simulation.tax_benefit_system.variables[
+                    variable
+                ].entity.key
+                with profiler.stage("calculate", f"{self.state_name}:{variable}"):
+                    values = self.simulation.calculate(variable, period=period)
+                self._results[key] = (entity_key, values)
+            except Exception as error:
+                self._results[key] = error
+
+        result = self._results[key]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def record(self, position):
+        """Simulation view of the household of one record."""
+        return RecordSimulation(self, position, self.situations[position])
+
+    def perturbed_record(self, position):
+        """Simulation view of the perturbed household of one record."""
+        if not self.perturbed_situations:
+            return None
+        return RecordSimulation(
+            self,
+            len(self.situations) + position,
+            self.perturbed_situations[position],
+        )
+
+
+class HouseholdArraysBatchSimulation(BatchSimulation):
+    """
+    BatchSimulation of households given as HouseholdArrays.
+
+    The simulation is built from the entity arrays directly, without
+    situation dicts. The records' situation_input is empty, so their
+    simulations cannot be logged as PE YAML tests.
+    """
+
+    def __init__(
+        self, households, year, disable_salt=False, marginal_rate_delta=None
+    ):
+        with profiler.stage("import_policyengine_us"):
+            get_simulation_class()
+
+        with profiler.stage("simulation_construction"):
+            self._set_households(households, marginal_rate_delta)
+            self.simulation = build_simulation(self.households, year)
+
+            if disable_salt:
+                set_salt_to_zero(self.simulation, year, self.households.count)
+
+        self._results = {}
+
+    def _set_households(self, households, marginal_rate_delta):
+        """Set the households of the batch and the arrays they are simulated as."""
+        state_names = set(households.state_names.tolist())
+        self.state_name = state_names.pop() if len(state_names) == 1 else "mixed"
+        self.situations = [{}] * households.count
+        parts = [households]
+        if marginal_rate_delta:
+            self.perturbed_situations = self.situations
+            parts.append(households.with_raised_earnings(marginal_rate_delta))
+        else:
+            self.perturbed_situations = []
+
+        self.households = HouseholdArrays.concatenate(parts)
+        self.offsets = self.households.offsets()
+
+    def reset(self, households, year, marginal_rate_delta=None):
+        """
+        Simulate other households of the same shape in this simulation.
+
+        The input values are replaced and the calculated values dropped, see
+        reset_simulation. The SALT setting of the batch is kept.
+
+        Args:
+            households (HouseholdArrays): Households with the shape_key of the
+                current ones
+            year (str): Tax year of the households
+            marginal_rate_delta (float): Extra earnings used for the marginal
+                rates, the same as the batch was built with
+        """
+        with profiler.stage("simulation_reset"):
+            self._set_households(households, marginal_rate_delta)
+            reset_simulation(self.simulation, self.households, year)
+        self._results = {}
+
+    def release(self):
+        """Drop the calculated values, which a kept simulation does not need."""
+        drop_calculated(self.simulation)
+        self._results = {}
+
+
+class SimulationPool:
+    """
+    HouseholdArraysBatchSimulations kept for reuse by household shape and
+    (year, state).
+
+    Building a simulation sets up its entities and formula machinery, which
+    costs more than calculating a single household. A batch with the shape,
+    year and state of a kept simulation resets the inputs of that simulation
+    instead of building a new one. This pays off where records cannot be
+    batched together, e.g. with a batch size of 1. The least recently used
+    simulations are dropped beyond max_simulations.
+
+    Only the batch handed out last keeps its calculated values. The others
+    keep their entities and inputs, since the values calculated for some
+    states take hundreds of MB.
+    """
+
+    def __init__(self, max_simulations=DEFAULT_POOL_SIZE):
+        self.max_simulations = max_simulations
+        self.built = 0
+        self.reused = 0
+        self._batches = OrderedDict()
+        self._current = None
+
+    def get(self, households, year, disable_salt=False, marginal_rate_delta=None):
+        """
+        BatchSimulation of households, reusing a kept simulation if possible.
+
+        The batch is only valid until the next call.
+
+        Args:
+            households (HouseholdArrays): Households of one tax year
+            year (str): Tax year of the households
+            disable_salt (bool): Set SALT deduction to 0
+            marginal_rate_delta (float): Extra earnings used for the marginal
+                rates, or None without marginal rates
+
+        Returns:
+            HouseholdArraysBatchSimulation: The batch
+        """
+        key = (
+            str(year),
+            tuple(households.state_names.tolist()),
+            households.shape_key(),
+            bool(disable_salt),
+            marginal_rate_delta,
+        )
+        if self._current is not None:
+            self._current.release()
+            self._current = None
+
+        batch = self._batches.get(key)
+        if batch is not None:
+            self._batches.move_to_end(key)
+            batch.reset(households, year, marginal_rate_delta)
+            self.reused += 1
+            self._current = batch
+            return batch
+
+        batch = HouseholdArraysBatchSimulation(
+            households, year, disable_salt, marginal_rate_delta
+        )
+        self.built += 1
+        if self.max_simulations > 0 and can_reset(
+            batch.simulation, batch.households, year
+        ):
+            self._batches[key] = batch
+            self._current = batch
+            if len(self._batches) > self.max_simulations:
+                self._batches.popitem(last=False)
+        return batch
+
+
+class RecordSimulation:
+    """
+    View of one household of a BatchSimulation.
+
+    Offers the part of the policyengine_us.Simulation interface used by the
+    output mappers: calculate returns the values of the record's entities,
+    starting with the first one, and situation_input is its own situation.
+    """
+
+    def __init__(self, batch, position, situation):
+        self.batch = batch
+        self.position = position
+        self.situation_input = situation
+
+    def calculate(self, variable, period=None):
+        entity_key, values = self.batch.calculate(variable, period)
+        index = self.batch.offsets[self.position][entity_key]
+        return values[index : index + 1]
@@ -0,0 +1,196 @@
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from .output_format import write_csv_rows
+from .columnar import read_parquet_chunks, read_arrow_chunks, ColumnarOutputWriter
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Suffix of the spool file of an output section, next to the output file
+SPOOL_SUFFIX = ".idtl{section}.part"
+
+
+def read_input_chunks(input_file, chunk_size=DEFAULT_CHUNK_SIZE, input_format="csv"):
+    """
+    Read a TAXSIM input file in chunks of records.
+
+    Parquet and Arrow files are read column by column, and only the TAXSIM
+    columns the emulator uses are loaded.
+
+    Args:
+        input_file (str): Path of the TAXSIM input file
+        chunk_size (int): Maximum number of records per chunk
+        input_format (str): "csv", "parquet" or "arrow"
+
+    Yields:
+        pandas.DataFrame: Records of one chunk
+    """
+    if input_format == "parquet":
+        yield from read_parquet_chunks(input_file, chunk_size)
+        return
+    if input_format == "arrow":
+        yield from read_arrow_chunks(input_file, chunk_size)
+        return
+
+    import pandas as pd
+
+    with pd.read_csv(input_file, chunksize=chunk_size) as reader:
+        yield from reader
+
+
+class TaxsimOutputWriter:
+    """
+    Write TAXSIM output incrementally, chunk by chunk.
+
+    The output of a run lists the idtl 0 records first, then the idtl 2
+    records and then the idtl 5 text, each section in input order. idtl 0
+    rows are written to the stream as soon as their chunk is done. The other
+    sections are spooled to files and appended by close, so memory use does
+    not grow with the input. Closing the writer after a failure still writes
+    the sections of the chunks completed so far.
+
+    With a spool prefix, the spools are named files next to the output,
+    flushed with every chunk, so the idtl 2 rows and idtl 5 text of the
+    completed chunks survive a run that is killed before it can close.
+    """
+
+    def __init__(self, output_stream, end="", close_stream=False, spool_prefix=None):
+        """
+        Args:
+            output_stream: Text stream the output is written to
+            end (str): Text written after the output on close
+            close_stream (bool): Close the stream on close, e.g. an output file
+            spool_prefix (str): Path the names of the section spool files
+                start with, see SPOOL_SUFFIX, or None for anonymous temporary
+                files
+        """
+        self.output_stream = output_stream
+        self.end = end
+        self.close_stream = close_stream
+        self.spool_prefix = spool_prefix
+        self.records = 0
+        self._has_rows = {0: False, 2: False}
+        self._full_text = False
+        self._spools = {}
+        self._closed = False
+
+    def spool_path(self, section):
+        """Path of the named spool file of a section, or None."""
+        if self.spool_prefix is None:
+            return None
+        return f"{self.spool_prefix}{SPOOL_SUFFIX.format(section=section)}"
+
+    def _spool(self, section):
+        if section not in self._spools:
+            path = self.spool_path(section)
+            self._spools[section] = (
+                tempfile.TemporaryFile("w+") if path is None else open(path, "w+")
+            )
+        return self._spools[section]
+
+    def _write_rows(self, idtl, rows, stream):
+        if not rows:
+            return
+        # The header line is written with the first chunk only
+        write_csv_rows(rows, stream, header=not self._has_rows[idtl])
+        self._has_rows[idtl] = True
+
+    def write(self, taxsim_inputs, taxsim_outputs):
+        """Write the outputs of one chunk of records and flush the stream."""
+        rows = {0: [], 2: []}
+        full_text = []
+        for taxsim_input, taxsim_output in zip(taxsim_inputs, taxsim_outputs):
+            idtl = taxsim_input["idtl"]
+            if idtl in rows:
+                rows[idtl].append(taxsim_output)
+            else:
+                full_text.append(taxsim_output)
+
+        self._write_rows(0, rows[0], self.output_stream)
+        if rows[2]:
+            self._write_rows(2, rows[2], self._spool(2))
+        if full_text:
+            self._spool(5).write("".join(full_text))
+            self._full_text = True
+
+        self.records += len(taxsim_inputs)
+        self.output_stream.flush()
+        for spool in self._spools.values():
+            spool.flush()
+
+    def close(self):
+        """Append the spooled idtl 2 and idtl 5 sections and the end text."""
+        if self._closed:
+            return
+        self._closed = True
+
+        for section, written in ((2, self._has_rows[2]), (5, self._full_text)):
+            spool = self._spools.pop(section, None)
+            if spool is None:
+                continue
+            if written:
+                self.output_stream.write("\n")
+                spool.seek(0)
+                shutil.copyfileobj(spool, self.output_stream)
+            spool.close()
+            if self.spool_path(section) is not None:
+                os.remove(self.spool_path(section))
+        self.output_stream.write(self.end)
+        if self.close_stream:
+            self.output_stream.close()
+        else:
+            self.output_stream.flush()
+
+
+def open_output_writer(output=None, output_format="csv", columns=None):
+    """
+    Output writer of a file run.
+
+    Args:
+        output (str): Output file path, or None for stdout
+        output_format (str): "csv" for the TAXSIM text output, "parquet" or
+            "arrow" for a typed columnar file
+        columns (tuple): Requested idtl 0/2 output columns, or None for all
+
+    Returns:
+        TaxsimOutputWriter or ColumnarOutputWriter: Writer to close when done
+    """
+    if output_format != "csv":
+        if not output:
+            raise ValueError(f"{output_format} output needs an output file")
+        return ColumnarOutputWriter(output, output_format, columns)
+
+    # The text output ends with a newline, like print
+    if output:
+        return TaxsimOutputWriter(
+            open(output, "w"), end="\n", close_stream=True, spool_prefix=output
+        )
+    return TaxsimOutputWriter(sys.stdout, end="\n")
+
+
+@contextmanager
+def exit_on_sigterm():
+    """
+    Turn SIGTERM into SystemExit while the block runs.
+
+    A terminated run then unwinds like a failed one, so its output writer is
+    closed and the chunks completed so far are written. Signal handlers can
+    only be set from the main thread; elsewhere the block runs unchanged.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handle_sigterm(signum, frame):
+        sys.exit(128 + signum)
+
+    previous = signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
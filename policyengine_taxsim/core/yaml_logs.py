@@ -0,0 +1,206 @@
+import json
+import os
+import queue
+import threading
+import zipfile
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+# "yaml" writes one file per record, "jsonl" and "zip" bundle the records of a
+# process into one JSON-lines file or zip archive
+LOG_FORMATS = ("yaml", "jsonl", "zip")
+DEFAULT_QUEUE_SIZE = 256
+BUNDLE_FILE_NAME = "pe_tests_{pid}.{extension}"
+
+
+def is_sampled(taxsimid, rate):
+    """
+    Whether the record of a taxsimid is in a log sample.
+
+    The decision hashes the taxsimid, so a record is sampled the same way in
+    every run, worker and chunk.
+
+    Args:
+        taxsimid: taxsimid of the record
+        rate (float): Fraction of records to sample, from 0 to 1
+
+    Returns:
+        bool: True if the record is sampled
+    """
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return zlib.crc32(str(taxsimid).encode()) / 2**32 < rate
+
+
+@dataclass(frozen=True)
+class LogSettings:
+    """
+    Where PE YAML test logs are written, and for how many records.
+
+    Attributes:
+        sample: Fraction of records logged, sampled by taxsimid
+        directory: Directory the logs are written into
+        log_format: "yaml", "jsonl" or "zip", see LOG_FORMATS
+    """
+
+    sample: float = 1.0
+    directory: str = "."
+    log_format: str = "yaml"
+
+
+class YamlLogWriter:
+    """
+    Writes PE YAML test logs on a background thread.
+
+    Records are handed over through a bounded queue, so the simulation loop
+    only blocks when the writer falls that far behind. The thread renders
+    every record with one reused PETestsYAMLGenerator and writes it into the
+    log directory, as a YAML file per record or into a bundle file of this
+    process. An error of the thread is raised by the next submit or by close.
+    """
+
+    def __init__(
+        self,
+        directory=".",
+        log_format="yaml",
+        queue_size=DEFAULT_QUEUE_SIZE,
+        generator=None,
+    ):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(
+                f"Unknown log format {log_format!r}, "
+                f"expected one of {', '.join(LOG_FORMATS)}"
+            )
+        if generator is None:
+            from policyengine_tests_generator.core.generator import (
+                PETestsYAMLGenerator,
+            )
+
+            generator = PETestsYAMLGenerator()
+
+        self.directory = Path(directory)
+        self.log_format = log_format
+        self.generator = generator
+        self.written = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="pe-yaml-logs", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def bundle_path(self):
+        """Bundle file of this process, or None for a file per record."""
+        if self.log_format == "yaml":
+            return None
+        return self.directory / BUNDLE_FILE_NAME.format(
+            pid=os.getpid(), extension=self.log_format
+        )
+
+    def submit(self, household, outputs, name):
+        """
+        Queue the log of one record.
+
+        Args:
+            household (dict): Situation of the record
+            outputs (list): {"variable", "value"} dicts of its outputs
+            name (str): Name of the test, and file name of a YAML log
+        """
+        self._raise_error()
+        self._queue.put((household, outputs, name))
+
+    def close(self):
+        """Write the queued logs, stop the thread and close the bundle file."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Writing the PE YAML test logs failed") from self._error
+
+    def _run(self):
+        bundle = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                # After an error, keep draining the queue so submit never blocks
+                if self._error is not None:
+                    continue
+                try:
+                    if bundle is None and self.log_format != "yaml":
+                        bundle = self._open_bundle()
+                    self._write(bundle, *item)
+                except Exception as error:
+                    self._error = error
+        finally:
+            if bundle is not None:
+                bundle.close()
+
+    def _open_bundle(self):
+        # Append, so the chunks of a process that open the writer one after
+        # another share one bundle file
+        if self.log_format == "zip":
+            return zipfile.ZipFile(
+                self.bundle_path, "a", compression=zipfile.ZIP_DEFLATED
+            )
+        return open(self.bundle_path, "a")
+
+    def _write(self, bundle, household, outputs, name):
+        yaml_data = self.generator.generate_yaml(
+            household_data=household, name=name, pe_outputs=outputs
+        )
+        text = self.generator._get_yaml(yaml_data)
+        if self.log_format == "yaml":
+            with open(self.directory / name, "w") as f:
+                f.write(text)
+        elif self.log_format == "zip":
+            bundle.writestr(name, text)
+        else:
+            bundle.write(json.dumps({"name": name, "yaml": text}) + "\n")
+        self.written += 1
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+@contextmanager
+def open_yaml_logs(settings):
+    """
+    Shared YamlLogWriter of a log directory and format.
+
+    Runs of one process that log into the same place, like the chunks of
+    worker threads, share one writer and one bundle file. The writer is
+    closed, and its logs written, when its last user leaves.
+
+    Args:
+        settings (LogSettings): Log settings of the run
+
+    Yields:
+        YamlLogWriter: The shared writer
+    """
+    key = (str(settings.directory), settings.log_format)
+    with _writers_lock:
+        writer, users = _writers.get(key, (None, 0))
+        if writer is None:
+            writer = YamlLogWriter(*key)
+        _writers[key] = (writer, users + 1)
+    try:
+        yield writer
+    finally:
+        with _writers_lock:
+            writer, users = _writers.pop(key)
+            if users > 1:
+                _writers[key] = (writer, users - 1)
+            else:
+                writer.close()
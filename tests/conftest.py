@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture
+def sample_taxsim_inputs():
+    return [
+        {
+            "year": 2023,
+            "state": 39,
+            "pwages": 81000.001,
+            "swages": 0,
+            "taxsimid": 1,
+            "idtl": 2,
+            "mstat": 2,
+            "depx": 2,
+            "age1": 4,
+        },
+        {
+            "year": 2023,
+            "state": 5,
+            "pwages": 50000,
+            "psemp": 3000,
+            "intrec": 200,
+            "taxsimid": 2,
+            "idtl": 0,
+        },
+        {"year": 2021, "state": 3, "page": 35, "pwages": 50000, "taxsimid": 3, "idtl": 2},
+    ]
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from policyengine_taxsim import run_taxsim
+from policyengine_taxsim.core.api import to_records, to_results_frame
+
+
+def test_records_of_mapping_and_dataframe():
+    inputs = {"taxsimid": [1, 2], "year": [2023, 2023], "pwages": [50000, 0]}
+
+    assert to_records(inputs) == to_records(pd.DataFrame(inputs))
+    assert to_records(inputs)[1] == {"taxsimid": 2, "year": 2023, "pwages": 0}
+
+
+def test_results_frame_is_typed():
+    df = to_results_frame(
+        [{"idtl": 0}, {"idtl": 5, "taxsimid": 2, "year": 2023.0, "state": 5}],
+        [
+            {"taxsimid": 1, "year": 2023, "state": 5, "fiitax": np.float32(4409.65)},
+            "   Input Data:\n",
+        ],
+        ("fiitax",),
+    )
+
+    assert list(df.columns) == [
+        "taxsimid",
+        "year",
+        "state",
+        "idtl",
+        "fiitax",
+        "full_text",
+    ]
+    assert df["year"].dtype == np.int64
+    assert df["fiitax"].dtype == np.float64
+    assert df["fiitax"][0] == 4409.65
+    assert np.isnan(df["fiitax"][1])
+    assert df["full_text"][1] == "   Input Data:\n"
+
+
+def test_results_frame_only_has_columns_of_present_idtls():
+    df = to_results_frame([], [])
+
+    assert "v10" not in df.columns
+    assert len(df) == 0
+
+
+def test_unknown_columns_are_rejected():
+    with pytest.raises(ValueError, match="nope"):
+        run_taxsim({"taxsimid": [1], "year": [2023]}, columns=["fiitax", "nope"])
+
+
+def test_run_taxsim():
+    df = run_taxsim(
+        {
+            "taxsimid": [1, 2],
+            "year": [2023, 2023],
+            "state": [5, 5],
+            "mstat": [1, 1],
+            "pwages": [50000, 80000],
+            "idtl": [0, 2],
+        },
+        columns="fiitax,v10",
+    )
+
+    assert list(df["taxsimid"]) == [1, 2]
+    assert list(df.columns) == [
+        "taxsimid",
+        "year",
+        "state",
+        "idtl",
+        "fiitax",
+        "v10",
+        "full_text",
+    ]
+    assert df["fiitax"][1] > df["fiitax"][0] > 0
+    assert np.isnan(df["v10"][0])
+    assert df["v10"][1] == 80000
@@ -0,0 +1,171 @@
+import copy
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from policyengine_taxsim import (
+    generate_household,
+    export_household,
+    export_households,
+)
+from policyengine_taxsim.core.batch import run_records, schedule_records
+from policyengine_taxsim.core.parallel import run_records_parallel
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.simulation import combine_situations
+
+
+def test_combine_situations_offsets(sample_taxsim_inputs):
+    situations = [generate_household(dict(each)) for each in sample_taxsim_inputs]
+
+    combined, offsets = combine_situations(situations)
+
+    assert len(combined["people"]) == 4 + 1 + 1
+    assert len(combined["tax_units"]) == 3
+    assert offsets[1] == {
+        "person": 4,
+        "family": 1,
+        "household": 1,
+        "marital_unit": 3,
+        "spm_unit": 1,
+        "tax_unit": 1,
+    }
+    assert combined["tax_units"]["1:your tax unit"]["members"] == ["1:you"]
+
+
+def test_schedule_records_by_year_and_state():
+    taxsim_inputs = [
+        {"year": 2023, "state": 5, "taxsimid": 1},
+        {"year": 2021, "state": 3, "taxsimid": 2},
+        {"year": 2023, "taxsimid": 3},
+        {"year": 2023, "state": 5, "taxsimid": 4},
+    ]
+
+    assert schedule_records(taxsim_inputs) == [1, 0, 3, 2]
+    assert taxsim_inputs[2]["state"] == 44
+
+
+@pytest.mark.parametrize("disable_salt", [False, True])
+def test_batch_matches_single_household_export(sample_taxsim_inputs, disable_salt):
+    expected = []
+    for each in copy.deepcopy(sample_taxsim_inputs):
+        situation = generate_household(each)
+        expected.append(export_household(each, situation, False, disable_salt))
+
+    taxsim_inputs = copy.deepcopy(sample_taxsim_inputs)
+    situations = [generate_household(each) for each in taxsim_inputs]
+    result = export_households(
+        taxsim_inputs, situations, RunConfig(disable_salt=disable_salt)
+    )
+
+    assert result == expected
+    assert [list(each) for each in result] == [list(each) for each in expected]
+
+
+def test_exports_take_a_run_config(sample_taxsim_inputs):
+    config = RunConfig(disable_salt=True, columns=("fiitax", "siitax"), batch_size=2)
+    taxsim_inputs = copy.deepcopy(sample_taxsim_inputs)
+    situations = [generate_household(each) for each in taxsim_inputs]
+
+    expected = run_records(copy.deepcopy(sample_taxsim_inputs), config)
+    single = [
+        export_household(each, situation, config=config)
+        for each, situation in zip(taxsim_inputs, situations)
+    ]
+
+    assert export_households(taxsim_inputs, situations, config) == expected
+    assert single == expected
+
+
+def test_export_household_rejects_options_next_to_a_config(sample_taxsim_inputs):
+    taxsim_input = dict(sample_taxsim_inputs[0])
+    situation = generate_household(taxsim_input)
+
+    with pytest.raises(ValueError, match="RunConfig"):
+        export_household(taxsim_input, situation, False, True, config=RunConfig())
+
+
+def test_requested_columns_only(sample_taxsim_inputs):
+    full = run_records(copy.deepcopy(sample_taxsim_inputs), RunConfig())
+
+    result = run_records(
+        copy.deepcopy(sample_taxsim_inputs),
+        RunConfig(columns=("fiitax", "siitax", "v10")),
+    )
+
+    assert list(result[0]) == ["taxsimid", "year", "state", "fiitax", "siitax", "v10"]
+    assert list(result[1]) == ["taxsimid", "year", "state", "fiitax", "siitax"]
+    for expected, output in zip(full, result):
+        assert output == {key: expected[key] for key in output}
+
+
+def test_parallel_matches_serial(sample_taxsim_inputs):
+    expected = run_records(copy.deepcopy(sample_taxsim_inputs), RunConfig())
+
+    taxsim_inputs, result = run_records_parallel(
+        copy.deepcopy(sample_taxsim_inputs), RunConfig(batch_size=1, jobs=2)
+    )
+
+    assert result == expected
+    assert [each["taxsimid"] for each in taxsim_inputs] == [1, 2, 3]
+
+
+def test_warm_up_once_per_bucket(sample_taxsim_inputs):
+    from policyengine_taxsim.core.parallel import warm_up, warm_buckets
+
+    taxsim_inputs = copy.deepcopy(sample_taxsim_inputs)
+    warm_buckets.clear()
+
+    assert warm_up(taxsim_inputs) == 3
+    assert warm_up(taxsim_inputs) == 0
+    assert (2021, 3) in warm_buckets
+
+
+def test_parallel_warm_start_matches_serial(sample_taxsim_inputs):
+    expected = run_records(copy.deepcopy(sample_taxsim_inputs), RunConfig())
+
+    _, result = run_records_parallel(
+        copy.deepcopy(sample_taxsim_inputs),
+        RunConfig(batch_size=1, jobs=2, warm_start=True),
+    )
+
+    assert result == expected
+
+
+def test_thread_executor_matches_serial(sample_taxsim_inputs):
+    expected = run_records(copy.deepcopy(sample_taxsim_inputs), RunConfig())
+
+    taxsim_inputs, result = run_records_parallel(
+        copy.deepcopy(sample_taxsim_inputs),
+        RunConfig(batch_size=1, jobs=3, executor="thread"),
+    )
+
+    assert result == expected
+    assert [each["taxsimid"] for each in taxsim_inputs] == [1, 2, 3]
+
+
+def test_unknown_executor_is_rejected(sample_taxsim_inputs):
+    with pytest.raises(ValueError, match="executor"):
+        run_records_parallel(sample_taxsim_inputs, RunConfig(executor="fiber"))
+
+
+def test_concurrent_runs_match_serial(sample_taxsim_inputs):
+    # Runs with different options share the process, so no option may leak
+    # from one run into another
+    configs = [
+        RunConfig(),
+        RunConfig(disable_salt=True),
+        RunConfig(marginal_rate_delta=100),
+        RunConfig(columns=("fiitax", "siitax", "frate")),
+    ]
+
+    def run(config):
+        return run_records(
+            copy.deepcopy(sample_taxsim_inputs), replace(config, batch_size=1)
+        )
+
+    expected = [run(config) for config in configs]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(run, configs * 3))
+
+    assert results == expected * 3
@@ -0,0 +1,105 @@
+import pytest
+
+from policyengine_taxsim.core import cache as cache_module
+from policyengine_taxsim.core.cache import ResultCache, mapping_digest
+from policyengine_taxsim.core.utils import load_variable_mappings
+from policyengine_taxsim.core.batch import run_records
+from policyengine_taxsim.core.run_config import RunConfig
+
+
+@pytest.fixture
+def cache(tmp_path):
+    result_cache = ResultCache(tmp_path, max_entries=3)
+    yield result_cache
+    result_cache.close()
+
+
+@pytest.fixture
+def sample_taxsim_input():
+    return {
+        "year": 2021,
+        "state": 3,
+        "page": 35,
+        "pwages": 50000,
+        "taxsimid": 11,
+        "idtl": 0,
+        "mstat": 1,
+        "depx": 0,
+    }
+
+
+def test_key_normalises_numbers(cache, sample_taxsim_input):
+    as_floats = {key: float(value) for key, value in sample_taxsim_input.items()}
+
+    assert cache.key(sample_taxsim_input, False) == cache.key(as_floats, False)
+    assert cache.key(sample_taxsim_input, False) != cache.key(
+        sample_taxsim_input, True
+    )
+    assert cache.key(sample_taxsim_input, False) != cache.key(
+        {**sample_taxsim_input, "idtl": 2}, False
+    )
+    assert cache.key(sample_taxsim_input, False) != cache.key(
+        sample_taxsim_input, False, columns=("fiitax",)
+    )
+
+
+def test_mapping_change_invalidates_entries(
+    tmp_path, monkeypatch, sample_taxsim_input
+):
+    writer = ResultCache(tmp_path)
+    key = writer.key(sample_taxsim_input, False)
+    writer.put_many({key: {"taxsimid": 11, "fiitax": 10.5}})
+    writer.close()
+
+    mappings = load_variable_mappings()
+    fiitax = mappings["policyengine_to_taxsim"]["fiitax"]
+    fiitax["variable"] = "income_tax_before_credits"
+    monkeypatch.setattr(
+        cache_module, "get_mapping_digest", lambda: mapping_digest(mappings)
+    )
+    reader = ResultCache(tmp_path)
+
+    assert reader.key(sample_taxsim_input, False) != key
+    assert reader.get_many([reader.key(sample_taxsim_input, False)]) == {}
+    reader.close()
+
+
+def test_round_trip_and_counts(cache):
+    cache.put_many({"a": {"taxsimid": 1, "fiitax": 10.5}, "b": "text output"})
+
+    found = cache.get_many(["a", "b", "c"])
+
+    assert found == {"a": {"taxsimid": 1, "fiitax": 10.5}, "b": "text output"}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_evicts_least_recently_used(cache):
+    for key, value in [("a", 1), ("b", 2), ("c", 3)]:
+        cache.put_many({key: value})
+    cache.get_many(["a"])
+
+    cache.put_many({"d": 4})
+
+    assert set(cache.get_many(["a", "b", "c", "d"])) == {"a", "c", "d"}
+
+
+def test_shared_between_connections(tmp_path):
+    writer = ResultCache(tmp_path)
+    reader = ResultCache(tmp_path)
+
+    writer.put_many({"a": 1})
+
+    assert reader.get_many(["a"]) == {"a": 1}
+    writer.close()
+    reader.close()
+
+
+def test_process_records_uses_cache(cache, sample_taxsim_input):
+    expected = run_records([dict(sample_taxsim_input)], RunConfig())
+
+    first = run_records([dict(sample_taxsim_input)], RunConfig(), cache)
+    second = run_records([dict(sample_taxsim_input)], RunConfig(), cache)
+
+    assert first == expected
+    assert second == expected
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from policyengine_taxsim.cli import main
+from policyengine_taxsim.core.columnar import (
+    ColumnarOutputWriter,
+    get_input_columns,
+    get_output_columns,
+    to_float64,
+)
+from policyengine_taxsim.core.streaming import read_input_chunks
+
+
+def test_input_columns_skip_unused_fields():
+    available = ["taxsimid", "notes", "year", "pwages", "age1", "age12", "ssemp"]
+    available.append("idtl")
+
+    assert get_input_columns(available) == [
+        "taxsimid",
+        "year",
+        "pwages",
+        "age1",
+        "age12",
+        "ssemp",
+        "idtl",
+    ]
+
+
+def test_output_columns():
+    columns = get_output_columns()
+
+    assert columns[:5] == ["taxsimid", "year", "state", "fiitax", "siitax"]
+    assert {"frate", "v10", "v28", "v45"} <= set(columns)
+    assert get_output_columns(("v10", "fiitax")) == [
+        "taxsimid",
+        "year",
+        "state",
+        "fiitax",
+        "v10",
+    ]
+
+
+def test_float32_values_keep_their_decimal_form():
+    assert to_float64(np.float32(2486.7)) == 2486.7
+    assert to_float64(12.01) == 12.01
+
+
+def test_columnar_output_needs_output_file(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("taxsimid,year,state,pwages,idtl\n1,2023,5,50000,0\n")
+
+    result = CliRunner().invoke(main, [str(input_file), "--output-format", "parquet"])
+
+    assert result.exit_code == 2
+    assert "needs --output" in result.output
+
+
+@pytest.mark.parametrize("input_format", ["parquet", "arrow"])
+def test_read_columnar_chunks(tmp_path, input_format):
+    pytest.importorskip("pyarrow")
+    import pyarrow.feather
+
+    df = pd.DataFrame(
+        {
+            "taxsimid": [1, 2, 3],
+            "year": [2023] * 3,
+            "pwages": [1.5, 2.5, 3.5],
+            "notes": ["a", "b", "c"],
+        }
+    )
+    input_file = tmp_path / f"input.{input_format}"
+    if input_format == "parquet":
+        df.to_parquet(input_file)
+    else:
+        pyarrow.feather.write_feather(df, input_file)
+
+    chunks = list(read_input_chunks(input_file, 2, input_format))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(chunks[0].columns) == ["taxsimid", "year", "pwages"]
+    assert list(chunks[1]["pwages"]) == [3.5]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_columnar_output_writer(tmp_path, output_format):
+    pytest.importorskip("pyarrow")
+    import pyarrow.feather
+
+    output_file = tmp_path / f"output.{output_format}"
+    writer = ColumnarOutputWriter(output_file, output_format, ("fiitax", "v10"))
+    writer.write(
+        [{"idtl": 0}, {"idtl": 2}],
+        [
+            {"taxsimid": 1, "year": 2023, "state": 5, "fiitax": np.float32(4409.65)},
+            {
+                "taxsimid": 2,
+                "year": 2023,
+                "state": 5,
+                "fiitax": np.float32(-12.34),
+                "v10": np.float32(50000.0),
+            },
+        ],
+    )
+    writer.write(
+        [{"idtl": 5, "taxsimid": 3, "year": 2021.0, "state": 3}], ["   Input Data:\n"]
+    )
+    writer.close()
+
+    if output_format == "parquet":
+        df = pd.read_parquet(output_file)
+    else:
+        df = pyarrow.feather.read_feather(output_file)
+
+    assert list(df.columns) == [
+        "taxsimid",
+        "year",
+        "state",
+        "idtl",
+        "fiitax",
+        "v10",
+        "full_text",
+    ]
+    assert list(df["taxsimid"]) == [1, 2, 3]
+    assert list(df["idtl"]) == [0, 2, 5]
+    assert df["fiitax"][0] == 4409.65
+    assert pd.isna(df["v10"][0])
+    assert df["full_text"][2] == "   Input Data:\n"
+    assert df["year"][2] == 2021
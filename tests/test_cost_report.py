@@ -0,0 +1,93 @@
+from policyengine_taxsim.core.cost_report import (
+    column_costs,
+    find_regressions,
+    format_column_costs,
+    total_column_costs,
+    variable_costs,
+)
+from policyengine_taxsim.core.simulation import get_batch_state_name
+
+
+def make_report(entries):
+    return {
+        "details": {
+            "calculate": {
+                detail: {"calls": calls, "seconds": seconds}
+                for detail, (calls, seconds) in entries.items()
+            }
+        }
+    }
+
+
+def test_batch_state_name():
+    def situation(state_name):
+        return {"households": {"your household": {"state_name": {"2023": state_name}}}}
+
+    assert get_batch_state_name([situation("CA"), situation("CA")]) == "CA"
+    assert get_batch_state_name([situation("CA"), situation("NY")]) == "mixed"
+
+
+def test_variable_costs_per_state():
+    report = make_report(
+        {"CA:income_tax": (2, 1.5), "NY:income_tax": (1, 0.5), "CA:ca_income_tax": (2, 3.0)}
+    )
+
+    costs = variable_costs(report)
+
+    assert costs["CA"]["income_tax"] == {"calls": 2, "seconds": 1.5}
+    assert costs["NY"] == {"income_tax": {"calls": 1, "seconds": 0.5}}
+
+
+def test_column_costs_resolve_state_variables():
+    report = make_report(
+        {
+            "CA:income_tax": (2, 1.5),
+            "CA:ca_income_tax": (2, 3.0),
+            "CA:ca_agi": (1, 0.25),
+            "IL:il_base_income": (1, 0.75),
+        }
+    )
+
+    costs = column_costs(report)
+
+    assert list(costs["CA"])[0] == "siitax"
+    assert costs["CA"]["siitax"]["variables"] == ["ca_income_tax"]
+    assert costs["CA"]["fiitax"]["seconds"] == 1.5
+    assert costs["CA"]["v32"] == {
+        "calls": 1,
+        "seconds": 0.25,
+        "variables": ["ca_agi"],
+        "special_case": False,
+    }
+    # Illinois reports its base income as state AGI
+    assert costs["IL"]["v32"]["variables"] == ["il_base_income"]
+    assert costs["IL"]["v32"]["special_case"]
+    assert "taxsimid" not in costs["CA"]
+
+
+def test_total_column_costs_and_table():
+    report = make_report({"CA:income_tax": (2, 1.5), "NY:income_tax": (1, 0.5)})
+    costs = column_costs(report)
+
+    totals = total_column_costs(costs)
+
+    assert totals["fiitax"] == {"calls": 3, "seconds": 2.0}
+    table = format_column_costs(costs)
+    assert "fiitax" in table
+    assert table.index("CA") < table.index("NY")
+
+
+def test_find_regressions():
+    baseline = {
+        "fiitax": {"calls": 1, "seconds": 1.0},
+        "siitax": {"calls": 1, "seconds": 1.0},
+        "v10": {"calls": 1, "seconds": 0.001},
+    }
+    current = {
+        "fiitax": {"calls": 1, "seconds": 1.2},
+        "siitax": {"calls": 1, "seconds": 3.0},
+        "v10": {"calls": 1, "seconds": 0.01},
+        "v11": {"calls": 1, "seconds": 5.0},
+    }
+
+    assert find_regressions(baseline, current, threshold=1.5) == [("siitax", 1.0, 3.0)]
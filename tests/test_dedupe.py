@@ -0,0 +1,83 @@
+import copy
+
+import pytest
+
+from policyengine_taxsim.core.dedupe import RecordDeduplicator, record_fingerprint
+from policyengine_taxsim.core.parallel import run_records_parallel
+from policyengine_taxsim.core.run_config import RunConfig
+
+
+@pytest.fixture
+def duplicate_taxsim_inputs():
+    return [
+        {"year": 2021, "state": 3, "pwages": 50000, "taxsimid": 1, "idtl": 0},
+        {"year": 2021, "state": 3, "pwages": 50000.0, "taxsimid": 2, "idtl": 0},
+        {"year": 2021, "state": 3, "pwages": 60000, "taxsimid": 3, "idtl": 0},
+        {
+            "year": 2021,
+            "state": 3,
+            "pwages": 50000,
+            "taxsimid": 4,
+            "idtl": 0,
+            "mstat": 1,
+            "depx": 0,
+        },
+    ]
+
+
+def test_fingerprint_ignores_taxsimid():
+    assert record_fingerprint({"year": 2021, "taxsimid": 1}) == record_fingerprint(
+        {"year": 2021.0, "taxsimid": 2}
+    )
+
+
+def test_deduplicate_uses_defaults(duplicate_taxsim_inputs):
+    deduplicator = RecordDeduplicator()
+
+    representatives = deduplicator.deduplicate(duplicate_taxsim_inputs)
+
+    assert representatives == [0, 0, 2, 0]
+    assert deduplicator.records == 4
+    assert deduplicator.unique_records == 2
+    assert deduplicator.dedupe_ratio == 2.0
+
+
+def test_full_text_records_are_not_deduplicated():
+    taxsim_inputs = [
+        {"year": 2021, "taxsimid": 1, "idtl": 5},
+        {"year": 2021, "taxsimid": 2, "idtl": 5},
+    ]
+
+    assert RecordDeduplicator().deduplicate(taxsim_inputs) == [0, 1]
+
+
+def test_fan_out_keeps_taxsimid(duplicate_taxsim_inputs):
+    deduplicator = RecordDeduplicator()
+    representatives = deduplicator.deduplicate(duplicate_taxsim_inputs)
+
+    taxsim_outputs = deduplicator.fan_out(
+        duplicate_taxsim_inputs,
+        representatives,
+        {0: {"taxsimid": 1, "fiitax": 10.0}, 2: {"taxsimid": 3, "fiitax": 20.0}},
+    )
+
+    assert taxsim_outputs == [
+        {"taxsimid": 1, "fiitax": 10.0},
+        {"taxsimid": 2, "fiitax": 10.0},
+        {"taxsimid": 3, "fiitax": 20.0},
+        {"taxsimid": 4, "fiitax": 10.0},
+    ]
+
+
+def test_deduplicated_run_matches_full_run(duplicate_taxsim_inputs):
+    _, expected = run_records_parallel(
+        copy.deepcopy(duplicate_taxsim_inputs), RunConfig()
+    )
+
+    _, result = run_records_parallel(
+        copy.deepcopy(duplicate_taxsim_inputs),
+        RunConfig(),
+        deduplicator=RecordDeduplicator(),
+    )
+
+    assert result == expected
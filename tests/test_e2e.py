@@ -6,10 +6,21 @@ import numpy as np
 from pathlib import Path
 import platform
 import sys
+import tempfile
 
 
 class E2ETest(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls) -> None:
+        # The match tests read the outputs of the generate tests, so they share
+        # one directory, outside the tree so test runs leave it clean
+        cls._output_dir = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls._output_dir.cleanup()
+
     def setUp(self) -> None:
         import importlib.resources as pkg_resources
         import policyengine_taxsim
@@ -72,8 +83,7 @@ class E2ETest(unittest.TestCase):
                 print(f"  {path}")
             raise FileNotFoundError("Could not find taxsim directory")
 
-        self.output_dir = Path.cwd() / "output"
-        self.output_dir.mkdir(exist_ok=True)
+        self.output_dir = Path(self._output_dir.name)
 
         # Get CLI path
         self.cli_path = Path(policyengine_taxsim.__file__).parent / "cli.py"
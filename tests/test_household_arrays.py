@@ -0,0 +1,184 @@
+import copy
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from policyengine_taxsim import generate_household, export_households
+from policyengine_taxsim.core.batch import export_household_arrays
+from policyengine_taxsim.core.household_arrays import (
+    HEAD,
+    SPOUSE,
+    DEPENDENT,
+    HouseholdArrays,
+    map_households,
+    records_to_columns,
+)
+from policyengine_taxsim.core.input_mapper import set_taxsim_defaults
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.simulation import (
+    SimulationPool,
+    combine_situations,
+    perturb_earnings,
+)
+
+
+def situation_inputs(situations):
+    """{(entity key, variable): {entity index: value}} of combined situations."""
+    combined, _ = combine_situations(situations)
+    entity_keys = {
+        "people": "person",
+        "households": "household",
+        "marital_units": "marital_unit",
+        "tax_units": "tax_unit",
+    }
+    inputs = {}
+    for plural, entity_key in entity_keys.items():
+        for index, entity in enumerate(combined[plural].values()):
+            for name, values in entity.items():
+                if name != "members":
+                    value = list(values.values())[0]
+                    inputs.setdefault((entity_key, name), {})[index] = value
+    return inputs
+
+
+def test_structure(sample_taxsim_inputs):
+    households = map_households(records_to_columns(sample_taxsim_inputs))
+
+    assert list(households.years) == [2023, 2023, 2021]
+    assert list(households.state_names) == ["PA", "CA", "AZ"]
+    assert list(households.person_kind) == [
+        HEAD,
+        SPOUSE,
+        DEPENDENT,
+        DEPENDENT,
+        HEAD,
+        HEAD,
+    ]
+    assert list(households.person_marital_unit) == [0, 0, 1, 2, 3, 4]
+    situations = [generate_household(dict(each)) for each in sample_taxsim_inputs]
+    assert households.offsets() == combine_situations(situations)[1]
+
+
+def test_inputs_match_situations(sample_taxsim_inputs):
+    situations = [generate_household(dict(each)) for each in sample_taxsim_inputs]
+    expected = situation_inputs(situations)
+
+    households = map_households(records_to_columns(sample_taxsim_inputs))
+
+    result = {}
+    for entity_key, variables in households.inputs.items():
+        for name, (values, mask) in variables.items():
+            result[(entity_key, name)] = {
+                index: values[index] for index in np.flatnonzero(mask).tolist()
+            }
+    assert result == expected
+
+
+def test_dataframe_input(sample_taxsim_inputs):
+    df = pd.DataFrame(sample_taxsim_inputs).fillna(0)
+
+    households = map_households(df)
+
+    assert list(households.state_names) == ["PA", "CA", "AZ"]
+    values, mask = households.inputs["person"]["self_employment_income"]
+    assert list(values[mask]) == [0, 3000, 0]
+
+
+def test_missing_year_is_rejected():
+    with pytest.raises(KeyError):
+        map_households({"state": [5]})
+
+
+def test_select_and_concatenate(sample_taxsim_inputs):
+    households = map_households(records_to_columns(sample_taxsim_inputs))
+
+    selected = households.select([2, 0])
+    combined = HouseholdArrays.concatenate([selected, households.select([1])])
+
+    assert list(combined.state_names) == ["AZ", "PA", "CA"]
+    assert list(combined.person_household) == [0, 1, 1, 1, 1, 2]
+    assert list(combined.person_marital_unit) == [0, 1, 1, 2, 3, 4]
+    ages, _ = combined.inputs["person"]["age"]
+    assert list(ages) == [35, 40, 40, 4, 10, 40]
+
+
+def test_raised_earnings_match_perturb_earnings(sample_taxsim_inputs):
+    sample_taxsim_inputs[0]["swages"] = 19000
+    situations = [generate_household(dict(each)) for each in sample_taxsim_inputs]
+    perturbed = [perturb_earnings(situation, 100) for situation in situations]
+
+    households = map_households(records_to_columns(sample_taxsim_inputs))
+    raised = households.with_raised_earnings(100)
+
+    expected = situation_inputs(perturbed)[("person", "employment_income")]
+    earnings, _ = raised.inputs["person"]["employment_income"]
+    assert dict(enumerate(earnings.tolist())) == expected
+
+
+@pytest.mark.parametrize("disable_salt", [False, True])
+def test_export_matches_situations(sample_taxsim_inputs, disable_salt):
+    taxsim_inputs = copy.deepcopy(sample_taxsim_inputs)
+    situations = [generate_household(each) for each in taxsim_inputs]
+    expected = export_households(
+        taxsim_inputs, situations, RunConfig(disable_salt=disable_salt)
+    )
+
+    taxsim_inputs = copy.deepcopy(sample_taxsim_inputs)
+    for each in taxsim_inputs:
+        set_taxsim_defaults(each)
+    households = map_households(records_to_columns(taxsim_inputs))
+    result = export_household_arrays(
+        taxsim_inputs, households, RunConfig(disable_salt=disable_salt)
+    )
+
+    assert result == expected
+
+
+@pytest.mark.parametrize("disable_salt", [False, True])
+def test_reused_simulations_match_batches(disable_salt):
+    # The first household itemizes, which leaves branches in its simulation
+    taxsim_inputs = [
+        {
+            "taxsimid": 1,
+            "year": 2023,
+            "state": 33,
+            "page": 63,
+            "depx": 2,
+            "age1": 3,
+            "age2": 1,
+            "pwages": 18800.34,
+            "mortgage": 32339.27,
+            "childcare": 9834.14,
+            "idtl": 2,
+        },
+        {
+            "taxsimid": 2,
+            "year": 2023,
+            "state": 33,
+            "page": 78,
+            "depx": 2,
+            "age1": 6,
+            "age2": 16,
+            "pwages": 93346.97,
+            "mortgage": 0,
+            "childcare": 1333.25,
+            "idtl": 2,
+        },
+        {"taxsimid": 3, "year": 2023, "state": 33, "pwages": 50000, "idtl": 5},
+        {"taxsimid": 4, "year": 2023, "state": 33, "pwages": 75000, "idtl": 5},
+    ]
+    for each in taxsim_inputs:
+        set_taxsim_defaults(each)
+    households = map_households(records_to_columns(taxsim_inputs))
+    config = RunConfig(disable_salt=disable_salt)
+    expected = export_household_arrays(taxsim_inputs, households, config)
+
+    pool = SimulationPool()
+    result = export_household_arrays(
+        taxsim_inputs, households, replace(config, batch_size=1), pool=pool
+    )
+
+    assert result == expected
+    assert pool.reused == 2
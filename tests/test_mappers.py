@@ -1,6 +1,7 @@
 import pytest
 
 from policyengine_taxsim import generate_household, export_household
+from policyengine_taxsim.core.input_mapper import get_household_shape
 
 
 @pytest.fixture
@@ -392,6 +393,24 @@ def test_household_with_dependent_single_parent(
     assert result == expected_output
 
 
+def test_household_shape_is_shared_but_not_its_values(sample_taxsim_input_for_joint):
+    first = generate_household(dict(sample_taxsim_input_for_joint))
+    first["tax_units"]["your tax unit"]["members"].append("someone")
+    first["marital_units"]["your first dependent's marital unit"]["marital_unit_id"][
+        "2023"
+    ] = 7
+    first["households"]["your household"]["state_name"]["2023"] = "CA"
+
+    second = generate_household(dict(sample_taxsim_input_for_joint, year=2022))
+
+    assert get_household_shape(True, 2) is get_household_shape(True, 2)
+    assert "someone" not in second["tax_units"]["your tax unit"]["members"]
+    assert second["marital_units"]["your first dependent's marital unit"][
+        "marital_unit_id"
+    ] == {"2022": 1}
+    assert second["households"]["your household"]["state_name"] == {"2022": "TX"}
+
+
 def test_roundtrip(sample_taxsim_input):
     # Import TAXSIM input to PolicyEngine situation
     pe_situation = generate_household(sample_taxsim_input)
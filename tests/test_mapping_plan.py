@@ -0,0 +1,130 @@
+import dataclasses
+
+import pytest
+
+from policyengine_taxsim.core.mapping_plan import (
+    get_mapping_plan,
+    parse_columns,
+    resolve_variable,
+)
+
+
+@pytest.fixture
+def plan():
+    return get_mapping_plan()
+
+
+def test_plan_is_compiled_once(plan):
+    assert get_mapping_plan() is plan
+
+
+def test_plan_is_immutable(plan):
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        plan.columns = ()
+
+
+def test_standard_output_columns(plan):
+    assert [column.name for column in plan.columns_by_idtl[0]] == [
+        "taxsimid",
+        "year",
+        "state",
+        "fiitax",
+        "siitax",
+        "fica",
+        "frate",
+        "srate",
+        "ficar",
+        "tfica",
+    ]
+
+
+def test_multiple_variables_resolved(plan):
+    fica = next(column for column in plan.columns if column.name == "fica")
+    assert fica.variables == (
+        "employee_social_security_tax",
+        "employee_medicare_tax",
+        "additional_medicare_tax",
+    )
+
+
+def test_resolve_variable_special_cases(plan):
+    v32 = next(column for column in plan.columns if column.name == "v32")
+    assert resolve_variable(v32, "IL") == "il_base_income"
+    assert resolve_variable(v32, "MN") == "mn_agi"
+    assert resolve_variable(v32, "AZ") == "az_agi"
+
+
+def test_input_routes(plan):
+    assert plan.use_tax_states == frozenset({"pa", "nc", "ca", "il", "in", "ok"})
+    assert ("tax_unit_childcare_expenses", ("childcare",)) in plan.tax_unit_routes
+    assert ("your partner", "self_employment_income", ("ssemp",)) in plan.person_routes
+    assert ("you", "capital_gains", ("ltcg", "stcg")) in plan.person_routes
+
+
+def test_state_variable_table(plan):
+    assert len(plan.state_variables) == 51
+    assert plan.state_variables["IL"]["v32"] == "il_base_income"
+    assert plan.state_variables["CA"]["siitax"] == "ca_income_tax"
+    assert plan.state_variables["MN"]["v25"] == "eitc"
+
+
+def test_state_output_variables(plan):
+    assert plan.output_variables[("CA", 0)] == (
+        "income_tax",
+        "ca_income_tax",
+        "employee_social_security_tax",
+        "employee_medicare_tax",
+        "additional_medicare_tax",
+        "taxsim_tfica",
+    )
+
+
+def test_marginal_rate_columns(plan):
+    columns = {column.name: column for column in plan.columns}
+
+    assert columns["frate"].marginal_rate
+    assert plan.state_variable(columns["srate"], "CA") == "ca_income_tax"
+    assert not columns["fiitax"].marginal_rate
+
+
+def test_multiple_variable_columns_honour_idtl(plan):
+    standard = [column.name for column in plan.columns_by_idtl[0]]
+    full = [column.name for column in plan.columns_by_idtl[2]]
+
+    assert "fica" in standard
+    assert "v44" not in standard
+    assert {"v28", "v40", "v44"} <= set(full)
+
+
+def test_select_columns(plan):
+    selected = plan.select_columns(2, ("v10", "fiitax", "srate"))
+
+    assert [column.name for column in selected] == [
+        "taxsimid",
+        "year",
+        "state",
+        "fiitax",
+        "srate",
+        "v10",
+    ]
+    assert plan.select_columns(0) == plan.columns_by_idtl[0]
+    assert [column.name for column in plan.select_columns(0, ("v10",))] == [
+        "taxsimid",
+        "year",
+        "state",
+    ]
+
+
+def test_needs_marginal_rates(plan):
+    assert plan.needs_marginal_rates(0)
+    assert plan.needs_marginal_rates(0, ("fiitax", "frate"))
+    assert not plan.needs_marginal_rates(2, ("fiitax", "siitax", "v10"))
+    assert plan.needs_marginal_rates(5, ("fiitax",))
+
+
+def test_parse_columns():
+    assert parse_columns(" fiitax, siitax,v10,fiitax ") == ("fiitax", "siitax", "v10")
+    with pytest.raises(ValueError, match="v999"):
+        parse_columns("fiitax,v999")
+    with pytest.raises(ValueError):
+        parse_columns(" , ")
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from policyengine_taxsim.core.output_format import (
+    format_csv_rows,
+    format_rows_with_pandas,
+)
+
+GOLDEN_DIR = Path(__file__).parent / "golden"
+
+
+def make_rows(count, seed=0):
+    """Output rows shaped like idtl 2 results, with the value types they carry."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for taxsimid in range(1, count + 1):
+        row = {"taxsimid": taxsimid, "year": 2023, "state": int(rng.integers(1, 52))}
+        for column in ("fiitax", "siitax", "fica", "v10", "v18", "v26"):
+            value = rng.normal(0, 10 ** rng.integers(0, 7))
+            row[column] = round(np.float32(value), 2)
+        # Marginal rates are python floats, failed calculations are 0.00
+        row["frate"] = round(float(rng.uniform(-50, 50)), 2)
+        row["v25"] = 0.00 if taxsimid % 3 else round(np.float32(-0.04), 2)
+        row["v40"] = round(float(rng.integers(0, 3)) * 0.05, 2)
+        rows.append(row)
+    return rows
+
+
+def test_matches_golden_output():
+    expected = (GOLDEN_DIR / "idtl_2_output.csv").read_text()
+
+    assert format_csv_rows(make_rows(200)) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_pandas_round_trip(seed):
+    rows = make_rows(500, seed)
+
+    assert format_csv_rows(rows) == format_rows_with_pandas(rows)
+    assert format_csv_rows(rows, header=False) == format_rows_with_pandas(
+        rows, header=False
+    )
+
+
+def test_missing_and_special_values():
+    rows = [
+        {"taxsimid": 1, "fiitax": np.float32(1.25), "v10": float("inf")},
+        {"taxsimid": 2, "fiitax": float("nan")},
+        {"taxsimid": 3.0, "fiitax": -0.04, "v10": 7},
+    ]
+
+    assert format_csv_rows(rows) == format_rows_with_pandas(rows)
+    assert format_csv_rows(rows) == (
+        "taxsimid,fiitax,v10\n1.0,1.2,inf\n2.0,,\n3.0,-0.0,7.0\n"
+    )
+
+
+def test_rounding_of_halves_and_large_values():
+    values = [0.05, 0.25, 0.35, 0.45, 1.45, 2.675, -0.25, -0.35, 1234.55]
+    values += [1e15 + 0.25, 3e17]
+    values += list(np.arange(-5, 5, 0.05))
+    rows = [{"v10": value, "v11": np.float32(value)} for value in values]
+
+    assert format_csv_rows(rows) == format_rows_with_pandas(rows)
+
+
+def test_non_numeric_columns_fall_back_to_pandas():
+    rows = [{"taxsimid": 1, "note": "a"}, {"taxsimid": 2, "note": 3.5}]
+
+    assert format_csv_rows(rows) == format_rows_with_pandas(rows)
+
+
+def test_no_rows():
+    assert format_csv_rows([]) == ""
@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+
+from click.testing import CliRunner
+
+from policyengine_taxsim.cli import main
+from policyengine_taxsim.core.profiling import StageProfiler, profiler
+
+
+def test_disabled_profiler_records_nothing():
+    stage_profiler = StageProfiler()
+
+    with stage_profiler.stage("calculate", "income_tax"):
+        pass
+
+    assert stage_profiler.stages == {}
+
+
+def test_nested_stages_report_self_time():
+    stage_profiler = StageProfiler()
+    stage_profiler.start()
+
+    with stage_profiler.stage("output_mapping"):
+        time.sleep(0.02)
+        with stage_profiler.stage("calculate", "income_tax"):
+            time.sleep(0.05)
+    with stage_profiler.stage("calculate", "income_tax"):
+        pass
+
+    report = stage_profiler.report()
+    calculate = report["stages"]["calculate"]
+    output_mapping = report["stages"]["output_mapping"]
+    assert calculate["calls"] == 2
+    assert output_mapping["seconds"] >= 0.07
+    assert 0.02 <= output_mapping["self_seconds"] < 0.05
+    assert list(report["stages"]) == ["calculate", "output_mapping"]
+    assert report["details"]["calculate"]["income_tax"]["calls"] == 2
+
+
+def test_merge_adds_worker_profiles():
+    worker = StageProfiler()
+    worker.start()
+    with worker.stage("calculate", "state_income_tax"):
+        pass
+
+    stage_profiler = StageProfiler()
+    stage_profiler.start()
+    stage_profiler.merge(worker.snapshot())
+    stage_profiler.merge(worker.snapshot())
+
+    assert stage_profiler.stages["calculate"]["calls"] == 2
+    assert stage_profiler.details["calculate"]["state_income_tax"]["calls"] == 2
+
+
+def test_threads_nest_their_own_stages():
+    stage_profiler = StageProfiler()
+    stage_profiler.start()
+    barrier = threading.Barrier(4)
+
+    def work():
+        with stage_profiler.stage("output_mapping"):
+            barrier.wait()
+            for _ in range(100):
+                with stage_profiler.stage("calculate", "income_tax"):
+                    time.sleep(0.001)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stages = stage_profiler.stages
+    assert stages["output_mapping"]["calls"] == 4
+    assert stages["calculate"]["calls"] == 400
+    assert stage_profiler.details["calculate"]["income_tax"]["calls"] == 400
+    # No calculate call is charged with the stages of another thread
+    assert stages["calculate"]["self_seconds"] == stages["calculate"]["seconds"]
+
+
+def test_cli_profile_report(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("taxsimid,year,state,pwages,idtl\n1,2023,5,50000,0\n2,2023,5,1,5\n")
+    report_file = tmp_path / "profile.json"
+    cprofile_file = tmp_path / "run.prof"
+
+    result = CliRunner().invoke(
+        main,
+        [
+            str(input_file),
+            "--profile",
+            "--profile-json",
+            str(report_file),
+            "--cprofile",
+            str(cprofile_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "simulation_construction" in result.stderr
+    report = json.loads(report_file.read_text())
+    assert {
+        "read_csv",
+        "map_households",
+        "simulation_construction",
+        "calculate",
+        "output_mapping",
+        "text_rendering",
+        "format_rows",
+    } <= set(report["stages"])
+    assert "CA:income_tax" in report["details"]["calculate"]
+    assert report["column_costs"]["CA"]["fiitax"]["calls"] >= 1
+    assert cprofile_file.stat().st_size > 0
+    assert not profiler.enabled
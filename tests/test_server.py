@@ -0,0 +1,92 @@
+from io import StringIO
+
+import pytest
+from click.testing import CliRunner
+
+from policyengine_taxsim.cli import main
+from policyengine_taxsim.core.server import read_micro_batches, serve_stream
+
+HEADER = "taxsimid,year,state,pwages,idtl"
+
+
+def test_micro_batches_end_on_blank_line_and_size():
+    stream = StringIO(
+        f"{HEADER}\n1,2023,5,50000,0\n\n2,2023,5,60000,0\n3,2023,5,70000,0\n4,2023,5,0,0\n"
+    )
+
+    batches = list(read_micro_batches(stream, max_records=2))
+
+    assert batches == [
+        f"{HEADER}\n1,2023,5,50000,0\n",
+        f"{HEADER}\n2,2023,5,60000,0\n3,2023,5,70000,0\n",
+        f"{HEADER}\n4,2023,5,0,0\n",
+    ]
+
+
+def test_micro_batches_follow_new_header():
+    stream = StringIO(f"{HEADER}\n1,2023,5,50000,0\ntaxsimid,year\n2,2021\n")
+
+    batches = list(read_micro_batches(stream, max_records=10))
+
+    assert batches == [f"{HEADER}\n1,2023,5,50000,0\n", "taxsimid,year\n2,2021\n"]
+
+
+def test_malformed_record_fails_its_batch_and_keeps_the_header():
+    stream = StringIO(f"{HEADER}\n1,2023,5,50000,0\n,2023,5,60000,0\n\n3,2023,5,0,0\n")
+
+    first, second = read_micro_batches(stream, max_records=10)
+
+    assert isinstance(first, ValueError)
+    assert ",2023,5,60000,0" in str(first)
+    assert second == f"{HEADER}\n3,2023,5,0,0\n"
+
+
+def test_micro_batches_need_header():
+    with pytest.raises(ValueError):
+        list(read_micro_batches(StringIO("1,2023,5\n"), max_records=10))
+
+
+def test_serve_stream_frames_every_answer():
+    output = StringIO()
+
+    def process_batch(csv_text):
+        if "fail" in csv_text:
+            raise ValueError("bad record")
+        return f"{csv_text.count(chr(10)) - 1} records\n"
+
+    batches = serve_stream(
+        StringIO(f"{HEADER}\n1,2,3\n\n2,fail\n"), output, process_batch, 10, "END"
+    )
+
+    assert batches == 2
+    assert output.getvalue() == "1 records\nEND\nEND\n"
+
+
+def test_serve_stream_answers_invalid_batches(capsys):
+    output = StringIO()
+
+    batches = serve_stream(
+        StringIO(f"{HEADER}\nabc,2023,5,1,0\n\n2,2023,5,1,0\n"),
+        output,
+        lambda csv_text: "answer\n",
+        10,
+        "END",
+    )
+
+    assert batches == 2
+    assert output.getvalue() == "END\nanswer\nEND\n"
+    assert "abc,2023,5,1,0" in capsys.readouterr().err
+
+
+def test_serve_matches_file_run(tmp_path):
+    csv_text = f"{HEADER}\n1,2023,5,50000,0\n2,2021,3,40000,2\n"
+    input_file = tmp_path / "input.csv"
+    input_file.write_text(csv_text)
+    runner = CliRunner()
+
+    file_run = runner.invoke(main, [str(input_file), "--no-dedupe"])
+    served = runner.invoke(main, ["serve", "--no-dedupe"], input=csv_text)
+
+    assert file_run.exit_code == 0
+    assert served.exit_code == 0
+    assert served.stdout == f"{file_run.stdout}%%END\n"
@@ -0,0 +1,181 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+from policyengine_taxsim.cli import format_output
+from policyengine_taxsim.core.parallel import run_records_parallel
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.service import (
+    RequestCoalescer,
+    check_records,
+    create_server,
+)
+
+
+def echo_records(taxsim_inputs):
+    return taxsim_inputs, [{"taxsimid": each["taxsimid"]} for each in taxsim_inputs]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+@pytest.fixture
+def running_server():
+    servers = []
+
+    def start(process_records, socket_path=None):
+        coalescer = RequestCoalescer(process_records, 0.05, 1000)
+        server = create_server(coalescer, format_output, port=0, socket_path=socket_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, coalescer))
+        return server
+
+    yield start
+
+    for server, coalescer in servers:
+        server.shutdown()
+        server.server_close()
+        coalescer.close()
+
+
+def test_coalescer_combines_concurrent_requests():
+    calls = []
+
+    def process_records(taxsim_inputs):
+        calls.append(len(taxsim_inputs))
+        return echo_records(taxsim_inputs)
+
+    coalescer = RequestCoalescer(process_records, 0.2, 1000)
+    futures = [coalescer.submit([{"taxsimid": i}, {"taxsimid": -i}]) for i in range(5)]
+    results = [future.result() for future in futures]
+    coalescer.close()
+
+    assert calls == [10]
+    assert [outputs for _, outputs in results][2] == [{"taxsimid": 2}, {"taxsimid": -2}]
+    assert coalescer.summary() == "Coalescing: 5 requests in 1 evaluations"
+
+
+def test_coalescer_closes_batch_at_max_records():
+    calls = []
+
+    def process_records(taxsim_inputs):
+        calls.append(len(taxsim_inputs))
+        return echo_records(taxsim_inputs)
+
+    coalescer = RequestCoalescer(process_records, 10, 2)
+    futures = [coalescer.submit([{"taxsimid": i}]) for i in range(4)]
+    [future.result(timeout=5) for future in futures]
+    coalescer.close()
+
+    assert calls == [2, 2]
+
+
+def test_coalescer_reports_errors_to_every_request():
+    def process_records(taxsim_inputs):
+        raise ValueError("bad record")
+
+    coalescer = RequestCoalescer(process_records, 0.05, 1000)
+    futures = [coalescer.submit([{"taxsimid": i}]) for i in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+    coalescer.close()
+
+
+def test_bad_request_does_not_fail_coalesced_requests():
+    def process_records(taxsim_inputs):
+        return run_records_parallel(taxsim_inputs, RunConfig())
+
+    coalescer = RequestCoalescer(process_records, 0.2, 1000)
+    good = coalescer.submit(
+        [{"taxsimid": 1, "year": 2023, "state": 5, "pwages": 50000, "idtl": 0}]
+    )
+    bad = coalescer.submit([{"taxsimid": 2, "state": 5, "pwages": 50000, "idtl": 0}])
+
+    _, outputs = good.result(timeout=600)
+    with pytest.raises(KeyError):
+        bad.result(timeout=600)
+    coalescer.close()
+
+    assert outputs[0]["taxsimid"] == 1
+    assert outputs[0]["fiitax"] > 0
+
+
+def test_invalid_requests_are_rejected_before_merging():
+    calls = []
+
+    def process_records(taxsim_inputs):
+        calls.append(len(taxsim_inputs))
+        return echo_records(taxsim_inputs)
+
+    coalescer = RequestCoalescer(process_records, 0.2, 1000, check_records)
+    good = coalescer.submit([{"taxsimid": 1, "year": 2023}, {"taxsimid": 2, "year": 2023}])
+    no_year = coalescer.submit([{"taxsimid": 3}])
+    text = coalescer.submit([{"taxsimid": 4, "year": 2023, "pwages": "lots"}])
+
+    assert good.result(timeout=5)[1] == [{"taxsimid": 1}, {"taxsimid": 2}]
+    with pytest.raises(ValueError, match="no year"):
+        no_year.result(timeout=5)
+    with pytest.raises(ValueError, match="non-numeric pwages"):
+        text.result(timeout=5)
+    coalescer.close()
+
+    assert calls == [2]
+
+
+def test_unix_socket_json_request(running_server, tmp_path):
+    socket_path = str(tmp_path / "taxsim.sock")
+    running_server(echo_records, socket_path)
+
+    connection = UnixHTTPConnection(socket_path)
+    connection.request(
+        "POST", "/", json.dumps([{"taxsimid": 7}]), {"Content-Type": "application/json"}
+    )
+    response = connection.getresponse()
+
+    assert response.status == 200
+    assert json.loads(response.read()) == [{"taxsimid": 7}]
+
+
+def test_http_rejects_bad_json(running_server):
+    server = running_server(echo_records)
+
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    connection.request("POST", "/", "[1, 2]", {"Content-Type": "application/json"})
+
+    assert connection.getresponse().status == 400
+
+
+def test_http_json_and_csv_results(running_server):
+    def process_records(taxsim_inputs):
+        return run_records_parallel(taxsim_inputs, RunConfig())
+
+    server = running_server(process_records)
+    record = {"taxsimid": 1, "year": 2023, "state": 5, "pwages": 50000, "idtl": 0}
+
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    connection.request("POST", "/", json.dumps(record), {"Content-Type": "application/json"})
+    json_result = json.loads(connection.getresponse().read())
+
+    connection.request(
+        "POST",
+        "/",
+        "taxsimid,year,state,pwages,idtl\n1,2023,5,50000,0\n",
+        {"Content-Type": "text/csv"},
+    )
+    csv_result = connection.getresponse().read().decode()
+
+    assert json_result[0]["taxsimid"] == 1
+    assert json_result[0]["fiitax"] > 0
+    assert csv_result.startswith("taxsimid,year,state,fiitax")
+    assert f"{json_result[0]['fiitax']:.1f}" in csv_result
@@ -0,0 +1,80 @@
+import pytest
+
+from policyengine_taxsim import generate_household, export_household
+from policyengine_taxsim.core.batch import run_records
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.simulation import BatchSimulation, perturb_earnings
+
+
+@pytest.fixture
+def joint_taxsim_input():
+    return {
+        "year": 2023,
+        "state": 5,
+        "pwages": 60000,
+        "swages": 20000,
+        "taxsimid": 1,
+        "idtl": 2,
+        "mstat": 2,
+    }
+
+
+def test_perturb_earnings_splits_delta_by_earnings(joint_taxsim_input):
+    situation = generate_household(joint_taxsim_input)
+
+    perturbed = perturb_earnings(situation, 4)
+
+    assert perturbed["people"]["you"]["employment_income"]["2023"] == 60003
+    assert perturbed["people"]["your partner"]["employment_income"]["2023"] == 20001
+    assert situation["people"]["you"]["employment_income"]["2023"] == 60000
+
+
+def test_perturb_earnings_without_earnings_goes_to_taxpayer():
+    situation = generate_household({"year": 2023, "state": 5, "taxsimid": 1})
+
+    perturbed = perturb_earnings(situation, 1)
+
+    assert perturbed["people"]["you"]["employment_income"]["2023"] == 1
+
+
+def test_batch_simulation_adds_perturbed_households(joint_taxsim_input):
+    situation = generate_household(joint_taxsim_input)
+
+    batch = BatchSimulation([situation], "2023", marginal_rate_delta=100)
+    base = batch.record(0).calculate("employment_income", "2023")
+    perturbed = batch.perturbed_record(0).calculate("employment_income", "2023")
+
+    assert len(batch.simulation.situation_input["tax_units"]) == 2
+    assert perturbed[0] - base[0] == pytest.approx(75)
+    assert BatchSimulation([situation], "2023").perturbed_record(0) is None
+
+
+def test_marginal_rates(joint_taxsim_input):
+    situation = generate_household(joint_taxsim_input)
+
+    result = export_household(
+        joint_taxsim_input, situation, config=RunConfig(marginal_rate_delta=100)
+    )
+
+    assert 10 <= result["frate"] <= 25
+    assert 0 < result["srate"] < 10
+    assert result["ficar"] >= 7.65
+
+
+@pytest.mark.parametrize("pwages", [1_000_000, 5_000_100])
+def test_default_marginal_rates_at_high_wages(pwages):
+    # A Texas single filer pays the 37% top bracket, and 1.45% Medicare plus
+    # the 0.9% Additional Medicare Tax on wages
+    taxsim_input = {
+        "taxsimid": 1,
+        "year": 2023,
+        "state": 44,
+        "mstat": 1,
+        "pwages": pwages,
+        "idtl": 0,
+    }
+
+    (result,) = run_records([taxsim_input], RunConfig())
+
+    assert result["frate"] == pytest.approx(37.0, abs=0.02)
+    assert result["ficar"] == pytest.approx(2.35, abs=0.02)
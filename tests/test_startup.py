@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+# The wall-clock startup budget is checked by benchmarks/startup.py, not here,
+# since timings are unreliable on loaded CI runners
+HEAVY_MODULES = ["pandas", "policyengine_us", "policyengine_tests_generator"]
+
+
+def loaded_heavy_modules(code):
+    """Heavy modules in sys.modules after running code in a fresh interpreter."""
+    code = f"{code}\nimport sys\nprint([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_cli_import_does_not_load_heavy_modules():
+    assert loaded_heavy_modules("import policyengine_taxsim.cli") == "[]"
+
+
+def test_cli_help_does_not_load_heavy_modules():
+    code = (
+        "from policyengine_taxsim.cli import main\n"
+        "try:\n"
+        "    main(['run', '--help'])\n"
+        "except SystemExit:\n"
+        "    pass"
+    )
+    assert loaded_heavy_modules(code) == "[]"
+
+
+def test_executable_runs_the_cli():
+    from policyengine_taxsim.cli import main
+    from policyengine_taxsim.exe import main as exe_main
+
+    assert exe_main is main
+    assert loaded_heavy_modules("import policyengine_taxsim.exe") == "[]"
@@ -0,0 +1,143 @@
+import os
+import signal
+from io import StringIO
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from policyengine_taxsim.cli import main, simulation_options
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.yaml_logs import LogSettings
+from policyengine_taxsim.core.streaming import (
+    TaxsimOutputWriter,
+    exit_on_sigterm,
+    open_output_writer,
+    read_input_chunks,
+)
+
+
+def test_read_input_chunks(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("taxsimid,year\n1,2023\n2,2023\n3,2023\n")
+
+    chunks = list(read_input_chunks(input_file, chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(chunks[1]["taxsimid"]) == [3]
+
+
+def test_writer_sections_in_order():
+    output = StringIO()
+    writer = TaxsimOutputWriter(output)
+
+    writer.write(
+        [{"idtl": 2}, {"idtl": 0}, {"idtl": 5}],
+        [{"taxsimid": 1, "v10": 5}, {"taxsimid": 2}, "text 3\n"],
+    )
+    first_chunk = output.getvalue()
+    writer.write(
+        [{"idtl": 0}, {"idtl": 5}, {"idtl": 2}],
+        [{"taxsimid": 4}, "text 5\n", {"taxsimid": 6, "v10": 7}],
+    )
+    writer.close()
+
+    # idtl 0 rows are written as soon as their chunk is done
+    assert first_chunk == "taxsimid\n2\n"
+    assert output.getvalue() == (
+        "taxsimid\n2\n4\n" "\ntaxsimid,v10\n1,5\n6,7\n" "\ntext 3\ntext 5\n"
+    )
+
+
+def test_writer_close_after_failure_keeps_completed_chunks():
+    output = StringIO()
+    writer = TaxsimOutputWriter(output)
+
+    try:
+        writer.write([{"idtl": 2}], [{"taxsimid": 1}])
+        raise RuntimeError("worker died")
+    except RuntimeError:
+        pass
+    finally:
+        writer.close()
+    writer.close()
+
+    assert output.getvalue() == "\ntaxsimid\n1\n"
+
+
+def test_output_file_sections_are_spooled_next_to_it(tmp_path):
+    output_file = tmp_path / "output.txt"
+    writer = open_output_writer(str(output_file))
+
+    writer.write(
+        [{"idtl": 2}, {"idtl": 0}, {"idtl": 5}],
+        [{"taxsimid": 1, "v10": 5}, {"taxsimid": 2}, "text 3\n"],
+    )
+
+    # A run killed now keeps the completed chunks of every section on disk
+    assert output_file.read_text() == "taxsimid\n2\n"
+    assert (tmp_path / "output.txt.idtl2.part").read_text() == "taxsimid,v10\n1,5\n"
+    assert (tmp_path / "output.txt.idtl5.part").read_text() == "text 3\n"
+
+    writer.close()
+    assert output_file.read_text() == "taxsimid\n2\n\ntaxsimid,v10\n1,5\n\ntext 3\n\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["output.txt"]
+
+
+def test_sigterm_unwinds_and_closes_the_writer():
+    output = StringIO()
+    writer = TaxsimOutputWriter(output)
+
+    with pytest.raises(SystemExit) as exit_info:
+        with exit_on_sigterm():
+            try:
+                writer.write([{"idtl": 2}], [{"taxsimid": 1}])
+                os.kill(os.getpid(), signal.SIGTERM)
+            finally:
+                writer.close()
+
+    assert exit_info.value.code == 128 + signal.SIGTERM
+    assert output.getvalue() == "\ntaxsimid\n1\n"
+    assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+
+
+def test_cli_writes_output_file_in_chunks(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text(
+        "taxsimid,year,state,pwages,idtl\n"
+        "1,2023,5,50000,2\n2,2023,5,30000,0\n3,2023,5,40000,0\n"
+    )
+    output_file = tmp_path / "output.txt"
+
+    chunked = CliRunner().invoke(
+        main, [str(input_file), "--chunk-size", "1", "-o", str(output_file)]
+    )
+    whole = CliRunner().invoke(main, [str(input_file)])
+
+    assert chunked.exit_code == 0
+    assert whole.exit_code == 0
+    assert output_file.read_text() == whole.stdout
+    assert output_file.read_text().startswith("taxsimid,year,state,fiitax")
+
+
+def test_simulation_options_build_one_run_config():
+    received = {}
+
+    @click.command()
+    @simulation_options
+    def command(config, cache_dir, cache_size, dedupe):
+        received.update(config=config, dedupe=dedupe)
+
+    result = CliRunner().invoke(
+        command,
+        ["--disable-salt", "--jobs", "3", "--columns", "fiitax", "--logs-sample", "0.5"],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert received["dedupe"] is True
+    assert received["config"] == RunConfig(
+        disable_salt=True,
+        columns=("fiitax",),
+        log_settings=LogSettings(sample=0.5),
+        jobs=3,
+    )
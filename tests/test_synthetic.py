@@ -0,0 +1,43 @@
+from policyengine_taxsim import generate_household
+from synthetic import (
+    generate_synthetic_inputs,
+    get_income_fields,
+    MSTAT_VALUES,
+)
+from policyengine_taxsim.core.utils import STATE_MAPPING
+
+
+def test_synthetic_inputs_cover_every_category():
+    df = generate_synthetic_inputs(400, seed=3, max_dependents=3)
+
+    assert len(df) == 400
+    assert df["taxsimid"].is_unique
+    assert set(df["state"]) == set(STATE_MAPPING)
+    assert set(df["mstat"]) == set(MSTAT_VALUES)
+    assert set(df["depx"]) == {0, 1, 2, 3}
+    assert set(df["idtl"]) == {0, 2, 5}
+    assert {"intrec", "psemp", "ssemp", "ltcg", "childcare"} <= set(get_income_fields())
+    assert (df[get_income_fields()] > 0).any().all()
+
+
+def test_synthetic_inputs_are_consistent():
+    df = generate_synthetic_inputs(200, seed=4, max_dependents=2)
+
+    assert (df.loc[df["mstat"] != 2, ["sage", "swages", "ssemp"]] == 0).all().all()
+    assert (df.loc[df["depx"] < 2, "age2"] == 0).all()
+    assert (df.loc[df["depx"] == 0, "childcare"] == 0).all()
+
+
+def test_synthetic_inputs_are_reproducible():
+    assert generate_synthetic_inputs(50, seed=1).equals(generate_synthetic_inputs(50, seed=1))
+    assert not generate_synthetic_inputs(50, seed=1).equals(
+        generate_synthetic_inputs(50, seed=2)
+    )
+
+
+def test_synthetic_inputs_map_to_households():
+    df = generate_synthetic_inputs(60, seed=5)
+
+    for _, row in df.iterrows():
+        situation = generate_household(row.to_dict())
+        assert situation["people"]["you"]["employment_income"]
@@ -0,0 +1,166 @@
+import json
+import threading
+import zipfile
+from functools import partial
+
+import pytest
+
+from policyengine_taxsim.core import yaml_logs
+from policyengine_taxsim.core.batch import run_records
+from policyengine_taxsim.core.run_config import RunConfig
+from policyengine_taxsim.core.yaml_logs import (
+    LogSettings,
+    YamlLogWriter,
+    is_sampled,
+    open_yaml_logs,
+)
+
+
+class FakeGenerator:
+    """Renders a test log without policyengine_tests_generator."""
+
+    def __init__(self, release=None):
+        self.release = release
+
+    def generate_yaml(self, household_data, name, pe_outputs):
+        if self.release is not None:
+            self.release.wait()
+        if name == "broken.yaml":
+            raise ValueError("cannot render")
+        return {"name": name, "outputs": pe_outputs}
+
+    def _get_yaml(self, yaml_data):
+        return f"- name: {yaml_data['name']}\n  outputs: {yaml_data['outputs']}\n"
+
+
+def submit_logs(writer, count):
+    for taxsimid in range(count):
+        writer.submit(
+            {"people": {}},
+            [{"variable": "income_tax", "value": taxsimid}],
+            f"{taxsimid}-NY.yaml",
+        )
+
+
+def test_yaml_format_writes_a_file_per_record(tmp_path):
+    writer = YamlLogWriter(tmp_path / "logs", generator=FakeGenerator())
+    submit_logs(writer, 3)
+    writer.close()
+
+    assert sorted(path.name for path in (tmp_path / "logs").iterdir()) == [
+        "0-NY.yaml",
+        "1-NY.yaml",
+        "2-NY.yaml",
+    ]
+    assert "value': 2" in (tmp_path / "logs" / "2-NY.yaml").read_text()
+    assert writer.written == 3
+
+
+def test_jsonl_bundle_is_appended_across_writers(tmp_path):
+    for _ in range(2):
+        writer = YamlLogWriter(tmp_path, "jsonl", generator=FakeGenerator())
+        submit_logs(writer, 2)
+        writer.close()
+
+    lines = writer.bundle_path.read_text().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == [
+        "0-NY.yaml",
+        "1-NY.yaml",
+        "0-NY.yaml",
+        "1-NY.yaml",
+    ]
+    assert list(tmp_path.iterdir()) == [writer.bundle_path]
+
+
+def test_zip_bundle(tmp_path):
+    writer = YamlLogWriter(tmp_path, "zip", generator=FakeGenerator())
+    submit_logs(writer, 3)
+    writer.close()
+
+    with zipfile.ZipFile(writer.bundle_path) as archive:
+        assert archive.namelist() == ["0-NY.yaml", "1-NY.yaml", "2-NY.yaml"]
+        assert archive.read("1-NY.yaml").decode().startswith("- name: 1-NY.yaml")
+
+
+def test_submit_does_not_wait_for_the_writer(tmp_path):
+    release = threading.Event()
+    writer = YamlLogWriter(
+        tmp_path, queue_size=2, generator=FakeGenerator(release=release)
+    )
+    submit_logs(writer, 2)
+    assert writer.written == 0
+
+    release.set()
+    writer.close()
+    assert writer.written == 2
+
+
+def test_writer_errors_are_raised_on_close(tmp_path):
+    writer = YamlLogWriter(tmp_path, generator=FakeGenerator())
+    writer.submit({}, [], "broken.yaml")
+    submit_logs(writer, 2)
+
+    with pytest.raises(RuntimeError, match="PE YAML test logs") as error:
+        writer.close()
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_unknown_log_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Unknown log format"):
+        YamlLogWriter(tmp_path, "xml", generator=FakeGenerator())
+
+
+def test_open_yaml_logs_shares_a_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        yaml_logs, "YamlLogWriter", partial(YamlLogWriter, generator=FakeGenerator())
+    )
+    settings = LogSettings(directory=str(tmp_path), log_format="jsonl")
+
+    with open_yaml_logs(settings) as outer:
+        with open_yaml_logs(settings) as inner:
+            assert inner is outer
+        submit_logs(outer, 1)
+    with open_yaml_logs(settings) as writer:
+        assert writer is not outer
+
+
+def test_sampling_is_deterministic():
+    taxsimids = range(10_000)
+    sampled = [taxsimid for taxsimid in taxsimids if is_sampled(taxsimid, 0.1)]
+
+    assert 900 < len(sampled) < 1100
+    assert sampled == [taxsimid for taxsimid in taxsimids if is_sampled(taxsimid, 0.1)]
+    assert all(is_sampled(taxsimid, 1) for taxsimid in taxsimids)
+    assert not any(is_sampled(taxsimid, 0) for taxsimid in taxsimids)
+
+
+def test_sampled_logs_keep_the_outputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        yaml_logs, "YamlLogWriter", partial(YamlLogWriter, generator=FakeGenerator())
+    )
+    taxsim_inputs = [
+        {
+            "year": 2023,
+            "state": 5,
+            "pwages": 20000 + 5000 * taxsimid,
+            "taxsimid": taxsimid,
+            "idtl": taxsimid % 3 * 2 % 4,
+        }
+        for taxsimid in range(1, 9)
+    ]
+    settings = LogSettings(0.5, str(tmp_path), "jsonl")
+    logged = [
+        each["taxsimid"] for each in taxsim_inputs if is_sampled(each["taxsimid"], 0.5)
+    ]
+    assert 0 < len(logged) < len(taxsim_inputs)
+
+    expected = run_records([dict(each) for each in taxsim_inputs], RunConfig())
+    result = run_records(
+        [dict(each) for each in taxsim_inputs],
+        RunConfig(logs=True, log_settings=settings),
+    )
+
+    assert result == expected
+    (bundle,) = tmp_path.iterdir()
+    names = [json.loads(line)["name"] for line in bundle.read_text().splitlines()]
+    assert sorted(names) == sorted(f"{taxsimid}-CA.yaml" for taxsimid in logged)